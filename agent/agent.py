@@ -1,6 +1,7 @@
 from mm_user_proxy_agent import MultimodalUserProxyAgent
 from autogen.agentchat import Agent
 from typing import Dict, Optional, Union
+from spans import span
 
 class SketchpadUserAgent(MultimodalUserProxyAgent):
     
@@ -20,23 +21,16 @@ class SketchpadUserAgent(MultimodalUserProxyAgent):
     def sender_hits_max_reply(self, sender: Agent):
         return self._consecutive_auto_reply_counter[sender.name] >= self._max_consecutive_auto_reply
 
-    def receive(
-        self,
-        message: Union[Dict, str],
-        sender: Agent,
-        request_reply: Optional[bool] = None,
-        silent: Optional[bool] = False,
-    ):
-        """Receive a message from the sender agent.
-        Once a message is received, this function sends a reply to the sender or simply stop.
-        The reply can be generated automatically or entered manually by a human.
-        """
-        
+    def _handle_message(self, message: Union[Dict, str], sender: Agent, silent: Optional[bool]):
+        # the part of receive and a_receive before any await: record and parse the message.
+        # Returns (reply, code): the feedback to send if the message can't be parsed, or the code to
+        # execute. Both are None when the conversation stops here.
         print("COUNTER:", self._consecutive_auto_reply_counter[sender.name])
         self._process_received_message(message, sender, silent)
         
         # parsing the code component, if there is one
-        parsed_results = self.parser.parse(message)
+        with span("parse"):
+            parsed_results = self.parser.parse(message)
         parsed_content = parsed_results['content']
         parsed_status = parsed_results['status']
         parsed_error_message = parsed_results['message']
@@ -44,7 +38,7 @@ class SketchpadUserAgent(MultimodalUserProxyAgent):
         
         # if TERMINATION message, then return
         if not parsed_status and self._is_termination_msg(message):
-            return
+            return None, None
         
         # if parsing fails
         if not parsed_status:
@@ -52,38 +46,78 @@ class SketchpadUserAgent(MultimodalUserProxyAgent):
             # reset the consecutive_auto_reply_counter
             if self.sender_hits_max_reply(sender):
                 self._consecutive_auto_reply_counter[sender.name] = 0
-                return
+                return None, None
             
             # if parsing fails, construct a feedback message from the error code and message of the parser
             # send the feedback message, and request a reply
             self._consecutive_auto_reply_counter[sender.name] += 1
             reply = self.prompt_generator.get_parsing_feedback(parsed_error_message, parsed_error_code)
             self.feedback_types.append("parsing")
-            self.send(reply, sender, request_reply=True)
-            return
+            return reply, None
         
         # if parsing succeeds, then execute the code component
-        if self.executor:
-            # go to execution stage if there is an executor module
-            exit_code, output, file_paths = self.executor.execute(parsed_content)
-            reply = self.prompt_generator.get_exec_feedback(exit_code, output)
-            
-            # if execution fails
-            if exit_code != 0:
-                if self.sender_hits_max_reply(sender):
-                    # reset the consecutive_auto_reply_counter
-                    self._consecutive_auto_reply_counter[sender.name] = 0
-                    return
-                
-                self._consecutive_auto_reply_counter[sender.name] += 1
-                self.send(reply, sender, request_reply=True)
-                return
-                
+        return None, parsed_content
+    
+    def _handle_execution(self, sender: Agent, exit_code: int, output: str):
+        # the feedback to send on the result of the code, None when the conversation stops here
+        reply = self.prompt_generator.get_exec_feedback(exit_code, output)
+        
+        # if execution fails
+        if exit_code != 0:
+            if self.sender_hits_max_reply(sender):
+                # reset the consecutive_auto_reply_counter
+                self._consecutive_auto_reply_counter[sender.name] = 0
+                return None
+            self._consecutive_auto_reply_counter[sender.name] += 1
+        return reply
+    
+    def receive(
+        self,
+        message: Union[Dict, str],
+        sender: Agent,
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+    ):
+        """Receive a message from the sender agent.
+        Once a message is received, this function sends a reply to the sender or simply stop.
+        The reply can be generated automatically or entered manually by a human.
+        """
+        reply, code = self._handle_message(message, sender, silent)
+        succeeded = False
+        # go to execution stage if there is an executor module
+        if code is not None and self.executor:
+            exit_code, output, file_paths = self.executor.execute(code)
+            reply = self._handle_execution(sender, exit_code, output)
+            succeeded = exit_code == 0
+        
+        if reply is not None:
+            self.send(reply, sender, request_reply=True)
             # if execution succeeds
-            else:
-                self.send(reply, sender, request_reply=True)
+            if succeeded:
+                self._consecutive_auto_reply_counter[sender.name] = 0
+    
+    async def a_receive(
+        self,
+        message: Union[Dict, str],
+        sender: Agent,
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+    ):
+        """(async) Receive a message from the sender agent.
+        Same flow as `receive`, but the code execution and the next LLM call are awaited,
+        so one event loop can drive many conversations at the same time.
+        """
+        reply, code = self._handle_message(message, sender, silent)
+        succeeded = False
+        if code is not None and self.executor:
+            exit_code, output, file_paths = await self.executor.a_execute(code)
+            reply = self._handle_execution(sender, exit_code, output)
+            succeeded = exit_code == 0
+        
+        if reply is not None:
+            await self.a_send(reply, sender, request_reply=True)
+            if succeeded:
                 self._consecutive_auto_reply_counter[sender.name] = 0
-                return
     
     def generate_init_message(self, query, n_image):
         content = self.prompt_generator.initial_prompt(query, n_image)
@@ -96,4 +130,13 @@ class SketchpadUserAgent(MultimodalUserProxyAgent):
         if log_prompt_only:
             print(initial_message)
         else:
-            assistant.receive(initial_message, self, request_reply=True)
\ No newline at end of file
+            assistant.receive(initial_message, self, request_reply=True)
+
+    async def a_initiate_chat(self, assistant, message, n_image, task_id, log_prompt_only=False):
+        self.current_task_id = task_id
+        self.feedback_types = []
+        initial_message = self.generate_init_message(message, n_image)
+        if log_prompt_only:
+            print(initial_message)
+        else:
+            await assistant.a_receive(initial_message, self, request_reply=True)
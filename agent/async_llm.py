@@ -0,0 +1,78 @@
+import asyncio
+import random
+from typing import Dict, Optional
+
+try:
+    import openai
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+except (ImportError, AttributeError):
+    RETRYABLE_ERRORS = ()
+
+
+# one semaphore per (event loop, provider). asyncio primitives must not be shared across loops.
+_provider_semaphores: Dict[tuple, asyncio.Semaphore] = {}
+
+
+def provider_key(llm_config) -> str:
+    """Identify the provider of an llm_config: its base_url, or the api_type for the default endpoints."""
+    if not llm_config:
+        return "default"
+    config_list = llm_config.get("config_list") or [llm_config]
+    first = config_list[0] if config_list else {}
+    return first.get("base_url") or first.get("api_type") or "openai"
+
+
+def get_provider_semaphore(provider: str) -> asyncio.Semaphore:
+    from config import ASYNC_LLM_CONFIG
+
+    key = (id(asyncio.get_running_loop()), provider)
+    semaphore = _provider_semaphores.get(key)
+    if semaphore is None:
+        limit = ASYNC_LLM_CONFIG.get("provider_concurrency", {}).get(
+            provider, ASYNC_LLM_CONFIG.get("default_concurrency", 8))
+        semaphore = asyncio.Semaphore(limit)
+        _provider_semaphores[key] = semaphore
+    return semaphore
+
+
+def _retry_after(error) -> Optional[float]:
+    # honor the Retry-After header of 429 / 503 responses when the provider sends one
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def call_with_limits(provider: str, fn, *args, **kwargs):
+    """Run a blocking LLM call in a worker thread, holding the provider's concurrency slot,
+    and retry rate-limit / connection / 5xx errors with exponential backoff and full jitter."""
+    from config import ASYNC_LLM_CONFIG
+
+    max_retries = ASYNC_LLM_CONFIG.get("max_retries", 5)
+    backoff_base = ASYNC_LLM_CONFIG.get("backoff_base", 1.0)
+    backoff_max = ASYNC_LLM_CONFIG.get("backoff_max", 30.0)
+
+    attempt = 0
+    while True:
+        async with get_provider_semaphore(provider):
+            try:
+                return await asyncio.to_thread(fn, *args, **kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= max_retries:
+                    raise
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+                print(f"[ASYNC_LLM] {type(e).__name__} from {provider}, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+                attempt += 1
+        # sleep outside the semaphore so the slot goes to another conversation meanwhile
+        await asyncio.sleep(delay)
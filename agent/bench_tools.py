@@ -0,0 +1,420 @@
+"""Microbenchmark of the vision tool path against local stand-in expert servers.
+
+The stand-ins are gradio apps with the same endpoints as som_server.py, grounding_dino_server.py
+and depthanything_server.py (inputs, outputs, api names and response modes), served like the real
+servers with vision_experts/fast_api.py, so they also have the binary /v1/ routes. They answer after
+a fixed latency with synthetic payloads of a fixed size, so the time left is what the client spends:
+encoding, upload, the gradio or HTTP round trips, download, decoding and post-processing.
+`--protocol` picks the client protocol: "gradio", "http", or "both" to report each (the default).
+
+For every tool and image size the report gives the wall time of a call and splits it into
+    server:   time inside the stand-in handlers (the fixed latency plus building the payload)
+    upload:   encoding and uploading the image (the <tool>.upload spans)
+    protocol: the inference spans minus the server time (gradio queue and SSE, or the HTTP request)
+    download: fetching and decoding the outputs (the <tool>.download spans)
+    postprocess: the post-processors, when enabled with --postprocess
+    client:   everything but the server time
+
+The tool cache is off and images, payloads and seeds are fixed, so reports of different commits
+can be compared; the report records the git commit. Run from agent/:
+    python bench_tools.py --sizes 256 512 1024 --repeat 5 --output bench_tools.json
+    python bench_tools.py --compare bench_tools.json --output bench_tools_new.json
+    python bench_tools.py --protocol gradio --sizes 512
+"""
+import argparse
+import base64
+import functools
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+# set before the tools and the config are imported: no cache, the remote backend, spans on
+os.environ["VSP_TOOL_CACHE"] = "0"
+os.environ["VSP_TOOL_PREFETCH"] = "0"
+os.environ["VSP_TOOL_BACKEND"] = "remote"
+os.environ["VSP_SOM_BACKEND"] = "remote"
+os.environ["VSP_SPANS"] = "1"
+
+BENCH_TOOLS = ["segment_and_mark", "detection", "depth", "sliding_window_detection", "overlay_images"]
+PROTOCOLS = ["gradio", "http"]
+
+
+class StandInTimings:
+    """Time spent in the stand-in handlers, so it can be taken out of the client's time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = 0.0
+
+    def reset(self):
+        with self._lock:
+            self.seconds = 0.0
+
+    def timed(self, fn):
+        # functools.wraps keeps the signature, gradio names the API parameters after it
+        @functools.wraps(fn)
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.seconds += time.perf_counter() - start
+        return wrapper
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _annotate(image, n_boxes: int):
+    from PIL import ImageDraw
+
+    annotated = image.convert("RGB")
+    draw = ImageDraw.Draw(annotated)
+    w, h = annotated.size
+    for i in range(n_boxes):
+        x, y = (i * 37) % max(1, w - 20), (i * 53) % max(1, h - 20)
+        draw.rectangle([x, y, x + 20, y + 20], outline=(255, 0, 0), width=2)
+        draw.text((x + 2, y + 2), str(i + 1), fill=(255, 255, 255))
+    return annotated
+
+
+def _region_mask(w: int, h: int, i: int, n: int):
+    import numpy as np
+
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cols = max(1, int(n ** 0.5))
+    cell_w, cell_h = max(1, w // cols), max(1, h // cols)
+    x, y = (i % cols) * cell_w, (i // cols % cols) * cell_h
+    mask[y:y + cell_h, x:x + cell_w] = 255
+    return mask, [int(x), int(y), int(cell_w), int(cell_h)]
+
+
+def _som_regions(w: int, h: int, n: int, response_mode: str) -> List[Dict]:
+    # the payload of som_server._build_regions_from_mask, with rectangular masks
+    import numpy as np
+    from PIL import Image
+
+    regions = []
+    for i in range(n):
+        mask, bbox = _region_mask(w, h, i, n)
+        region = {"id": i + 1, "category": None, "score": None, "area": int((mask > 0).sum()), "bbox": bbox,
+                  "height": h, "width": w}
+        if response_mode == "rle":
+            pixels = (mask > 0).ravel(order="F")
+            changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+            counts = np.diff(np.concatenate([[0], changes, [pixels.size]])).tolist()
+            region["mask_rle"] = {"size": [h, w], "counts": ([0] + counts) if pixels[0] else counts}
+        elif response_mode != "bboxes":
+            buffer = io.BytesIO()
+            Image.fromarray(mask, "L").save(buffer, format="PNG")
+            region["mask_png_base64"] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        regions.append(region)
+    return regions
+
+
+def start_stand_ins(latency_ms: Dict[str, float], regions: int, boxes: int, timings: StandInTimings) -> Dict[str, str]:
+    """Launch the three stand-in servers in this process and return their addresses by tool name.
+    Each one serves its gradio API at / and its binary API at /v1/, like fast_api.serve does."""
+    import gradio as gr
+    import numpy as np
+    import uvicorn
+    from PIL import Image
+
+    import config
+    if config.TOOL_BACKEND_CONFIG["remote"]["vision_experts_dir"] not in sys.path:
+        sys.path.append(config.TOOL_BACKEND_CONFIG["remote"]["vision_experts_dir"])
+    from fast_api import create_app, open_image, png_bytes
+
+    def sleep(tool):
+        time.sleep(latency_ms[tool] / 1000)
+
+    @timings.timed
+    def som(image, slider, alpha, label_mode, anno_mode, response_mode="full"):
+        sleep("segment_and_mark")
+        w, h = image.size
+        return _annotate(image, regions), _som_regions(w, h, regions, response_mode)
+
+    @timings.timed
+    def detection(image, text, box_threshold=0.35, text_threshold=0.25):
+        sleep("detection")
+        found = [[0.2 + 0.6 * i / max(1, boxes), 0.5, 0.1, 0.1] for i in range(boxes)]
+        return (_annotate(Image.open(image), boxes),
+                {"boxes": found, "logits": [0.5] * boxes, "phrases": [text.split(",")[0]] * boxes})
+
+    @timings.timed
+    def detect_tiles(image, text, tiles, box_threshold=0.35, text_threshold=0.25, binary=False):
+        sleep("detection")
+        image = Image.open(image)
+        w, h = image.size
+        results = []
+        for tile in json.loads(tiles):
+            # one box in the middle of every tile, so all the tiles are kept, and sent annotated
+            tx, ty, tw, th = tile
+            annotated = png_bytes(_annotate(image.crop((tx * w, ty * h, (tx + tw) * w, (ty + th) * h)), 1))
+            results.append({"tile": tile, "boxes": [[0.5, 0.5, 0.2, 0.2]],
+                            "boxes_global": [[tx + 0.5 * tw, ty + 0.5 * th, 0.2 * tw, 0.2 * th]],
+                            "logits": [0.5], "phrases": [text.split(",")[0]]})
+            if binary:
+                results[-1]["image_png"] = annotated
+            else:
+                results[-1]["image_png_base64"] = base64.b64encode(annotated).decode("ascii")
+        return {"tiles": results}
+
+    @timings.timed
+    def depth(image, response_mode="full"):
+        sleep("depth")
+        h, w = image.shape[:2]
+        gray = np.tile(np.linspace(0, 255, w, dtype=np.uint8), (h, 1))
+        colored = np.stack([gray, gray // 2, 255 - gray], axis=2)
+        data = {"height": h, "width": w, "depth_min": 0.0, "depth_max": 1.0}
+        if response_mode == "float16":
+            data["depth_float16_base64"] = base64.b64encode(gray.astype("<f2").tobytes()).decode("ascii")
+        elif response_mode != "colored":
+            for key, array in (("depth_map_grayscale_base64", gray), ("depth_map_colored_base64", colored)):
+                buffer = io.BytesIO()
+                Image.fromarray(array).save(buffer, format="PNG")
+                data[key] = base64.b64encode(buffer.getvalue()).decode("ascii")
+        return Image.fromarray(colored), data
+
+    # the /v1/ handlers, with the request and response documents of the real servers' fast_* handlers
+    def fast_som(request):
+        image, data = som(open_image(request["image"]), request.get("slider"), request.get("alpha"),
+                          request.get("label_mode"), request.get("anno_mode"), request.get("response_mode", "full"))
+        return {"image": png_bytes(image), "data": data}
+
+    def fast_detection(request):
+        image, data = detection(io.BytesIO(request["image"]), request["text"], request.get("box_threshold", 0.35),
+                                request.get("text_threshold", 0.25))
+        return {"image": png_bytes(image), "data": data}
+
+    def fast_detect_tiles(request):
+        return {"data": detect_tiles(io.BytesIO(request["image"]), request["text"], json.dumps(request["tiles"]),
+                                     request.get("box_threshold", 0.35), request.get("text_threshold", 0.25),
+                                     True)}
+
+    def fast_depth(request):
+        image, data = depth(np.asarray(open_image(request["image"])), request.get("response_mode", "full"))
+        # the float16 depth travels as raw bytes on the binary API
+        if "depth_float16_base64" in data:
+            data["depth_float16"] = base64.b64decode(data.pop("depth_float16_base64"))
+        return {"image": png_bytes(image), "data": data}
+
+    apps = {
+        "segment_and_mark": (gr.Interface(
+            fn=som,
+            inputs=[gr.Image(type="pil"), gr.Number(value=1.8), gr.Number(value=0.1),
+                    gr.Radio(["Number", "Alphabet"], value="Number"),
+                    gr.CheckboxGroup(["Mask", "Box", "Mark"], value=["Mask", "Mark"]),
+                    gr.Radio(["full", "bboxes", "rle"], value="full", label="response_mode")],
+            outputs=[gr.Image(type="pil"), gr.JSON()]),
+            {"segment_and_mark": fast_som}),
+        "detection": (gr.TabbedInterface([
+            gr.Interface(fn=detection, inputs=[gr.Image(type="filepath"), gr.Text(), gr.Number(value=0.35),
+                                               gr.Number(value=0.25)],
+                         outputs=[gr.Image(type="pil"), gr.JSON()], api_name="predict"),
+            gr.Interface(fn=detect_tiles, inputs=[gr.Image(type="filepath"), gr.Text(), gr.Text(),
+                                                  gr.Number(value=0.35), gr.Number(value=0.25)],
+                         outputs=gr.JSON(), api_name="detect_tiles"),
+        ], ["detection", "detect_tiles"]),
+            {"detection": fast_detection, "detect_tiles": fast_detect_tiles}),
+        "depth": (gr.Interface(
+            fn=depth,
+            inputs=[gr.Image(), gr.Radio(["full", "colored", "float16"], value="full", label="response_mode")],
+            outputs=[gr.Image(type="pil"), gr.JSON()]),
+            {"depth": fast_depth}),
+    }
+    addresses = {}
+    for tool, (app, handlers) in apps.items():
+        # one request at a time, like the real servers
+        app.queue(default_concurrency_limit=1)
+        port = _free_port()
+        server = uvicorn.Server(uvicorn.Config(gr.mount_gradio_app(create_app(handlers), app, path="/"),
+                                               host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, name=f"stand-in-{tool}", daemon=True).start()
+        while not server.started:
+            time.sleep(0.01)
+        addresses[tool] = f"http://127.0.0.1:{port}"
+    return addresses
+
+
+def make_image(size: int, seed: int = 0):
+    """A fixed test image: smooth gradients with some shapes, so PNG sizes are realistic."""
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    rng = np.random.default_rng(seed)
+    h, w = int(size * 0.75), size
+    y, x = np.mgrid[0:h, 0:w]
+    array = np.stack([(x * 255 / w), (y * 255 / h), ((x + y) * 127 / (w + h)) + 64], axis=2)
+    array += rng.normal(0, 6, array.shape)
+    image = Image.fromarray(np.clip(array, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x0, y0 = rng.integers(0, w - 10), rng.integers(0, h - 10)
+        draw.ellipse([x0, y0, x0 + rng.integers(10, w // 4 + 11), y0 + rng.integers(10, h // 4 + 11)],
+                     fill=tuple(int(c) for c in rng.integers(0, 255, 3)))
+    return image
+
+
+def _git_info() -> Dict:
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=directory, capture_output=True, text=True, timeout=10).stdout.strip()
+        except Exception:
+            return None
+
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 6) if values else 0.0
+
+
+def bench_case(tools, tool_name: str, image, repeat: int, timings: StandInTimings, protocol: str = "gradio") -> Dict:
+    """Time `repeat` calls of one tool on one image over one protocol, after a warm-up call."""
+    from spans import read_spans, reset_output, set_output
+    from stub_llm_server import _latency_stats
+
+    calls = {
+        "segment_and_mark": lambda: tools.segment_and_mark(image),
+        "detection": lambda: tools.detection(image, ["ellipse"]),
+        "depth": lambda: tools.depth(image),
+        "sliding_window_detection": lambda: tools.sliding_window_detection(image, ["ellipse"]),
+        "overlay_images": lambda: tools.overlay_images(image, image.transpose(0), alpha=0.3),
+    }
+    call = calls[tool_name]
+    tools.get_backend("remote").protocol = protocol
+    with tempfile.TemporaryDirectory() as directory:
+        token = set_output(directory)
+        try:
+            call()
+            since = time.time()
+            walls, servers = [], []
+            for _ in range(repeat):
+                timings.reset()
+                start = time.perf_counter()
+                call()
+                walls.append(time.perf_counter() - start)
+                servers.append(timings.seconds)
+        finally:
+            reset_output(token)
+        spans = [s for s in read_spans(directory) if s["start"] >= since]
+
+    def per_call(suffix):
+        return sum(s["duration"] for s in spans if s["name"].endswith(suffix)) / repeat
+
+    inference = per_call(".inference")
+    server = _mean(servers)
+    return {
+        "tool": tool_name,
+        "protocol": protocol,
+        "size": list(image.size),
+        "wall_seconds": _latency_stats(walls),
+        "server": server,
+        "client": round(_mean(walls) - server, 6),
+        "breakdown": {
+            "upload": round(per_call(".upload"), 6),
+            "protocol": round(max(0.0, inference - server), 6),
+            "download": round(per_call(".download"), 6),
+            "postprocess": round(per_call("postprocess"), 6),
+        },
+    }
+
+
+def compare(previous: Dict, current: Dict):
+    """Print the change of the mean wall and client time per (tool, protocol, size) between two reports.
+    Results of reports without a protocol were measured over gradio."""
+    old = {(r["tool"], r.get("protocol", "gradio"), tuple(r["size"])): r for r in previous["results"]}
+    print(f"{'tool':<26}{'protocol':>9}{'size':>12}{'wall (ms)':>22}{'client (ms)':>22}")
+    for r in current["results"]:
+        key = (r["tool"], r["protocol"], tuple(r["size"]))
+        if key not in old:
+            continue
+        o = old[key]
+
+        def change(a, b):
+            return f"{a * 1000:8.1f} -> {b * 1000:8.1f}" + (f" ({(b - a) / a * 100:+.0f}%)" if a else "")
+
+        print(f"{r['tool']:<26}{r['protocol']:>9}{'x'.join(map(str, r['size'])):>12}  "
+              f"{change(o['wall_seconds']['mean'], r['wall_seconds']['mean'])}  {change(o['client'], r['client'])}")
+    print(f"(commit {previous.get('git', {}).get('commit', '?')[:10]} -> {current.get('git', {}).get('commit', '?')[:10]})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision tools against local stand-in expert servers.")
+    parser.add_argument("--tools", nargs="+", default=BENCH_TOOLS, choices=BENCH_TOOLS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[256, 512, 1024, 2048], help="image widths")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency_ms", type=float, default=50.0, help="fixed latency of every stand-in server")
+    parser.add_argument("--regions", type=int, default=50, help="segments returned by the SoM stand-in")
+    parser.add_argument("--boxes", type=int, default=5, help="boxes returned by the detection stand-in")
+    parser.add_argument("--protocol", choices=PROTOCOLS + ["both"], default="both",
+                        help="call the stand-ins through their gradio API, their binary HTTP API, or both")
+    parser.add_argument("--postprocess", action="store_true", help="enable the ask post-processor (visual_mask)")
+    parser.add_argument("--output", type=str, default="bench_tools.json")
+    parser.add_argument("--compare", type=str, default=None, help="an earlier report to compare against")
+    args = parser.parse_args()
+
+    if args.postprocess:
+        os.environ["VSP_POSTPROC_ENABLED"] = "1"
+        os.environ["VSP_POSTPROC_BACKEND"] = "ask"
+
+    timings = StandInTimings()
+    latency = {tool: args.latency_ms for tool in ("segment_and_mark", "detection", "depth")}
+    addresses = start_stand_ins(latency, args.regions, args.boxes, timings)
+
+    import config
+    config.SOM_ADDRESS = addresses["segment_and_mark"]
+    config.GROUNDING_DINO_ADDRESS = addresses["detection"]
+    config.DEPTH_ANYTHING_ADDRESS = addresses["depth"]
+    import tools
+
+    protocols = PROTOCOLS if args.protocol == "both" else [args.protocol]
+    results = []
+    for size in args.sizes:
+        image = make_image(size)
+        for tool_name in args.tools:
+            for protocol in protocols:
+                result = bench_case(tools, tool_name, image, args.repeat, timings, protocol)
+                results.append(result)
+                print(f"[BENCH_TOOLS] {tool_name:<26} {protocol:<6} {size:>5}px  wall {result['wall_seconds']['mean'] * 1000:8.1f} ms"
+                      f"  server {result['server'] * 1000:8.1f} ms  client {result['client'] * 1000:8.1f} ms")
+
+    report = {
+        "git": _git_info(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": args.sizes, "protocols": protocols, "repeat": args.repeat, "latency_ms": args.latency_ms, "regions": args.regions,
+                   "boxes": args.boxes, "postprocess": args.postprocess,
+                   "image_transport": [tools.get_backend("remote").image_transport.format,
+                                       tools.get_backend("remote").image_transport.quality]},
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"[BENCH_TOOLS] Report written to {args.output}")
+    # gradio keeps non-daemon threads running
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,174 @@
+import numpy as np
+
+FORMATS = ("xywh", "cxcywh", "xyxy")
+
+
+def convert(array: np.ndarray, source: str, target: str) -> np.ndarray:
+    """Convert an (N, 4) box array between "xywh" (top-left corner and size),
+    "cxcywh" (center and size) and "xyxy" (top-left and bottom-right corners)."""
+    if source not in FORMATS or target not in FORMATS:
+        raise ValueError(f"Unknown box format: {source if source not in FORMATS else target}")
+    array = np.asarray(array, dtype=np.float64).reshape(-1, 4)
+    if source == target:
+        return array.copy()
+    # through xywh
+    if source == "cxcywh":
+        array = np.column_stack([array[:, 0] - array[:, 2] / 2, array[:, 1] - array[:, 3] / 2, array[:, 2], array[:, 3]])
+    elif source == "xyxy":
+        array = np.column_stack([array[:, 0], array[:, 1], array[:, 2] - array[:, 0], array[:, 3] - array[:, 1]])
+    if target == "cxcywh":
+        return np.column_stack([array[:, 0] + array[:, 2] / 2, array[:, 1] + array[:, 3] / 2, array[:, 2], array[:, 3]])
+    if target == "xyxy":
+        return np.column_stack([array[:, 0], array[:, 1], array[:, 0] + array[:, 2], array[:, 1] + array[:, 3]])
+    return array
+
+
+class Boxes(list):
+    """The bounding boxes returned by the vision tools: a list of (x, y, w, h) tuples, normalized to 0-1,
+    with x, y the top-left corner.
+
+    It is a real list, so everything code did with the old list still works (`boxes[4]`, `append`, `sort`,
+    `isinstance(boxes, list)`, `json.dumps(boxes)`). Underneath it keeps the (N, 4) xywh array, `boxes.array`,
+    for bulk work: `boxes.to("xyxy")`, `boxes.near_margin()` and `boxes.iou(other)` convert or test all
+    the boxes at once. The array is built once; the list methods that change the items mark it stale,
+    and it is rebuilt from the items on the next use.
+
+    Args:
+        data: an (N, 4) array or a list of boxes.
+        format (str): the format of `data`: "xywh", "cxcywh" or "xyxy".
+    """
+
+    # None when the items changed since the array was built
+    _array = None
+
+    def __init__(self, data=(), format: str = "xywh"):
+        array = convert(data, format, "xywh")
+        super().__init__(map(tuple, array.tolist()))
+        self._set_array(array)
+
+    @classmethod
+    def from_pixels(cls, data, width: float, height: float, format: str = "xywh") -> "Boxes":
+        """Boxes from pixel coordinates of an image of the given size."""
+        array = np.asarray(data, dtype=np.float64).reshape(-1, 4)
+        return cls(array / np.array([width, height, width, height]), format=format)
+
+    def _set_array(self, array: np.ndarray):
+        # read-only, so the array can't get out of sync with the items
+        array.flags.writeable = False
+        self._array = array
+
+    @property
+    def array(self) -> np.ndarray:
+        if self._array is None:
+            self._set_array(np.array(self, dtype=np.float64).reshape(-1, 4))
+        return self._array
+
+    def to(self, format: str) -> np.ndarray:
+        return convert(self.array, "xywh", format)
+
+    def to_pixels(self, width: float, height: float, format: str = "xywh") -> np.ndarray:
+        return self.to(format) * np.array([width, height, width, height])
+
+    def tolist(self):
+        """A plain list of the boxes, as tuples."""
+        return [tuple(box) for box in self]
+
+    def area(self) -> np.ndarray:
+        array = self.array
+        return array[:, 2] * array[:, 3]
+
+    def near_margin(self, margin: float = 0.005) -> np.ndarray:
+        """For each box, whether it comes within `margin` of an image border."""
+        x, y, w, h = self.array.T
+        x_margin = np.minimum(x, 1 - x - w)
+        y_margin = np.minimum(y, 1 - y - h)
+        return (x_margin < margin) | (y_margin < margin)
+
+    def iou(self, other) -> np.ndarray:
+        """The (N, M) matrix of intersection over union with `other` (Boxes, or boxes in xywh)."""
+        if not isinstance(other, Boxes):
+            other = Boxes(other)
+        a, b = self.to("xyxy"), other.to("xyxy")
+        top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+        bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+        intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+        union = self.area()[:, None] + other.area()[None, :] - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Boxes(self.array[index])
+        return super().__getitem__(index)
+
+    def copy(self) -> "Boxes":
+        return Boxes(self.array)
+
+    # the list methods that change the items
+
+    def append(self, box):
+        super().append(box)
+        self._array = None
+
+    def extend(self, boxes):
+        super().extend(boxes)
+        self._array = None
+
+    def insert(self, index, box):
+        super().insert(index, box)
+        self._array = None
+
+    def pop(self, index=-1):
+        self._array = None
+        return super().pop(index)
+
+    def remove(self, box):
+        super().remove(box)
+        self._array = None
+
+    def clear(self):
+        super().clear()
+        self._array = None
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._array = None
+
+    def reverse(self):
+        super().reverse()
+        self._array = None
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._array = None
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._array = None
+
+    def __iadd__(self, boxes):
+        self.extend(boxes)
+        return self
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._array = None
+        return result
+
+    def __getstate__(self):
+        # pickle the items only, the array is rebuilt from them
+        return None
+
+    def __eq__(self, other):
+        # a box given as a list equals the same box as a tuple, like the old list comparisons with tolist()
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(tuple(a) == tuple(b) for a, b in zip(self, other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return repr(self.tolist())
@@ -0,0 +1,146 @@
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+
+class HistoryCompactor:
+    """Shrink the chat history before it is sent to the LLM.
+
+    The whole history is resent on every turn, including every earlier observation image, so the
+    request grows with each turn. The compactor keeps the last `keep_last_images` images at full
+    fidelity and replaces older ones with a thumbnail or a text placeholder. Long texts in older
+    observations are cut to `max_text_chars`, keeping the head and the tail.
+    The first message (the task prompt and the task images) and the last message are never changed.
+    The stored chat history is not modified; only the copy that goes into the request is.
+
+    Every decision is appended to `log`, so the effect on accuracy and cost can be measured.
+
+    Args:
+        keep_last_images (int): number of most recent images kept as they are.
+        older_images (str): "thumbnail" or "placeholder", what replaces older images.
+        thumbnail_long_side (int): size of the longer side of the thumbnails.
+        max_text_chars (int, optional): maximum length of a text item in older observations. None disables truncation.
+    """
+
+    def __init__(self, keep_last_images: int = 2, older_images: str = "thumbnail",
+                 thumbnail_long_side: int = 256, max_text_chars: Optional[int] = 2000):
+        assert older_images in ["thumbnail", "placeholder"]
+        self.keep_last_images = keep_last_images
+        self.older_images = older_images
+        self.thumbnail_long_side = thumbnail_long_side
+        self.max_text_chars = max_text_chars
+        self.log: List[Dict] = []
+        self._n_calls = 0
+        # id(image) -> (image, thumbnail). The same thumbnail object is reused on every turn,
+        # so the image encoding cache encodes it only once.
+        self._thumbnails: Dict[int, tuple] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "HistoryCompactor":
+        return cls(
+            keep_last_images=config.get("keep_last_images", 2),
+            older_images=config.get("older_images", "thumbnail"),
+            thumbnail_long_side=config.get("thumbnail_long_side", 256),
+            max_text_chars=config.get("max_text_chars", 2000),
+        )
+
+    def _thumbnail(self, image: Image.Image) -> Image.Image:
+        entry = self._thumbnails.get(id(image))
+        if entry is not None and entry[0] is image:
+            return entry[1]
+        thumbnail = image.copy()
+        thumbnail.thumbnail((self.thumbnail_long_side, self.thumbnail_long_side))
+        self._thumbnails[id(image)] = (image, thumbnail)
+        return thumbnail
+
+    def _truncate(self, text: str) -> str:
+        half = self.max_text_chars // 2
+        n_cut = len(text) - 2 * half
+        return f"{text[:half]}\n...[{n_cut} characters truncated]...\n{text[-half:]}"
+
+    def compact(self, messages: List[Dict]) -> List[Dict]:
+        turn = self._n_calls
+        self._n_calls += 1
+        decisions = []
+        compacted = list(messages)
+        if len(messages) < 3:
+            return compacted
+
+        # images in the last message count towards the kept ones
+        n_images_kept = sum(1 for item in self._content_items(messages[-1]) if self._is_image(item))
+
+        # walk from the newest message, so the most recent images are the ones kept
+        for idx in range(len(messages) - 2, 0, -1):
+            message = messages[idx]
+            content = message.get("content") if isinstance(message, dict) else None
+            if not isinstance(content, list):
+                if isinstance(content, str) and self._should_truncate(message, content):
+                    compacted[idx] = dict(message, content=self._truncate(content))
+                    decisions.append(self._decision(turn, idx, "truncate_text", chars_before=len(content),
+                                                    chars_after=len(compacted[idx]["content"])))
+                continue
+
+            new_content = []
+            changed = False
+            for item in reversed(content):
+                if self._is_image(item):
+                    image = item["image_url"]["url"]
+                    if n_images_kept < self.keep_last_images:
+                        n_images_kept += 1
+                    elif self.older_images == "thumbnail":
+                        thumbnail = self._thumbnail(image)
+                        item = dict(item, image_url=dict(item["image_url"], url=thumbnail))
+                        decisions.append(self._decision(turn, idx, "thumbnail", size_before=list(image.size),
+                                                        size_after=list(thumbnail.size)))
+                        changed = True
+                    else:
+                        item = {"type": "text", "text": f"[image {image.size[0]}x{image.size[1]} omitted, it was shown earlier]"}
+                        decisions.append(self._decision(turn, idx, "placeholder", size_before=list(image.size)))
+                        changed = True
+                elif isinstance(item, dict) and item.get("type") == "text" and self._should_truncate(message, item.get("text", "")):
+                    text = item["text"]
+                    item = dict(item, text=self._truncate(text))
+                    decisions.append(self._decision(turn, idx, "truncate_text", chars_before=len(text),
+                                                    chars_after=len(item["text"])))
+                    changed = True
+                new_content.append(item)
+
+            if changed:
+                compacted[idx] = dict(message, content=list(reversed(new_content)))
+
+        if decisions:
+            print(f"[COMPACTION] turn {turn}: " + ", ".join(
+                f"{action} x{sum(d['action'] == action for d in decisions)}"
+                for action in sorted({d["action"] for d in decisions})))
+        self.log.extend(decisions)
+        return compacted
+
+    @staticmethod
+    def _content_items(message) -> list:
+        content = message.get("content") if isinstance(message, dict) else None
+        return content if isinstance(content, list) else []
+
+    @staticmethod
+    def _is_image(item) -> bool:
+        return isinstance(item, dict) and "image_url" in item and isinstance(item["image_url"].get("url"), Image.Image)
+
+    def _should_truncate(self, message: Dict, text: str) -> bool:
+        # only observations (execution outputs) are cut, never the assistant's own code
+        return (self.max_text_chars is not None and message.get("role") == "user"
+                and len(text) > self.max_text_chars)
+
+    @staticmethod
+    def _decision(turn, message_index, action, **details):
+        return dict(turn=turn, message_index=message_index, action=action, **details)
+
+    def summary(self) -> Dict:
+        return {
+            "settings": {"keep_last_images": self.keep_last_images, "older_images": self.older_images,
+                         "thumbnail_long_side": self.thumbnail_long_side, "max_text_chars": self.max_text_chars},
+            "decisions": self.log,
+        }
+
+    def clear(self):
+        self.log = []
+        self._n_calls = 0
+        self._thumbnails.clear()
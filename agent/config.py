@@ -43,7 +43,171 @@ llm_config={
     ]
 }
 
+# Point the agent at another OpenAI-compatible endpoint, e.g. the offline stub in stub_llm_server.py
+if os.environ.get("VSP_LLM_BASE_URL"):
+    llm_config["config_list"][0]["base_url"] = os.environ["VSP_LLM_BASE_URL"]
+    llm_config["config_list"][0]["api_key"] = os.environ.get("VSP_LLM_API_KEY", "none")
+
+# Async conversations (main.a_run_agent, run_task.py --async_chats)
+# LLM calls are limited per provider (base_url) and retried with exponential backoff on
+# rate limit, connection and 5xx errors.
+ASYNC_LLM_CONFIG = {
+    "default_concurrency": 8,
+    "provider_concurrency": {
+        "https://openrouter.ai/api/v1": 16,
+    },
+    "max_retries": 5,
+    "backoff_base": 1.0,    # seconds, doubled on every retry
+    "backoff_max": 30.0,
+}
+
+# How images are encoded for the LLM request (see image_encoding.py).
+# Only the request payload changes; the agent code and the saved traces keep the original images.
+# The defaults send full-size lossless PNGs, as before.
+#   max_long_side: downscale so the longer side is at most this many pixels (None keeps the size)
+#   format: "PNG", "JPEG" or "WEBP"
+#   quality: JPEG / WEBP quality
+#   detail: "detail" field of the image_url ("low", "high", "auto"), None leaves it out
+IMAGE_POLICY_CONFIG = {
+    "max_long_side": int(os.environ["VSP_IMAGE_MAX_SIDE"]) if os.environ.get("VSP_IMAGE_MAX_SIDE") else None,
+    "format": os.environ.get("VSP_IMAGE_FORMAT", "PNG"),
+    "quality": int(os.environ.get("VSP_IMAGE_QUALITY", "85")),
+    "detail": os.environ.get("VSP_IMAGE_DETAIL") or None,
+}
+
+# Compaction of the chat history before each LLM call (see compaction.py). Disabled by default.
+# The last `keep_last_images` images are sent as they are, older ones become thumbnails or text
+# placeholders, and older observations longer than `max_text_chars` are cut in the middle.
+# Every decision is saved in usage_summary.json under "compaction".
+HISTORY_COMPACTION_CONFIG = {
+    "enabled": os.environ.get("VSP_COMPACTION", "0") == "1",
+    "keep_last_images": 2,
+    "older_images": "thumbnail",    # "thumbnail" or "placeholder"
+    "thumbnail_long_side": 256,
+    "max_text_chars": 2000,
+}
+
+# The LLM and tool caches live under the user cache directory, outside the repository.
+CACHE_ROOT = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "visualsketchpad")
+
+# LLM completion cache (see llm_cache.py), in front of MultimodalConversableAgent.generate_oai_reply.
+# "record" serves recorded completions and records new ones, "replay" only serves recorded ones
+# (a miss fails the instance, so regression runs stay offline), "bypass" always calls the LLM.
+# The cache is evicted least-recently-used once it grows past `max_size_mb`.
+LLM_CACHE_CONFIG = {
+    "mode": os.environ.get("VSP_LLM_CACHE", "bypass"),
+    "directory": os.environ.get("VSP_LLM_CACHE_DIR", os.path.join(CACHE_ROOT, "llm_cache")),
+    "max_size_mb": 2048,
+}
+
+# How the vision tools send images to the expert servers (see image_transport.py).
+# Images are encoded in memory and uploaded directly; results are fetched into memory.
+# "PNG" is lossless. "JPEG" (what the tools used to send) is smaller but recompresses every image.
+IMAGE_TRANSPORT_CONFIG = {
+    "format": os.environ.get("VSP_TOOL_IMAGE_FORMAT", "PNG"),
+    "quality": int(os.environ.get("VSP_TOOL_IMAGE_QUALITY", "95")),
+    "timeout": 60.0,
+}
+
+# Cache of the vision tool results (see tool_cache.py), keyed on the image content and the tool parameters.
+# An in-process LRU of `memory_entries` results, and a disk tier shared by all kernels and reruns.
+TOOL_CACHE_CONFIG = {
+    "enabled": os.environ.get("VSP_TOOL_CACHE", "1") == "1",
+    "memory_entries": 64,
+    "disk": True,
+    "directory": os.environ.get("VSP_TOOL_CACHE_DIR", os.path.join(CACHE_ROOT, "tool_cache")),
+    "max_size_mb": 2048,
+}
+
+# Connections to the vision expert servers (see expert_clients.py). The gradio clients are created on
+# first use, not at import, and share one pooled HTTP session for uploads, downloads and health checks.
+# A connection is retried `connect_retries` times with an exponential `backoff`; after that the expert
+# fails fast for `cooldown` seconds. A call whose connection drops is retried `call_retries` times,
+# on another replica when the expert has several. A replica that fails gets no requests for
+# `eject_seconds`, then comes back once it passes a health check.
+EXPERT_CLIENT_CONFIG = {
+    "connect_retries": 2,
+    "backoff": 1.0,
+    "cooldown": 10.0,
+    "call_retries": 1,
+    "eject_seconds": 30.0,
+    "health_check_interval": 30.0,
+    "health_check_timeout": 5.0,
+    "max_connections": 16,
+    "timeout": 60.0,
+}
+
+# Where each vision tool runs (see tool_backends/): "remote" (the expert gradio servers below) or
+# "local" (in-process, on CPU by default, with the smaller Depth-Anything ViT-S and GroundingDINO SwinT).
+# VSP_TOOL_BACKEND sets every tool at once; segment_and_mark has no local version (Semantic-SAM needs a GPU).
+# With a `fallback`, a call whose backend fails (e.g. the server is down) is run on that backend instead.
+_vision_root = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vision_experts")
+_tool_backend = os.environ.get("VSP_TOOL_BACKEND", "remote")
+TOOL_BACKEND_CONFIG = {
+    "segment_and_mark": os.environ.get("VSP_SOM_BACKEND", "remote"),
+    "detection": os.environ.get("VSP_DETECTION_BACKEND", _tool_backend),
+    "depth": os.environ.get("VSP_DEPTH_BACKEND", _tool_backend),
+    "fallback": os.environ.get("VSP_TOOL_BACKEND_FALLBACK", ""),
+
+    # "auto": the servers' binary HTTP routes (/v1/..., vision_experts/fast_api.py), their gradio API if they
+    # have none; "http": only the HTTP routes; "gradio": only the gradio API
+    "remote": {
+        "protocol": os.environ.get("VSP_EXPERT_PROTOCOL", "auto"),
+        "vision_experts_dir": _vision_root,  # for wire.py, the message format of the HTTP routes
+    },
+    "local": {
+        "device": os.environ.get("VSP_LOCAL_DEVICE", "cpu"),
+        "num_threads": None,  # torch's default
+        "depth_encoder": "vits",  # "vits", "vitb" or "vitl"
+        "vision_experts_dir": _vision_root,  # for annotation.py, the drawing of the detection server
+        "depth_anything_dir": os.path.join(_vision_root, "Depth-Anything"),
+        "grounding_dino_dir": os.path.join(_vision_root, "GroundingDINO"),
+        # relative to grounding_dino_dir
+        "grounding_dino_config": "groundingdino/config/GroundingDINO_SwinT_OGC.py",
+        "grounding_dino_checkpoint": "weights/groundingdino_swint_ogc.pth",
+    },
+}
+
+# Overlapping vision tool calls (see tools.submit and tool_prefetch.py).
+# With `prefetch`, the expert tool calls of a code block whose arguments are known beforehand
+# (e.g. depth(image_1) and segment_and_mark(image_1)) are started together before the block runs,
+# so a multi-tool step takes as long as its slowest call. Needs the tool cache. Opt-in (VSP_TOOL_PREFETCH=1):
+# a prefetched call whose image the block changes in a way the static check misses is a wasted expert call.
+TOOL_FANOUT_CONFIG = {
+    "prefetch": os.environ.get("VSP_TOOL_PREFETCH", "0") == "1",
+    "max_workers": 8,
+}
+
+# Timing spans for every phase of a turn (see spans.py): parse, execute, image encoding, LLM call,
+# and, from the jupyter kernel, each tool's upload / inference / download and post-processing.
+# They are written to spans.jsonl in the task directory and summed up in the end record of trace.jsonl.
+SPANS_CONFIG = {
+    "enabled": os.environ.get("VSP_SPANS", "1") == "1",
+}
+
+# Warm jupyter kernel pool (see kernel_pool.py), used by run_task.py.
+# Instead of starting a LocalJupyterServer and importing the tools for every task instance,
+# each worker process keeps `size` kernels alive and resets their namespace between tasks.
+# A kernel is restarted after `max_tasks_per_kernel` tasks or once it uses more than `max_memory_mb`.
+KERNEL_POOL_CONFIG = {
+    "enabled": os.environ.get("VSP_KERNEL_POOL", "1") == "1",
+    "size": int(os.environ.get("VSP_KERNEL_POOL_SIZE", "1")),
+    "max_tasks_per_kernel": 20,
+    "max_memory_mb": 4096,
+}
+
+# Conversation trace (see trace_writer.py). Every message is appended to trace.jsonl in the task
+# directory as soon as it is sent, with images saved once under trace_images/ by content hash.
+# Set `write_output_json` to also write the old output.json (with inlined base64 images) at the end
+# of each run; it can always be rebuilt later with `python trace_writer.py <task directory>`.
+TRACE_CONFIG = {
+    "write_output_json": os.environ.get("VSP_WRITE_OUTPUT_JSON", "0") == "1",
+}
+
 # use this after building your own server. You can also set up the server in other machines and paste them here.
+# An expert running on several GPU replicas takes a list of addresses; each call goes to the replica
+# with the fewest requests in flight.
+# e.g. SOM_ADDRESS = ["http://gpu-1:7862", "http://gpu-2:7862"]
 SOM_ADDRESS = "http://34.210.214.193:7862"
 GROUNDING_DINO_ADDRESS = "http://34.210.214.193:7860"
 DEPTH_ANYTHING_ADDRESS = "http://34.210.214.193:7861"
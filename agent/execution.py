@@ -1,8 +1,11 @@
 import os, sys
+import asyncio
 import pickle
 from autogen.coding import CodeBlock
 from autogen.coding.jupyter import JupyterCodeExecutor, LocalJupyterServer
 import ast, re
+from spans import span
+from tool_prefetch import should_prefetch
 
 # add the tools directory to the path
 parent_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,12 +13,27 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 
+def build_init_code(use_custom_tools):
+    # the code every kernel runs before the first task code
+    init_code = ("import sys\n"
+                 "from PIL import Image\n"
+                 "from IPython.display import display\n"
+                 f"parent_dir = '{parent_dir}'\n"
+                 "if parent_dir not in sys.path:\n"
+                 "    sys.path.insert(0, parent_dir)\n"
+    )
+    if use_custom_tools:
+        init_code += "from tools import *\n"
+    return init_code
+
+
 # for each dialogue, we will have a new code executor
 class CodeExecutor:
     def __init__(
         self, 
         working_dir: str = "",
         use_custom_tools: bool = False,
+        kernel_pool = None,
         ):
         self.working_dir = working_dir
         
@@ -24,6 +42,18 @@ class CodeExecutor:
             
         # Set environment variable for post-processors to access working directory
         os.environ["VSP_WORKING_DIR"] = self.working_dir
+        
+        # start independent vision tool calls of a code block in the background before it runs
+        from config import TOOL_FANOUT_CONFIG
+        self.prefetch_tools = use_custom_tools and TOOL_FANOUT_CONFIG.get("prefetch", False)
+        
+        self.kernel_pool = kernel_pool
+        if kernel_pool is not None:
+            # lease a warm kernel from the pool. It is already reset for this task and has the tools imported.
+            self.server = None
+            self.kernel = kernel_pool.acquire(self.working_dir, use_custom_tools)
+            self.executor = self.kernel.executor
+            return
             
         # set up the server
         self.server = LocalJupyterServer()
@@ -104,30 +134,51 @@ class CodeExecutor:
             return exit_code, error_msg, file_paths
     
     def execute(self, code: str):
-        self.executor._jupyter_kernel_client = self.executor._jupyter_client.get_kernel_client(self.executor._kernel_id)
-        execution_result = self.executor.execute_code_blocks(
-            code_blocks=[
-                CodeBlock(language="python",
-                        code=code),
-            ]
-        )
-        ret = self.result_processor(execution_result)
+        with span("execute") as attrs:
+            self.executor._jupyter_kernel_client = self.executor._jupyter_client.get_kernel_client(self.executor._kernel_id)
+            if self.prefetch_tools and should_prefetch(code):
+                self.prefetch_tool_calls(code)
+            try:
+                execution_result = self.executor.execute_code_blocks(
+                    code_blocks=[
+                        CodeBlock(language="python",
+                                code=code),
+                    ]
+                )
+            except Exception:
+                # a pooled kernel that timed out or died must not be handed to the next task as is
+                if self.kernel_pool is not None:
+                    self.kernel.broken = True
+                raise
+            ret = self.result_processor(execution_result)
+            attrs.update(exit_code=ret[0], n_files=len(ret[2]))
         return ret
     
+    def prefetch_tool_calls(self, code: str):
+        # the calls run in the kernel's tool threads; the code block then waits for them through the tool cache
+        prefetch_code = f"_vsp_prefetched = prefetch_tool_calls({code!r}, globals())"
+        try:
+            with span("prefetch"):
+                self.executor.execute_code_blocks(code_blocks=[CodeBlock(language="python", code=prefetch_code)])
+        except Exception as e:
+            print(f"[EXECUTION] Tool prefetch failed: {e}")
+    
+    async def a_execute(self, code: str):
+        # the kernel round trip is blocking, run it in a worker thread so the event loop can serve other conversations
+        return await asyncio.to_thread(self.execute, code)
+    
     def init_env(self, use_custom_tools):
-        init_code = ("import sys\n"
-                     "from PIL import Image\n"
-                     "from IPython.display import display\n"
-                     f"parent_dir = '{parent_dir}'\n"
-                     "if parent_dir not in sys.path:\n"
-                     "    sys.path.insert(0, parent_dir)\n"
-        )
-        if use_custom_tools:
-            init_code += "from tools import *\n"
-        
-        init_resp = self.execute(init_code)
+        init_resp = self.execute(build_init_code(use_custom_tools))
         print(init_resp[1])
 
 
     def cleanup(self):
-        self.server.stop()
+        # safe to call more than once
+        if self.kernel_pool is not None:
+            # give the kernel back instead of shutting it down
+            if self.kernel is not None:
+                kernel, self.kernel = self.kernel, None
+                self.kernel_pool.release(kernel)
+        elif self.server is not None:
+            server, self.server = self.server, None
+            server.stop()
@@ -0,0 +1,310 @@
+"""Lazy, shared connections to the vision expert servers.
+
+Creating a gradio Client fetches the server's API schema, so the clients are only created when a
+tool first needs them, not when tools.py is imported in every jupyter kernel. Geometry and math
+tasks never connect to the experts at all.
+
+An expert can run on several replicas (a list of addresses in config.py), one ExpertClient each:
+    - creates the gradio Client on first use, retrying the connection with a backoff,
+    - after repeated connection failures, fails fast for a cool-down period instead of making
+      every tool call wait for the connect timeout,
+    - checks the server's /config route (cheap, no schema download) before reconnecting.
+
+The ExpertPool of an expert sends each call to the replica with the fewest requests in flight
+(the servers handle one request at a time), ejects replicas whose connection fails and that fail
+a health check, and retries the call on another replica. An ejected replica is taken back once
+`eject_seconds` have passed and it passes a health check again. The counts of requests in flight
+are per process: every jupyter kernel and worker balances only its own calls, so ties are broken
+starting from a random replica, otherwise all the processes would send their first call to the
+first replica.
+
+Image uploads, output downloads, health checks and the calls to the servers' binary /v1/ routes go
+through one pooled httpx session (`http_session`), so the kernel keeps its connections to the
+servers alive between calls.
+
+The old module attributes still work: `expert_clients.som_client` returns the connected Client.
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, List
+
+# tool name -> the name of its address in config.py
+EXPERT_ADDRESS_NAMES = {
+    "segment_and_mark": "SOM_ADDRESS",
+    "detection": "GROUNDING_DINO_ADDRESS",
+    "depth": "DEPTH_ANYTHING_ADDRESS",
+}
+
+# the client attributes tools.py used to create at import time
+CLIENT_NAMES = {"som_client": "segment_and_mark", "gd_client": "detection", "da_client": "depth"}
+
+
+class ExpertUnavailableError(RuntimeError):
+    pass
+
+
+def _config() -> Dict:
+    from config import EXPERT_CLIENT_CONFIG
+    return EXPERT_CLIENT_CONFIG
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """The httpx.Client shared by the uploads, downloads and health checks of this process."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import httpx
+
+                config = _config()
+                limits = httpx.Limits(max_connections=config.get("max_connections", 16),
+                                      max_keepalive_connections=config.get("max_connections", 16))
+                _session = httpx.Client(limits=limits, timeout=config.get("timeout", 60.0))
+    return _session
+
+
+def _is_connection_error(error: Exception) -> bool:
+    import httpx
+
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+
+class ExpertClient:
+    """The gradio Client of one vision expert server, created on first use and reconnected on failure.
+
+    Args:
+        name (str): the tool served, for messages.
+        address (str): the server URL.
+        connect_retries (int): extra connection attempts before giving up.
+        backoff (float): seconds before the first retry, doubled after each attempt.
+        cooldown (float): seconds during which calls fail fast after the server could not be reached.
+        health_check_interval (float): seconds a successful health check is trusted.
+    """
+
+    def __init__(self, name: str, address: str, connect_retries: int = 2, backoff: float = 1.0,
+                 cooldown: float = 10.0, health_check_interval: float = 30.0):
+        self.name = name
+        self.address = address.rstrip("/")
+        self.connect_retries = connect_retries
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.health_check_interval = health_check_interval
+        self._client = None
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._healthy_at = 0.0
+        self.stats = {"connects": 0, "connect_failures": 0}
+
+    @classmethod
+    def from_config(cls, name: str, address: str, config: Dict) -> "ExpertClient":
+        return cls(name, address, connect_retries=config.get("connect_retries", 2),
+                   backoff=config.get("backoff", 1.0), cooldown=config.get("cooldown", 10.0),
+                   health_check_interval=config.get("health_check_interval", 30.0))
+
+    def healthy(self) -> bool:
+        """True if the server answers its /config route. A success is trusted for `health_check_interval`."""
+        if time.time() - self._healthy_at < self.health_check_interval:
+            return True
+        try:
+            response = http_session().get(f"{self.address}/config", timeout=_config().get("health_check_timeout", 5.0))
+            ok = response.status_code == 200
+        except Exception:
+            ok = False
+        if ok:
+            self._healthy_at = time.time()
+        return ok
+
+    def _connect(self):
+        from gradio_client import Client
+
+        delay = self.backoff
+        for attempt in range(self.connect_retries + 1):
+            if attempt > 0:
+                time.sleep(delay)
+                delay *= 2
+                if not self.healthy():
+                    continue
+            try:
+                # output files are not written to disk, the image transport fetches them into memory
+                client = Client(self.address, download_files=False)
+            except Exception as e:
+                print(f"[EXPERT_CLIENTS] Could not connect to the {self.name} server at {self.address}: {e}")
+                continue
+            self.stats["connects"] += 1
+            self._healthy_at = time.time()
+            return client
+        self.stats["connect_failures"] += 1
+        self._down_until = time.time() + self.cooldown
+        raise ExpertUnavailableError(f"The {self.name} server at {self.address} is not reachable.")
+
+    def get(self):
+        """The connected gradio Client, created on first use."""
+        if self._client is not None:
+            return self._client
+        with self._lock:
+            if self._client is None:
+                if time.time() < self._down_until:
+                    raise ExpertUnavailableError(
+                        f"The {self.name} server at {self.address} is not reachable (retrying in "
+                        f"{self._down_until - time.time():.0f}s).")
+                self._client = self._connect()
+            return self._client
+
+    def reset(self, client=None):
+        """Drop the Client, so the next call reconnects. With `client`, only if it is still the current one."""
+        with self._lock:
+            if client is None or self._client is client:
+                self._client = None
+                self._healthy_at = 0.0
+
+
+class ExpertPool:
+    """The replicas of one vision expert, balanced by least outstanding requests.
+    The outstanding counts only cover this process's calls; other processes have their own pool.
+
+    Args:
+        name (str): the tool served, for messages.
+        replicas (List[ExpertClient]): one client per server address.
+        call_retries (int): times a call whose connection fails is retried, on another replica if there is one.
+        eject_seconds (float): how long a failed replica gets no requests before it is health checked again.
+    """
+
+    def __init__(self, name: str, replicas: List[ExpertClient], call_retries: int = 1, eject_seconds: float = 30.0):
+        self.name = name
+        self.replicas = replicas
+        self.call_retries = call_retries
+        self.eject_seconds = eject_seconds
+        self._outstanding = [0] * len(replicas)
+        self._ejected_until = [0.0] * len(replicas)
+        # round robin among tied replicas, from a random start so processes don't all pick replica 0
+        self._next = random.randrange(len(replicas)) if replicas else 0
+        self._lock = threading.Lock()
+        self.stats = {"calls": [0] * len(replicas), "retries": 0, "ejections": 0}
+
+    @classmethod
+    def from_config(cls, name: str, addresses, config: Dict) -> "ExpertPool":
+        if isinstance(addresses, str):
+            addresses = [address for address in addresses.split(",") if address.strip()]
+        replicas = [ExpertClient.from_config(name, address.strip(), config) for address in addresses]
+        return cls(name, replicas, call_retries=config.get("call_retries", 1),
+                   eject_seconds=config.get("eject_seconds", 30.0))
+
+    def _readmit(self, index: int) -> bool:
+        # a replica whose ejection is over gets requests again only if it passes a health check
+        with self._lock:
+            if not self._ejected_until[index]:
+                return True
+        healthy = self.replicas[index].healthy()
+        with self._lock:
+            self._ejected_until[index] = 0.0 if healthy else time.time() + self.eject_seconds
+        return healthy
+
+    def _acquire(self, exclude) -> int:
+        n = len(self.replicas)
+        with self._lock:
+            candidates = [i for i in range(n) if i not in exclude and time.time() >= self._ejected_until[i]]
+        # health checks are network calls, don't hold the lock
+        candidates = [i for i in candidates if self._readmit(i)]
+        with self._lock:
+            if not candidates:
+                # every replica is ejected or was tried: use the one that comes back first
+                remaining = [i for i in range(n) if i not in exclude] or list(range(n))
+                candidates = [min(remaining, key=lambda i: self._ejected_until[i])]
+            # fewest requests in flight; ties go round robin
+            index = min(candidates, key=lambda i: (self._outstanding[i], (i - self._next) % n))
+            self._next = (index + 1) % n
+            self._outstanding[index] += 1
+            self.stats["calls"][index] += 1
+            return index
+
+    def _release(self, index: int):
+        with self._lock:
+            self._outstanding[index] -= 1
+
+    def _eject(self, index: int):
+        replica = self.replicas[index]
+        print(f"[EXPERT_CLIENTS] Ejecting the {self.name} replica {replica.address} for {self.eject_seconds:.0f}s")
+        with self._lock:
+            self._ejected_until[index] = time.time() + self.eject_seconds
+            self.stats["ejections"] += 1
+
+    def get(self):
+        """The gradio Client of the least loaded replica (without counting a request on it)."""
+        index = self._acquire(exclude=())
+        self._release(index)
+        return self.replicas[index].get()
+
+    def call(self, fn: Callable, use_gradio: bool = True):
+        """Run fn(client) on the least loaded replica. If its connection fails, the replica is reconnected,
+        ejected unless it passes a health check, and the call is retried on another replica.
+        With `use_gradio=False`, fn gets the replica's ExpertClient (for its address) and no gradio Client is created."""
+        tried = set()
+        for attempt in range(self.call_retries + 1):
+            index = self._acquire(exclude=tried)
+            replica = self.replicas[index]
+            client = None
+            try:
+                if not use_gradio:
+                    return fn(replica)
+                client = replica.get()
+                return fn(client)
+            except Exception as e:
+                if not (isinstance(e, ExpertUnavailableError) or _is_connection_error(e)):
+                    raise
+                if client is not None:
+                    replica.reset(client)
+                if isinstance(e, ExpertUnavailableError) or not replica.healthy():
+                    self._eject(index)
+                if attempt == self.call_retries:
+                    raise
+                print(f"[EXPERT_CLIENTS] Call to the {self.name} server at {replica.address} failed, retrying: {e}")
+                tried.add(index)
+                with self._lock:
+                    self.stats["retries"] += 1
+            finally:
+                self._release(index)
+
+    def healthy(self) -> bool:
+        """True if at least one replica answers its health check."""
+        return any(replica.healthy() for replica in self.replicas)
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [{"address": replica.address, "outstanding": self._outstanding[i], "calls": self.stats["calls"][i],
+                     "ejected": time.time() < self._ejected_until[i]} for i, replica in enumerate(self.replicas)]
+
+
+_experts: Dict[str, ExpertPool] = {}
+_experts_lock = threading.Lock()
+
+
+def get_expert(tool_name: str) -> ExpertPool:
+    if tool_name not in _experts:
+        import config
+
+        with _experts_lock:
+            if tool_name not in _experts:
+                addresses = getattr(config, EXPERT_ADDRESS_NAMES[tool_name])
+                _experts[tool_name] = ExpertPool.from_config(tool_name, addresses, _config())
+    return _experts[tool_name]
+
+
+def get_client(tool_name: str):
+    """The gradio Client of the least loaded replica of the expert serving `tool_name`, connected on first use."""
+    return get_expert(tool_name).get()
+
+
+def health() -> Dict[str, bool]:
+    """Health of every expert (any replica answering), without creating any gradio Client."""
+    return {tool_name: get_expert(tool_name).healthy() for tool_name in EXPERT_ADDRESS_NAMES}
+
+
+def __getattr__(name: str):
+    if name in CLIENT_NAMES:
+        return get_client(CLIENT_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,48 @@
+"""Decoders for the compact responses of the vision expert servers.
+
+The servers take a `response_mode` input so the client only gets what it uses:
+    segment_and_mark: "bboxes" (no masks), "rle" (COCO-style uncompressed RLE) or "full" (PNG base64 masks)
+    depth: "colored" (the colored map only), "float16" (also the raw depth values) or "full"
+
+Through the servers' binary HTTP routes the float16 depth comes as bytes ("depth_float16") instead of base64.
+"""
+import base64
+import io
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+
+def decode_rle(rle: Dict) -> np.ndarray:
+    """A boolean (height, width) mask from {"size": [height, width], "counts": [...]}.
+    The counts are run lengths over the column-major pixels, starting with a run of zeros."""
+    height, width = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    return np.repeat(values, counts).reshape((height, width), order="F")
+
+
+def decode_region_mask(region: Dict) -> Optional[np.ndarray]:
+    """The boolean mask of a segment_and_mark region, in whichever form the server sent it."""
+    if "mask_rle" in region:
+        return decode_rle(region["mask_rle"])
+    if "mask_png_base64" in region:
+        mask = Image.open(io.BytesIO(base64.b64decode(region["mask_png_base64"])))
+        return np.array(mask.convert("L")) > 0
+    return None
+
+
+def decode_depth(depth_data: Dict) -> Optional[np.ndarray]:
+    """The raw float16 (height, width) depth of a "float16" depth response, or None for the other modes.
+    Larger values are closer to the camera (the model predicts relative inverse depth)."""
+    if not depth_data:
+        return None
+    if "depth_float16" in depth_data:
+        raw = depth_data["depth_float16"]
+    elif "depth_float16_base64" in depth_data:
+        raw = base64.b64decode(depth_data["depth_float16_base64"])
+    else:
+        return None
+    return np.frombuffer(raw, dtype="<f2").reshape(depth_data["height"], depth_data["width"])
@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import math
+import time
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from spans import span
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def image_content_hash(image: Image.Image) -> str:
+    """Hash of the decoded pixels, so the same picture gives the same key no matter which object holds it."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+class ImageSendPolicy:
+    """How an image is encoded for the LLM request.
+
+    Only the request payload is affected. The agent code, the chat history and the saved traces
+    keep the original images.
+
+    Args:
+        max_long_side (int, optional): downscale so that the longer side is at most this many pixels. None keeps the size.
+        format (str): "PNG" (lossless), "JPEG" or "WEBP".
+        quality (int): quality for JPEG and WEBP.
+        detail (str, optional): the "detail" field of the OpenAI image_url ("low", "high" or "auto"). None omits it.
+    """
+
+    def __init__(self, max_long_side: Optional[int] = None, format: str = "PNG", quality: int = 85,
+                 detail: Optional[str] = None):
+        format = format.upper()
+        if format == "JPG":
+            format = "JPEG"
+        if format not in MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {format}")
+        if detail not in (None, "low", "high", "auto"):
+            raise ValueError(f"Unsupported image detail: {detail}")
+        self.max_long_side = max_long_side
+        self.format = format
+        self.quality = quality
+        self.detail = detail
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "ImageSendPolicy":
+        return cls(
+            max_long_side=config.get("max_long_side"),
+            format=config.get("format", "PNG"),
+            quality=config.get("quality", 85),
+            detail=config.get("detail"),
+        )
+
+    def prepare(self, image: Image.Image) -> Image.Image:
+        """Downscale and convert the image so that it can be saved in the target format."""
+        if self.max_long_side and max(image.size) > self.max_long_side:
+            scale = self.max_long_side / max(image.size)
+            new_size = (max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale)))
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+        if self.format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif self.format != "JPEG" and image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            image = image.convert("RGBA")
+        return image
+
+    def encode(self, image: Image.Image):
+        """Return the data URI and the size of the image that is actually sent.
+        With the default policy this is the same PNG data URI as autogen's pil_to_data_uri."""
+        image = self.prepare(image)
+        buffered = BytesIO()
+        if self.format == "PNG":
+            image.save(buffered, format="PNG")
+        else:
+            image.save(buffered, format=self.format, quality=self.quality)
+        data_uri = f"data:{MIME_TYPES[self.format]};base64," + base64.b64encode(buffered.getvalue()).decode("utf-8")
+        return data_uri, image.size
+
+    def estimate_tokens(self, size) -> int:
+        """Estimate the prompt tokens of an image of this size, with OpenAI's tiling rule:
+        85 tokens for low detail, otherwise fit in 2048x2048, scale the short side down to 768
+        and count 170 tokens per 512px tile plus 85. Other providers count differently,
+        so use it to compare settings rather than as an exact bill."""
+        if self.detail == "low":
+            return 85
+        width, height = size
+        if max(width, height) > 2048:
+            scale = 2048 / max(width, height)
+            width, height = width * scale, height * scale
+        if min(width, height) > 768:
+            scale = 768 / min(width, height)
+            width, height = width * scale, height * scale
+        tiles = math.ceil(width / 512) * math.ceil(height / 512)
+        return 170 * tiles + 85
+
+
+class ImageEncodingCache:
+    """Per-conversation cache of the base64 data URIs sent to the LLM.
+
+    Every turn resends the whole history, so without a cache every image is re-encoded on every turn.
+    Images are looked up by identity first (the PIL objects in the chat history are the same objects
+    from turn to turn), then by content hash, and are only encoded on a miss.
+    Images are encoded according to `policy` (lossless PNG at full size by default).
+    Per-turn statistics are kept in `turns`.
+    """
+
+    def __init__(self, policy: Optional[ImageSendPolicy] = None):
+        self.policy = policy or ImageSendPolicy()
+        # id(image) -> (image, content hash). The image is kept alive so its id can't be reused.
+        self._by_id: Dict[int, tuple] = {}
+        # content hash -> (data uri, estimated tokens)
+        self._by_hash: Dict[str, tuple] = {}
+        self.turns: List[Dict] = []
+
+    def clear(self):
+        self._by_id.clear()
+        self._by_hash.clear()
+        self.turns = []
+
+    def _lookup(self, image: Image.Image, stats: Dict) -> tuple:
+        entry = self._by_id.get(id(image))
+        if entry is not None and entry[0] is image:
+            stats["identity_hits"] += 1
+            return self._by_hash[entry[1]]
+
+        key = image_content_hash(image)
+        self._by_id[id(image)] = (image, key)
+        encoded = self._by_hash.get(key)
+        if encoded is not None:
+            stats["hash_hits"] += 1
+            return encoded
+
+        start = time.perf_counter()
+        data_uri, sent_size = self.policy.encode(image)
+        stats["encode_seconds"] += time.perf_counter() - start
+        stats["encoded"] += 1
+        stats["encoded_bytes"] += len(data_uri)
+        encoded = (data_uri, self.policy.estimate_tokens(sent_size))
+        self._by_hash[key] = encoded
+        return encoded
+
+    def format_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Drop-in replacement for autogen's message_formatter_pil_to_b64.
+        Returns new message dicts with PIL images replaced by data URIs; the input messages are not modified."""
+        stats = {"turn": len(self.turns), "images": 0, "encoded": 0, "identity_hits": 0, "hash_hits": 0,
+                 "encode_seconds": 0.0, "encoded_bytes": 0, "payload_image_bytes": 0, "estimated_image_tokens": 0}
+        new_messages = []
+        with span("image_encoding") as attrs:
+            for message in messages:
+                if isinstance(message, dict) and isinstance(message.get("content"), list):
+                    message = dict(message)
+                    new_content = []
+                    for item in message["content"]:
+                        if isinstance(item, dict) and "image_url" in item and isinstance(item["image_url"].get("url"), Image.Image):
+                            image_url = dict(item["image_url"])
+                            image_url["url"], tokens = self._lookup(image_url["url"], stats)
+                            if self.policy.detail is not None:
+                                image_url["detail"] = self.policy.detail
+                            stats["images"] += 1
+                            stats["payload_image_bytes"] += len(image_url["url"])
+                            stats["estimated_image_tokens"] += tokens
+                            item = dict(item, image_url=image_url)
+                        new_content.append(item)
+                    message["content"] = new_content
+                new_messages.append(message)
+            attrs.update(images=stats["images"], encoded=stats["encoded"])
+
+        stats["encode_seconds"] = round(stats["encode_seconds"], 4)
+        self.turns.append(stats)
+        return new_messages
+
+    def summary(self) -> Dict:
+        total_images = sum(t["images"] for t in self.turns)
+        encoded = sum(t["encoded"] for t in self.turns)
+        return {
+            "turns": self.turns,
+            "images_sent": total_images,
+            "images_encoded": encoded,
+            "cache_hits": total_images - encoded,
+            "encode_seconds": round(sum(t["encode_seconds"] for t in self.turns), 4),
+            "encoded_bytes": sum(t["encoded_bytes"] for t in self.turns),
+            "payload_image_bytes": sum(t["payload_image_bytes"] for t in self.turns),
+            "estimated_image_tokens": sum(t["estimated_image_tokens"] for t in self.turns),
+            "policy": {"max_long_side": self.policy.max_long_side, "format": self.policy.format,
+                       "quality": self.policy.quality, "detail": self.policy.detail},
+        }
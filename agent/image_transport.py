@@ -0,0 +1,120 @@
+import io
+import json
+import uuid
+from typing import Optional
+
+from PIL import Image
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class ImageTransport:
+    """Move images between the tools and the vision expert servers without temp files.
+
+    Images are encoded in memory and posted to the server's gradio upload route; the returned
+    server path is passed to `predict`, so gradio_client does not touch the disk. Output files are
+    fetched as bytes and decoded in memory (the clients are created with download_files=False).
+    If the upload route can't be used, `upload` returns None and the tool falls back to a temp file.
+
+    Args:
+        format (str): "PNG" (lossless, the default) or "JPEG" / "WEBP".
+        quality (int): quality for JPEG and WEBP.
+        timeout (float): timeout of the upload and download requests, in seconds.
+        session (httpx.Client, optional): a pooled session for the requests. Without one, every request opens a connection.
+    """
+
+    def __init__(self, format: str = "PNG", quality: int = 95, timeout: float = 60.0, session=None):
+        format = format.upper()
+        if format == "JPG":
+            format = "JPEG"
+        if format not in MIME_TYPES:
+            raise ValueError(f"Unsupported image format: {format}")
+        self.format = format
+        self.quality = quality
+        self.timeout = timeout
+        self.session = session
+
+    @classmethod
+    def from_config(cls, config, session=None) -> "ImageTransport":
+        return cls(format=config.get("format", "PNG"), quality=config.get("quality", 95),
+                   timeout=config.get("timeout", 60.0), session=session)
+
+    def encode(self, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        if self.format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(buffer, format="JPEG", quality=self.quality)
+        elif self.format == "WEBP":
+            image.save(buffer, format="WEBP", quality=self.quality)
+        else:
+            image.save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def save(self, image: Image.Image, path: str):
+        """Write the image the way `encode` would, for the temp file fallback."""
+        with open(path, "wb") as f:
+            f.write(self.encode(image))
+
+    def _request_kwargs(self, client) -> dict:
+        kwargs = {"headers": getattr(client, "headers", None) or {}}
+        cookies = getattr(client, "cookies", None)
+        if cookies:
+            kwargs["cookies"] = cookies
+        if self.session is None:
+            # a session has its own connection settings
+            kwargs.update(getattr(client, "httpx_kwargs", None) or {})
+        return kwargs
+
+    def _http(self):
+        if self.session is not None:
+            return self.session
+        import httpx
+
+        return httpx
+
+    def upload(self, client, image: Image.Image) -> Optional[dict]:
+        """Upload the encoded image and return the file value to pass to `client.predict`, or None on failure.
+        The value carries no gradio.FileData meta, so gradio_client sends it as is instead of uploading it again."""
+        upload_url = getattr(client, "upload_url", None)
+        if upload_url is None:
+            return None
+        data = self.encode(image)
+        filename = f"{uuid.uuid4().hex}{EXTENSIONS[self.format]}"
+        try:
+            response = self._http().post(upload_url, files=[("files", (filename, data, MIME_TYPES[self.format]))],
+                                  timeout=self.timeout, **self._request_kwargs(client))
+            response.raise_for_status()
+            server_path = response.json()[0]
+        except Exception as e:
+            print(f"[IMAGE_TRANSPORT] Upload failed, falling back to a temp file: {e}")
+            return None
+        return {"path": server_path, "orig_name": filename, "size": len(data), "mime_type": MIME_TYPES[self.format]}
+
+    def fetch(self, client, output) -> bytes:
+        """Bytes of a file output: a FileData dict (download_files=False) or a local path (downloaded by gradio_client)."""
+        if isinstance(output, dict):
+            url = output.get("url")
+            if url:
+                response = self._http().get(url, timeout=self.timeout, **self._request_kwargs(client))
+                response.raise_for_status()
+                return response.content
+            output = output["path"]
+        with open(output, "rb") as f:
+            return f.read()
+
+    @staticmethod
+    def decode(data: bytes) -> Image.Image:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        return image
+
+    def download_image(self, client, output) -> Image.Image:
+        return self.decode(self.fetch(client, output))
+
+    def download_json(self, client, output):
+        """A JSON output, either already parsed or a file."""
+        if isinstance(output, (dict, list)) and not (isinstance(output, dict) and ("url" in output or "path" in output)):
+            return output
+        return json.loads(self.fetch(client, output))
@@ -0,0 +1,246 @@
+import os
+import queue
+import threading
+from multiprocessing import util as mp_util
+
+from autogen.coding import CodeBlock
+from autogen.coding.jupyter import JupyterCodeExecutor, LocalJupyterServer
+
+from execution import build_init_code
+
+
+# Prints the resident memory of the kernel process in bytes.
+# psutil gives the current RSS; the resource fallback only knows the peak (in KB on Linux).
+MEMORY_PROBE_CODE = (
+    "try:\n"
+    "    import psutil as _vsp_psutil\n"
+    "    print(_vsp_psutil.Process().memory_info().rss)\n"
+    "except ImportError:\n"
+    "    import resource as _vsp_resource\n"
+    "    print(_vsp_resource.getrusage(_vsp_resource.RUSAGE_SELF).ru_maxrss * 1024)\n"
+)
+
+
+class PooledKernel:
+    # A jupyter kernel that outlives a single task. It is handed to one CodeExecutor at a time.
+
+    def __init__(self, server: LocalJupyterServer, warm_code: str):
+        self.executor = JupyterCodeExecutor(server, output_dir=".")
+        self.warm_code = warm_code
+        self.n_tasks = 0
+        self.broken = False
+        self.run(warm_code)
+
+    def run(self, code: str):
+        self.executor._jupyter_kernel_client = self.executor._jupyter_client.get_kernel_client(self.executor._kernel_id)
+        return self.executor.execute_code_blocks([CodeBlock(language="python", code=code)])
+
+    def reset(self, working_dir: str, use_custom_tools: bool):
+        """Clear the user namespace and bring the kernel back to the state a fresh kernel would have.
+        Imported modules stay in sys.modules, so re-running the init code is cheap."""
+        self.executor._output_dir = working_dir
+        reset_code = ("%reset -f\n"
+                      "import os\n"
+                      f"os.chdir({os.getcwd()!r})\n"
+                      f"os.environ['VSP_WORKING_DIR'] = {working_dir!r}\n")
+        result = self.run(reset_code + build_init_code(use_custom_tools))
+        if result.exit_code != 0:
+            raise RuntimeError(f"Failed to reset pooled kernel: {result.output}")
+
+    def memory_mb(self):
+        result = self.run(MEMORY_PROBE_CODE)
+        if result.exit_code != 0:
+            return None
+        try:
+            return int(result.output.strip().split("\n")[-1]) / (1024 * 1024)
+        except ValueError:
+            return None
+
+    def recycle(self):
+        self.executor.restart()
+        self.n_tasks = 0
+        self.broken = False
+        self.run(self.warm_code)
+
+    def stop(self):
+        self.executor.stop()
+
+
+class KernelPool:
+    """A pool of pre-warmed jupyter kernels shared by the tasks of one process.
+
+    All kernels live in one LocalJupyterServer and import PIL, IPython and (optionally) the tools
+    once at start. A task leases a kernel with `acquire`, which resets the namespace, the working
+    directory and VSP_WORKING_DIR, and gives it back with `release`. A kernel is restarted after
+    `max_tasks_per_kernel` tasks, or when its memory grows past `max_memory_mb`.
+    """
+
+    def __init__(self, size: int = 1, use_custom_tools: bool = True,
+                 max_tasks_per_kernel: int = 20, max_memory_mb: float = 4096):
+        self.size = size
+        self.max_tasks_per_kernel = max_tasks_per_kernel
+        self.max_memory_mb = max_memory_mb
+        self.warm_code = build_init_code(use_custom_tools)
+
+        self.server = LocalJupyterServer()
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._kernels = []
+        # slots reserved for kernels being started, outside the lock
+        self._starting = 0
+        self._closed = False
+
+    def _reserve_slot(self):
+        # with self._lock held: whether the pool has room for one more kernel, which the caller then starts
+        if len(self._kernels) + self._starting < self.size:
+            self._starting += 1
+            return True
+        return False
+
+    def _start_kernel(self):
+        # start and warm a kernel for a reserved slot. It takes seconds, so the lock is only held to add it.
+        try:
+            kernel = PooledKernel(self.server, self.warm_code)
+        except BaseException:
+            with self._lock:
+                self._starting -= 1
+            raise
+        with self._lock:
+            self._starting -= 1
+            closed = self._closed
+            if not closed:
+                self._kernels.append(kernel)
+        if closed:
+            kernel.stop()
+            raise RuntimeError("The kernel pool is closed.")
+        return kernel
+
+    def acquire(self, working_dir: str, use_custom_tools: bool = False) -> PooledKernel:
+        """Lease a kernel for one task. Blocks until one is free if all `size` kernels are in use."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The kernel pool is closed.")
+            kernel = None
+            start = False
+            try:
+                kernel = self._idle.get_nowait()
+            except queue.Empty:
+                start = self._reserve_slot()
+        if start:
+            kernel = self._start_kernel()
+        while kernel is None:
+            try:
+                kernel = self._idle.get(timeout=1.0)
+            except queue.Empty:
+                # a kernel that was dropped frees its slot
+                with self._lock:
+                    if self._closed:
+                        raise RuntimeError("The kernel pool is closed.")
+                    start = self._reserve_slot()
+                if start:
+                    kernel = self._start_kernel()
+
+        try:
+            kernel.reset(working_dir, use_custom_tools)
+        except Exception as e:
+            print(f"[KERNEL_POOL] Reset failed, restarting kernel: {e}")
+            try:
+                kernel.recycle()
+                kernel.reset(working_dir, use_custom_tools)
+            except BaseException:
+                # drop the kernel so its slot can be filled by a new one, otherwise the pool shrinks for good
+                print("[KERNEL_POOL] Restarted kernel failed too, dropping it")
+                self._discard(kernel)
+                raise
+        return kernel
+
+    def _discard(self, kernel: PooledKernel):
+        with self._lock:
+            if kernel in self._kernels:
+                self._kernels.remove(kernel)
+        try:
+            kernel.stop()
+        except Exception:
+            pass
+
+    def release(self, kernel: PooledKernel):
+        """Give a kernel back to the pool, restarting it first if it is due for recycling.
+        A kernel given back after `close` is stopped."""
+        if self._closed:
+            self._discard(kernel)
+            return
+        kernel.n_tasks += 1
+        reason = None
+        if kernel.broken:
+            reason = "broken"
+        elif kernel.n_tasks >= self.max_tasks_per_kernel:
+            reason = f"served {kernel.n_tasks} tasks"
+        elif self.max_memory_mb:
+            memory_mb = kernel.memory_mb()
+            if memory_mb is None:
+                reason = "memory probe failed"
+            elif memory_mb > self.max_memory_mb:
+                reason = f"memory {memory_mb:.0f} MB > {self.max_memory_mb} MB"
+
+        if reason is not None:
+            print(f"[KERNEL_POOL] Recycling kernel ({reason})")
+            try:
+                kernel.recycle()
+            except Exception as e:
+                print(f"[KERNEL_POOL] Restart failed, replacing kernel: {e}")
+                with self._lock:
+                    if kernel in self._kernels:
+                        self._kernels.remove(kernel)
+                    start = not self._closed and self._reserve_slot()
+                try:
+                    kernel.stop()
+                except Exception:
+                    pass
+                if not start:
+                    return
+                try:
+                    kernel = self._start_kernel()
+                except Exception as e:
+                    # the slot stays free, the next acquire starts a kernel
+                    print(f"[KERNEL_POOL] Starting the replacement kernel failed: {e}")
+                    return
+        with self._lock:
+            if not self._closed:
+                self._idle.put(kernel)
+                return
+        # closed while the kernel was being checked or recycled
+        self._discard(kernel)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for kernel in list(self._kernels):
+            try:
+                kernel.stop()
+            except Exception:
+                pass
+        self.server.stop()
+
+
+_default_pool = None
+
+
+def get_default_pool(size=None):
+    """The per-process kernel pool built from KERNEL_POOL_CONFIG, or None if pooling is disabled.
+    `size` overrides the configured size, it only has an effect when the pool is first created."""
+    global _default_pool
+    from config import KERNEL_POOL_CONFIG
+
+    if not KERNEL_POOL_CONFIG.get("enabled", False):
+        return None
+    if _default_pool is None:
+        _default_pool = KernelPool(
+            size=size or KERNEL_POOL_CONFIG.get("size", 1),
+            max_tasks_per_kernel=KERNEL_POOL_CONFIG.get("max_tasks_per_kernel", 20),
+            max_memory_mb=KERNEL_POOL_CONFIG.get("max_memory_mb", 4096),
+        )
+        # atexit does not run in multiprocessing workers, multiprocessing finalizers do
+        mp_util.Finalize(_default_pool, _default_pool.close, exitpriority=10)
+    return _default_pool
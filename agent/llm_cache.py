@@ -0,0 +1,115 @@
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from image_encoding import image_content_hash, ImageSendPolicy
+
+MODES = ("record", "replay", "bypass")
+
+
+class CompletionCacheMiss(Exception):
+    """Raised in replay mode when a request has no recorded completion."""
+
+
+def _normalize(obj):
+    # PIL images are replaced by their content hash, so the key does not depend on the base64 encoding
+    if isinstance(obj, Image.Image):
+        return {"image": image_content_hash(obj)}
+    if isinstance(obj, dict):
+        return {k: _normalize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_normalize(v) for v in obj]
+    return obj
+
+
+def _request_params(llm_config: Dict) -> Dict:
+    # everything that changes the completion: the model and the sampling parameters, without credentials
+    params = {k: v for k, v in (llm_config or {}).items() if k not in ("config_list", "cache_seed")}
+    params["config_list"] = [{k: v for k, v in config.items() if k != "api_key"}
+                             for config in (llm_config or {}).get("config_list", [])]
+    return params
+
+
+class CompletionCache:
+    """Disk-backed cache of LLM completions, shared by all the processes that use the same directory.
+
+    The key is a hash of the model and request parameters (without the API key), the image send
+    policy, and the messages as they are sent, with images hashed by their pixels. The stored value
+    is the extracted reply, so a hit skips both the image encoding and the request.
+
+    Modes:
+        record: serve hits from the cache, call the LLM on a miss and store the reply.
+        replay: serve hits from the cache, raise CompletionCacheMiss on a miss. Runs are fully offline.
+        bypass: don't use the cache.
+
+    Entries are evicted least-recently-used once the cache is larger than `max_size_mb`.
+    """
+
+    def __init__(self, directory: str, mode: str = "record", max_size_mb: float = 2048):
+        if mode not in MODES:
+            raise ValueError(f"Unsupported LLM cache mode: {mode}. Choose from {MODES}")
+        import diskcache
+
+        self.directory = directory
+        self.mode = mode
+        self.max_size_mb = max_size_mb
+        self._cache = diskcache.Cache(directory, size_limit=int(max_size_mb * 1024 * 1024),
+                                      eviction_policy="least-recently-used")
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "CompletionCache":
+        return cls(
+            directory=config["directory"],
+            mode=config.get("mode", "record"),
+            max_size_mb=config.get("max_size_mb", 2048),
+        )
+
+    @staticmethod
+    def make_key(llm_config: Dict, messages: List[Dict], image_policy: Optional[ImageSendPolicy] = None) -> str:
+        policy = image_policy or ImageSendPolicy()
+        payload = {
+            "params": _request_params(llm_config),
+            "image_policy": [policy.max_long_side, policy.format, policy.quality, policy.detail],
+            "messages": _normalize(messages),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def lookup(self, key: str):
+        """Return the recorded reply for `key`, or None on a miss (raises CompletionCacheMiss in replay mode)."""
+        if self.mode == "bypass":
+            return None
+        entry = self._cache.get(key)
+        if entry is None:
+            if self.mode == "replay":
+                raise CompletionCacheMiss(f"No recorded completion for request {key[:12]} in {self.directory}")
+            return None
+        return entry["reply"]
+
+    def store(self, key: str, reply):
+        if self.mode != "record":
+            return
+        self._cache.set(key, {"reply": reply, "time": time.time()})
+
+    def clear(self):
+        self._cache.clear()
+
+    def close(self):
+        self._cache.close()
+
+
+_default_cache = None
+
+
+def get_default_cache():
+    """The per-process completion cache built from LLM_CACHE_CONFIG, or None in bypass mode."""
+    global _default_cache
+    from config import LLM_CACHE_CONFIG
+
+    if LLM_CACHE_CONFIG.get("mode", "bypass") == "bypass":
+        return None
+    if _default_cache is None:
+        _default_cache = CompletionCache.from_config(LLM_CACHE_CONFIG)
+    return _default_cache
@@ -6,6 +6,9 @@ warnings.filterwarnings("ignore", message="flaml.automl is not available.*")
 
 import json
 import os
+import asyncio
+import threading
+import time
 import argparse, shutil
 
 from agent import SketchpadUserAgent
@@ -14,7 +17,12 @@ from prompt import ReACTPrompt, MathPrompt, GeoPrompt, python_codes_for_images_r
 from parse import Parser
 from execution import CodeExecutor
 from utils import custom_encoder
-from config import MAX_REPLY, llm_config
+from image_encoding import ImageSendPolicy
+from compaction import HistoryCompactor
+from trace_writer import TraceWriter
+from llm_cache import get_default_cache
+import spans
+from config import MAX_REPLY, llm_config, IMAGE_POLICY_CONFIG, HISTORY_COMPACTION_CONFIG, TRACE_CONFIG
 
 
 def checks_terminate_message(msg):
@@ -27,17 +35,12 @@ def checks_terminate_message(msg):
         raise NotImplementedError
 
 
-def run_agent(task_input, output_dir, task_type="vision", task_name=None, model=None):
-    """Run the Visual Sketchpad agent on one task instance.
+def _task_directory(task_input, output_dir):
+    return os.path.join(output_dir, os.path.basename(task_input.rstrip('/')))
 
-    Args:
-        task_input (str): a path to the task input directory
-        output_dir (str): a path to the directory where the output will be saved
-        task_type (str): Task type. Should be vision, math, or geo. Defaults to "vision".
-        task_name (str, optional): Only needed for math tasks. Defaults to None.
-        model (str, optional): Model name to use (e.g., "google/gemini-2.5-flash"). 
-            If provided, overrides the model in config.py. Defaults to None.
-    """
+
+def _setup_agents(task_input, output_dir, task_type, task_name, model, kernel_pool):
+    # build the executor, the user agent and the planner for one task instance
     
     # Override model if provided
     if model:
@@ -48,7 +51,7 @@ def run_agent(task_input, output_dir, task_type="vision", task_name=None, model=
     
     # create a directory for the task
     task_input = task_input.rstrip('/')
-    task_directory = os.path.join(output_dir, os.path.basename(task_input))
+    task_directory = _task_directory(task_input, output_dir)
     
     # copy the task input to the output directory
     os.makedirs(output_dir, exist_ok=True)
@@ -57,10 +60,9 @@ def run_agent(task_input, output_dir, task_type="vision", task_name=None, model=
     
     if task_type == "vision":
         
-        # test if vision tools are loaded
-        try:
-            from tools import som_client, gd_client, da_client
-        except ImportError as e:
+        # test if vision tools are loaded. The expert servers are only contacted when a tool is used.
+        from tools import VISION_TOOLS_AVAILABLE
+        if not VISION_TOOLS_AVAILABLE:
             raise ImportError("Vision tools are not loaded. Please install vision_experts.")
         
         task_metadata = json.load(open(os.path.join(task_input, "request.json")))
@@ -69,84 +71,203 @@ def run_agent(task_input, output_dir, task_type="vision", task_name=None, model=
     
         prompt_generator = ReACTPrompt()
         parser = Parser()
-        executor = CodeExecutor(working_dir=task_directory, use_custom_tools=True)
-        
-        # read all images, save them in image_1, image_2, ... as PIL images
-        image_reading_codes = python_codes_for_images_reading(images)
-        image_loading_result = executor.execute(image_reading_codes)
-        if image_loading_result[0] != 0:
-            raise Exception(f"Error loading images: {image_loading_result[1]}")
+        executor = CodeExecutor(working_dir=task_directory, use_custom_tools=True, kernel_pool=kernel_pool)
         
     elif task_type == "math":
         query = json.load(open(os.path.join(task_input, "example.json")))
         images = []
         prompt_generator = MathPrompt(task_name)
         parser = Parser()
-        executor = CodeExecutor(working_dir=task_directory)
+        executor = CodeExecutor(working_dir=task_directory, kernel_pool=kernel_pool)
         
     elif task_type == "geo":
         query = json.load(open(os.path.join(task_input, "ex.json")))
         images = []
         prompt_generator = GeoPrompt()
         parser = Parser()
-        executor = CodeExecutor(working_dir=task_directory, use_custom_tools=True)
-    
-    user = SketchpadUserAgent(
-        name="multimodal_user_agent",
-        human_input_mode='NEVER',
-        max_consecutive_auto_reply=MAX_REPLY,
-        is_termination_msg=checks_terminate_message,
-        prompt_generator = prompt_generator,
-        parser = parser,
-        executor = executor
-    )
+        executor = CodeExecutor(working_dir=task_directory, use_custom_tools=True, kernel_pool=kernel_pool)
     
-    # running the planning experiment
-    all_messages = {}
-    
-    # Log the model being used
-    model_name = llm_config.get('config_list', [{}])[0].get('model', 'unknown')
-    print(f"\n{'='*60}")
-    print(f"🤖 Using Model: {model_name}")
-    print(f"{'='*60}\n")
-    
-    planner = MultimodalConversableAgent(
-        name="planner",
-        human_input_mode='NEVER',
-        max_consecutive_auto_reply=MAX_REPLY,
-        is_termination_msg = lambda x: False,
-        system_message=MULTIMODAL_ASSISTANT_MESSAGE,
-        llm_config=llm_config
-    )
-    
-    # run the agent
+    # from here on, a failure must give the executor's kernel back (or stop its server)
     try:
-        user.initiate_chat(
-            planner,
-            n_image=len(images),
-            task_id = "testing_case",
-            message = query,
-            log_prompt_only = False,
+        if task_type == "vision":
+            # read all images, save them in image_1, image_2, ... as PIL images
+            image_reading_codes = python_codes_for_images_reading(images)
+            image_loading_result = executor.execute(image_reading_codes)
+            if image_loading_result[0] != 0:
+                raise Exception(f"Error loading images: {image_loading_result[1]}")
+        
+        user = SketchpadUserAgent(
+            name="multimodal_user_agent",
+            human_input_mode='NEVER',
+            max_consecutive_auto_reply=MAX_REPLY,
+            is_termination_msg=checks_terminate_message,
+            prompt_generator = prompt_generator,
+            parser = parser,
+            executor = executor
         )
-        all_messages = planner.chat_messages[user]
         
-    except Exception as e:
-        print(e)
-        all_messages = {'error': e.message if hasattr(e, 'message') else f"{e}"}
+        # Log the model being used
+        model_name = llm_config.get('config_list', [{}])[0].get('model', 'unknown')
+        print(f"\n{'='*60}")
+        print(f"🤖 Using Model: {model_name}")
+        print(f"{'='*60}\n")
         
+        planner = MultimodalConversableAgent(
+            name="planner",
+            human_input_mode='NEVER',
+            max_consecutive_auto_reply=MAX_REPLY,
+            is_termination_msg = lambda x: False,
+            system_message=MULTIMODAL_ASSISTANT_MESSAGE,
+            image_policy=ImageSendPolicy.from_config(IMAGE_POLICY_CONFIG),
+            history_compactor=HistoryCompactor.from_config(HISTORY_COMPACTION_CONFIG) if HISTORY_COMPACTION_CONFIG["enabled"] else None,
+            completion_cache=get_default_cache(),
+            trace_writer=TraceWriter(task_directory, task_input=task_input, task_type=task_type, model=model_name),
+            llm_config=llm_config
+        )
+    except BaseException:
+        executor.cleanup()
+        raise
     
-    # save the results
-    with open(os.path.join(task_directory, "output.json"), "w") as f:
-        json.dump(all_messages, f, indent=4, default=custom_encoder)
+    return user, planner, query, images, task_directory
+
+
+def _save_results(user, planner, task_directory, all_messages, started):
+    # the messages are already in trace.jsonl, only the outcome is left to record
+    if isinstance(all_messages, dict) and 'error' in all_messages:
+        planner.trace_writer.write_event("error", error=all_messages['error'])
+    if TRACE_CONFIG["write_output_json"]:
+        with open(os.path.join(task_directory, "output.json"), "w") as f:
+            json.dump(all_messages, f, indent=4, default=custom_encoder)
         
-    usage_summary = {'total': planner.client.total_usage_summary, 'actual': planner.client.actual_usage_summary}
+    usage_summary = {'total': planner.client.total_usage_summary, 'actual': planner.client.actual_usage_summary,
+                     'image_encoding': planner.image_cache.summary()}
+    if planner.history_compactor is not None:
+        usage_summary['compaction'] = planner.history_compactor.summary()
+    if planner.completion_cache is not None:
+        usage_summary['llm_cache'] = dict(planner.completion_cache_stats, mode=planner.completion_cache.mode)
     with open(os.path.join(task_directory, "usage_summary.json"), "w") as f:
         json.dump(usage_summary, f, indent=4)
+    
+    # written last, so a trace with an end record means the instance is complete
+    planner.trace_writer.write_event("end", n_messages=len(all_messages) if isinstance(all_messages, list) else 0,
+                                     phases=spans.summarize_spans(task_directory, since=started))
+
+
+def _outcome(all_messages):
+    # the error of a conversation is saved with the results rather than raised, report it to the caller
+    if isinstance(all_messages, dict) and 'error' in all_messages:
+        return {"status": "failed", "error": all_messages['error']}
+    return {"status": "done"}
+
+
+def _release_agents(user, planner):
+    # always runs after a task, even if the chat or saving the results failed
+    planner.trace_writer.close()
         
-    # turn off server
+    # turn off server, or give the kernel back to the pool
     user.executor.cleanup()
         
     user.reset()
     planner.reset()
+
+
+def run_agent(task_input, output_dir, task_type="vision", task_name=None, model=None, kernel_pool=None):
+    """Run the Visual Sketchpad agent on one task instance.
+
+    Args:
+        task_input (str): a path to the task input directory
+        output_dir (str): a path to the directory where the output will be saved
+        task_type (str): Task type. Should be vision, math, or geo. Defaults to "vision".
+        task_name (str, optional): Only needed for math tasks. Defaults to None.
+        model (str, optional): Model name to use (e.g., "google/gemini-2.5-flash"). 
+            If provided, overrides the model in config.py. Defaults to None.
+        kernel_pool (KernelPool, optional): Lease a warm jupyter kernel from this pool instead of
+            starting a new jupyter server for the task. Defaults to None.
+
+    Returns:
+        dict: {"status": "done"}, or {"status": "failed", "error": ...} if the conversation raised.
+            The error is also recorded in the trace and output.json.
+    """
     
-    
\ No newline at end of file
+    # the spans of this conversation go to spans.jsonl in the task directory
+    started = time.time()
+    spans_token = spans.set_output(_task_directory(task_input, output_dir))
+    try:
+        user, planner, query, images, task_directory = _setup_agents(task_input, output_dir, task_type, task_name, model, kernel_pool)
+        try:
+            # running the planning experiment
+            all_messages = {}
+            
+            # run the agent
+            try:
+                user.initiate_chat(
+                    planner,
+                    n_image=len(images),
+                    task_id = "testing_case",
+                    message = query,
+                    log_prompt_only = False,
+                )
+                all_messages = planner.chat_messages[user]
+                
+            except Exception as e:
+                print(e)
+                all_messages = {'error': e.message if hasattr(e, 'message') else f"{e}"}
+                
+            
+            _save_results(user, planner, task_directory, all_messages, started)
+        finally:
+            _release_agents(user, planner)
+    finally:
+        spans.reset_output(spans_token)
+    return _outcome(all_messages)
+
+
+# without a kernel pool, a new jupyter server inherits VSP_WORKING_DIR from os.environ when it starts,
+# so concurrent setups in one process must not interleave
+_setup_lock = threading.Lock()
+
+
+def _locked_setup_agents(*args):
+    with _setup_lock:
+        return _setup_agents(*args)
+
+
+async def a_run_agent(task_input, output_dir, task_type="vision", task_name=None, model=None, kernel_pool=None):
+    """(async) Run the Visual Sketchpad agent on one task instance.
+    Takes the same arguments and returns the same outcome as `run_agent`. Code execution and LLM calls are awaited, so many
+    task instances can run concurrently on one event loop. Pass a kernel pool with one kernel
+    per concurrent instance, otherwise every instance starts its own jupyter server.
+    """
+    # each instance runs in its own asyncio task, so this only affects this conversation
+    started = time.time()
+    spans_token = spans.set_output(_task_directory(task_input, output_dir))
+    try:
+        setup = _setup_agents if kernel_pool is not None else _locked_setup_agents
+        user, planner, query, images, task_directory = await asyncio.to_thread(
+            setup, task_input, output_dir, task_type, task_name, model, kernel_pool)
+        try:
+            # running the planning experiment
+            all_messages = {}
+            
+            # run the agent
+            try:
+                await user.a_initiate_chat(
+                    planner,
+                    n_image=len(images),
+                    task_id = "testing_case",
+                    message = query,
+                    log_prompt_only = False,
+                )
+                all_messages = planner.chat_messages[user]
+                
+            except Exception as e:
+                print(e)
+                all_messages = {'error': e.message if hasattr(e, 'message') else f"{e}"}
+                
+            
+            await asyncio.to_thread(_save_results, user, planner, task_directory, all_messages, started)
+        finally:
+            await asyncio.to_thread(_release_agents, user, planner)
+    finally:
+        spans.reset_output(spans_token)
+    return _outcome(all_messages)
@@ -1,16 +1,21 @@
+import asyncio
 import copy
 from typing import Dict, List, Optional, Tuple, Union
 
 from autogen.oai.client import OpenAIWrapper
 from autogen.agentchat import Agent, ConversableAgent
-from autogen.agentchat.contrib.img_utils import (
-    gpt4v_formatter,
-    message_formatter_pil_to_b64,
-)
+from autogen.agentchat.contrib.img_utils import gpt4v_formatter
 from autogen.code_utils import content_str
 
 from autogen._pydantic import model_dump
 
+from async_llm import call_with_limits, provider_key
+from image_encoding import ImageEncodingCache, ImageSendPolicy
+from compaction import HistoryCompactor
+from trace_writer import TraceWriter
+from llm_cache import CompletionCache
+from spans import span
+
 DEFAULT_LMM_SYS_MSG = """You are a helpful AI assistant."""
 DEFAULT_MODEL = "gpt-4-turbo"
 
@@ -25,6 +30,10 @@ class MultimodalConversableAgent(ConversableAgent):
         name: str,
         system_message: Optional[Union[str, List]] = DEFAULT_LMM_SYS_MSG,
         is_termination_msg: str = None,
+        image_policy: Optional[ImageSendPolicy] = None,
+        history_compactor: Optional[HistoryCompactor] = None,
+        trace_writer: Optional[TraceWriter] = None,
+        completion_cache: Optional[CompletionCache] = None,
         *args,
         **kwargs,
     ):
@@ -33,6 +42,14 @@ class MultimodalConversableAgent(ConversableAgent):
             name (str): agent name.
             system_message (str): system message for the OpenAIWrapper inference.
                 Please override this attribute if you want to reprogram the agent.
+            image_policy (ImageSendPolicy): how images are resized and encoded in the LLM requests.
+                Defaults to full-size PNG.
+            history_compactor (HistoryCompactor): shrinks older images and observations before each LLM call.
+                Defaults to None, which sends the full history.
+            trace_writer (TraceWriter): appends every message of the conversation to a trace file as it happens.
+                Defaults to None.
+            completion_cache (CompletionCache): serves and records LLM replies for identical requests.
+                Defaults to None.
             **kwargs (dict): Please refer to other kwargs in
                 [ConversableAgent](../conversable_agent#__init__).
         """
@@ -51,6 +68,13 @@ class MultimodalConversableAgent(ConversableAgent):
             else (lambda x: content_str(x.get("content")) == "TERMINATE")
         )
 
+        # base64 encodings of the images in this conversation, so each image is encoded only once
+        self.image_cache = ImageEncodingCache(image_policy)
+        self.history_compactor = history_compactor
+        self.trace_writer = trace_writer
+        self.completion_cache = completion_cache
+        self.completion_cache_stats = {"hits": 0, "misses": 0}
+
         # Override the `generate_oai_reply`
         self.replace_reply_func(ConversableAgent.generate_oai_reply, MultimodalConversableAgent.generate_oai_reply)
         self.replace_reply_func(
@@ -58,6 +82,22 @@ class MultimodalConversableAgent(ConversableAgent):
             MultimodalConversableAgent.a_generate_oai_reply,
         )
 
+    def reset(self):
+        """Reset the agent, including the image encoding cache, the compaction log and the completion cache counters."""
+        super().reset()
+        self.image_cache.clear()
+        self.completion_cache_stats = {"hits": 0, "misses": 0}
+        if self.history_compactor is not None:
+            self.history_compactor.clear()
+
+    def _append_oai_message(self, message: Union[Dict, str], role, conversation_id: Agent) -> bool:
+        """Append a message to the chat history, and to the trace if there is one."""
+        appended = super()._append_oai_message(message, role, conversation_id)
+        if appended and self.trace_writer is not None:
+            sender = self.name if role == "assistant" else conversation_id.name
+            self.trace_writer.write_message(self._oai_messages[conversation_id][-1], sender=sender)
+        return appended
+
     def update_system_message(self, system_message: Union[Dict, List, str]):
         """Update the system message.
 
@@ -95,26 +135,73 @@ class MultimodalConversableAgent(ConversableAgent):
             return message
         raise ValueError(f"Unsupported message type: {type(message)}")
 
-    def generate_oai_reply(
-        self,
-        messages: Optional[List[Dict]] = None,
-        sender: Optional[Agent] = None,
-        config: Optional[OpenAIWrapper] = None,
-    ) -> Tuple[bool, Union[str, Dict, None]]:
-        """Generate a reply using autogen.oai."""
+    def _prepare_oai_request(self, messages, sender, config):
+        # everything before the LLM call, done once per reply and not again when the call is retried:
+        # the context is popped off the last message and the request is looked up in the completion cache.
+        # Returns (reply, None) if the reply is known without calling the LLM, else (None, request).
         client = self.client if config is None else config
         if client is None:
-            return False, None
+            return (False, None), None
         if messages is None:
             messages = self._oai_messages[sender]
 
-        messages_with_b64_img = message_formatter_pil_to_b64(self._oai_system_message + messages)
+        # the stored history is left as is, only the request is compacted
+        messages_to_send = messages if self.history_compactor is None else self.history_compactor.compact(messages)
+        context = messages[-1].pop("context", None)
 
+        cache_key = None
+        if self.completion_cache is not None:
+            cache_key = self.completion_cache.make_key(self.llm_config, self._oai_system_message + messages_to_send,
+                                                       self.image_cache.policy)
+            cached_reply = self.completion_cache.lookup(cache_key)
+            if cached_reply is not None:
+                self.completion_cache_stats["hits"] += 1
+                return (True, cached_reply), None
+            self.completion_cache_stats["misses"] += 1
+
+        messages_with_b64_img = self.image_cache.format_messages(self._oai_system_message + messages_to_send)
+        return None, {"client": client, "context": context, "messages": messages_with_b64_img, "cache_key": cache_key}
+
+    def _create(self, request):
+        # the LLM call itself, the only part that is retried
         # TODO: #1143 handle token limit exceeded error
-        response = client.create(context=messages[-1].pop("context", None), messages=messages_with_b64_img)
+        model = ((self.llm_config or {}).get("config_list") or [{}])[0].get("model")
+        with span("llm_call", model=model):
+            return request["client"].create(context=request["context"], messages=request["messages"])
 
+    def _finish_oai_reply(self, request, response):
+        client = request["client"]
         # TODO: line 301, line 271 is converting messages to dict. Can be removed after ChatCompletionMessage_to_dict is merged.
         extracted_response = client.extract_text_or_completion_object(response)[0]
         if not isinstance(extracted_response, str):
             extracted_response = model_dump(extracted_response)
+        if request["cache_key"] is not None:
+            self.completion_cache.store(request["cache_key"], extracted_response)
         return True, extracted_response
+
+    def generate_oai_reply(
+        self,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[OpenAIWrapper] = None,
+    ) -> Tuple[bool, Union[str, Dict, None]]:
+        """Generate a reply using autogen.oai."""
+        reply, request = self._prepare_oai_request(messages, sender, config)
+        if request is None:
+            return reply
+        return self._finish_oai_reply(request, self._create(request))
+
+    async def a_generate_oai_reply(
+        self,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[OpenAIWrapper] = None,
+    ) -> Tuple[bool, Union[str, Dict, None]]:
+        """Generate a reply using autogen.oai asynchronously.
+        The request is prepared once; only the blocking client call runs within the provider's
+        concurrency limit and is retried with backoff."""
+        reply, request = await asyncio.to_thread(self._prepare_oai_request, messages, sender, config)
+        if request is None:
+            return reply
+        response = await call_with_limits(provider_key(self.llm_config), self._create, request)
+        return await asyncio.to_thread(self._finish_oai_reply, request, response)
@@ -82,22 +82,24 @@ def apply_postprocess(image, bboxes, tool_name="unknown"):
         
         # Handle AnnotatedImage wrapper
         from tools import AnnotatedImage
-        if isinstance(image, AnnotatedImage):
-            # Process the annotated image
-            processed = processor.process(
-                image.annotated_image, 
-                bboxes,
-                {"tool_name": tool_name, "image_size": image.annotated_image.size}
-            )
-            # Return wrapped result
-            return AnnotatedImage(processed, image.original_image)
-        else:
-            # Process regular PIL image
-            return processor.process(
-                image, 
-                bboxes, 
-                {"tool_name": tool_name, "image_size": image.size}
-            )
+        from spans import span
+        with span("postprocess", tool=tool_name, backend=backend):
+            if isinstance(image, AnnotatedImage):
+                # Process the annotated image
+                processed = processor.process(
+                    image.annotated_image, 
+                    bboxes,
+                    {"tool_name": tool_name, "image_size": image.annotated_image.size}
+                )
+                # Return wrapped result
+                return AnnotatedImage(processed, image.original_image)
+            else:
+                # Process regular PIL image
+                return processor.process(
+                    image, 
+                    bboxes, 
+                    {"tool_name": tool_name, "image_size": image.size}
+                )
     
     except Exception as e:
         print(f"[POST_PROCESSOR_ERROR] {e}")
@@ -1,36 +1,178 @@
-from main import run_agent
-import os, glob, argparse
+from main import run_agent, a_run_agent
+from kernel_pool import get_default_pool
+from trace_writer import trace_outcome
+import os, glob, json, time, argparse
+import asyncio
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from tqdm import tqdm
 
-def run_task(task, output_dir, task_type="vision", task_name=None):
-    all_task_instances = glob.glob(f"../tasks/{task}/processed/*/" if task_type == "vision" else f"../tasks/{task}/*/")
+# every finished instance (done or failed) is appended here, one JSON record per line
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def instance_is_done(task_instance, output_dir, retry_failed=False):
+    """An instance is considered finished once its trace has an end record
+    (or, for outputs written before traces existed, once its output.json has been written).
+    With retry_failed, an instance whose conversation failed is not finished."""
+    task_directory = os.path.join(output_dir, os.path.basename(task_instance.rstrip('/')))
+    outcome = trace_outcome(task_directory)
+    if outcome is not None:
+        return outcome == "done" or not retry_failed
+    output_path = os.path.join(task_directory, "output.json")
+    if not os.path.exists(output_path):
+        return False
+    if retry_failed:
+        with open(output_path) as f:
+            return "error" not in json.load(f)
+    return True
+
+
+def task_type_of(task):
+    """Return the task type and the task name (only set for math tasks) of a task."""
+    if task in ["vstar", "blink_viscorr", "blink_semcorr", "blink_depth","blink_jigsaw", "blink_spatial", "mmvp",]:
+        return "vision", None
+    elif task in ["geometry"]:
+        return "geo", None
+    else:
+        return "math", task
+
+
+def run_instance(task_instance, output_dir, task_type="vision", task_name=None):
+    """Run one task instance and return a manifest record, "failed" if the conversation or the
+    setup raised. Never raises, so one broken instance does not take the whole sweep down."""
+    start = time.time()
+    record = {"instance": task_instance.rstrip('/'), "pid": os.getpid()}
+    try:
+        # every process keeps its own pool of warm kernels across the instances it runs
+        outcome = run_agent(task_instance, output_dir, task_type=task_type, task_name=task_name, kernel_pool=get_default_pool())
+        record.update(outcome)
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.time() - start, 2)
+    return record
+
+
+async def a_run_instance(task_instance, output_dir, task_type="vision", task_name=None, kernel_pool=None):
+    """(async) Same as `run_instance`, for instances multiplexed on one event loop."""
+    start = time.time()
+    record = {"instance": task_instance.rstrip('/'), "pid": os.getpid()}
+    try:
+        outcome = await a_run_agent(task_instance, output_dir, task_type=task_type, task_name=task_name, kernel_pool=kernel_pool)
+        record.update(outcome)
+    except Exception as e:
+        record["status"] = "failed"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.time() - start, 2)
+    return record
+
+
+async def _a_run_instances(pending_instances, output_dir, task_type, task_name, concurrency, manifest_path):
+    # LLM calls and kernel executions run in worker threads, make sure they do not starve each other
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * concurrency + 4))
+    kernel_pool = get_default_pool(size=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    with tqdm(total=len(pending_instances)) as progress:
+        async def run_one(task_instance):
+            async with semaphore:
+                record = await a_run_instance(task_instance, output_dir, task_type, task_name, kernel_pool)
+            _append_manifest(manifest_path, record)
+            if record["status"] != "done":
+                print(f"Task instance failed: {record['instance']} ({record.get('error')})")
+            progress.update(1)
+
+        await asyncio.gather(*(run_one(task_instance) for task_instance in pending_instances))
+
+
+def _append_manifest(manifest_path, record):
+    with open(manifest_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def run_task(task, output_dir, task_type="vision", task_name=None, workers=1, max_pending=None, resume=True, async_chats=0,
+             retry_failed=False):
+    """Run all instances of a task.
+
+    Args:
+        task (str): task name, the folder under ../tasks
+        output_dir (str): root output directory, results go to output_dir/task
+        task_type (str): vision, math or geo
+        task_name (str, optional): only needed for math tasks
+        workers (int): number of worker processes. Each worker runs one instance at a time,
+            with its own jupyter kernel and its own task directory. 1 runs everything in this process.
+        max_pending (int, optional): bound on the number of submitted but unfinished instances.
+            Defaults to 2 * workers, so the pool never starves but the queue never holds the whole task.
+        resume (bool): skip instances that already finished
+        async_chats (int): if > 0, run up to this many conversations concurrently on one event loop
+            in this process instead of using worker processes
+        retry_failed (bool): when resuming, also rerun the instances whose conversation failed
+    """
+    all_task_instances = sorted(glob.glob(f"../tasks/{task}/processed/*/" if task_type == "vision" else f"../tasks/{task}/*/"))
     output_dir = os.path.join(output_dir, task)
-    
-    for task_instance in tqdm(all_task_instances):
-        print(f"Running task instance: {task_instance}")
-        run_agent(task_instance, output_dir, task_type=task_type, task_name=task_name)
-        break
-        
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+
+    if resume:
+        pending_instances = [t for t in all_task_instances if not instance_is_done(t, output_dir, retry_failed)]
+        print(f"Resuming {task}: {len(all_task_instances) - len(pending_instances)} done, {len(pending_instances)} to run")
+    else:
+        pending_instances = all_task_instances
+
+    if async_chats > 0:
+        asyncio.run(_a_run_instances(pending_instances, output_dir, task_type, task_name, async_chats, manifest_path))
+        return
+
+    if workers <= 1:
+        for task_instance in tqdm(pending_instances):
+            print(f"Running task instance: {task_instance}")
+            record = run_instance(task_instance, output_dir, task_type=task_type, task_name=task_name)
+            _append_manifest(manifest_path, record)
+        return
+
+    max_pending = max_pending or 2 * workers
+    instance_iter = iter(pending_instances)
+    in_flight = set()
+
+    # spawn instead of fork: the parent may hold jupyter / http client state that must not be shared
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+            tqdm(total=len(pending_instances)) as progress:
+        while True:
+            # keep the queue topped up to max_pending, but never beyond it
+            for task_instance in instance_iter:
+                in_flight.add(pool.submit(run_instance, task_instance, output_dir, task_type, task_name))
+                if len(in_flight) >= max_pending:
+                    break
+
+            if not in_flight:
+                break
+
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                _append_manifest(manifest_path, record)
+                if record["status"] != "done":
+                    print(f"Task instance failed: {record['instance']} ({record.get('error')})")
+                progress.update(1)
+
 if __name__ == "__main__":
-    
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--task", type=str, choices=["vstar", "blink_viscorr", "blink_semcorr", "blink_depth",
-                                                    "blink_jigsaw", "blink_spatial", "mmvp", 
-                                                    "geometry", 
-                                                    "graph_connectivity", "graph_isomorphism", "graph_maxflow", 
+                                                    "blink_jigsaw", "blink_spatial", "mmvp",
+                                                    "geometry",
+                                                    "graph_connectivity", "graph_isomorphism", "graph_maxflow",
                                                     "math_convexity", "math_parity", "winner_id"], help="The task name")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes running instances in parallel")
+    parser.add_argument("--max_pending", type=int, default=None, help="Maximum number of queued instances. Defaults to 2 * workers")
+    parser.add_argument("--async_chats", type=int, default=0, help="Run this many conversations concurrently on one event loop instead of using worker processes")
+    parser.add_argument("--no_resume", action="store_true", help="Rerun instances that already finished")
+    parser.add_argument("--retry_failed", action="store_true", help="When resuming, rerun the instances whose conversation failed")
     args = parser.parse_args()
-    
-    if args.task in ["vstar", "blink_viscorr", "blink_semcorr", "blink_depth","blink_jigsaw", "blink_spatial", "mmvp",]:
-        task_type = "vision"
-        task_name = None
-        
-    elif args.task in ["geometry"]:
-        task_type = "geo"
-        task_name = None
-        
-    else:
-        task_type = "math"
-        task_name = args.task
-        
-    run_task(args.task, "outputs", task_type=task_type, task_name=task_name)
+
+    task_type, task_name = task_type_of(args.task)
+    run_task(args.task, "outputs", task_type=task_type, task_name=task_name,
+             workers=args.workers, max_pending=args.max_pending, resume=not args.no_resume, async_chats=args.async_chats,
+             retry_failed=args.retry_failed)
@@ -0,0 +1,177 @@
+"""Structured timing spans for the phases of an agent turn.
+
+A span is one JSON line in spans.jsonl in the task directory:
+    {"name": "execute", "start": <unix time>, "duration": <seconds>, "pid": ..., "tid": ...,
+     "span_id": ..., "parent_id": ..., "attrs": {...}}
+
+Spans come from two processes: the agent (parse, execute, image encoding, LLM call) and the jupyter
+kernel (tool upload / inference / download, post-processing). Both append to the same file, the
+agent through `set_output` and the kernel through VSP_WORKING_DIR.
+
+Export a task's spans for chrome://tracing / Perfetto or as OpenTelemetry-style JSON with
+    python spans.py <task directory> --format chrome
+    python spans.py <task directory> --format otel
+"""
+import argparse
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+SPANS_NAME = "spans.jsonl"
+
+# the spans file of the conversation running in this context. Falls back to VSP_WORKING_DIR (kernel side).
+_output_path: contextvars.ContextVar = contextvars.ContextVar("vsp_spans_output", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("vsp_current_span", default=None)
+_write_lock = threading.Lock()
+
+
+def _enabled() -> bool:
+    from config import SPANS_CONFIG
+    return SPANS_CONFIG.get("enabled", True)
+
+
+def set_output(task_directory: Optional[str]):
+    """Send the spans of the current context (thread, or asyncio task) to `task_directory`. Returns a reset token."""
+    return _output_path.set(os.path.join(task_directory, SPANS_NAME) if task_directory else None)
+
+
+def reset_output(token):
+    _output_path.reset(token)
+
+
+def _spans_path() -> Optional[str]:
+    path = _output_path.get()
+    if path is None and os.environ.get("VSP_WORKING_DIR"):
+        path = os.path.join(os.environ["VSP_WORKING_DIR"], SPANS_NAME)
+    return path
+
+
+def _write(record: Dict):
+    path = _spans_path()
+    if path is None:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    try:
+        # one write per line on a file opened for append, so the agent and the kernel don't interleave
+        with _write_lock, open(path, "a") as f:
+            f.write(line)
+    except OSError as e:
+        print(f"[SPANS] Could not write span: {e}")
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block and record it as a span. Yields the attribute dict, so results
+    (e.g. an exit code) can be added inside the block."""
+    if not _enabled():
+        yield attrs
+        return
+    span_id = uuid.uuid4().hex[:16]
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - t0
+        _current_span.reset(token)
+        _write({"name": name, "start": round(start, 6), "duration": round(duration, 6),
+                "pid": os.getpid(), "tid": threading.get_ident(), "span_id": span_id,
+                "parent_id": parent_id, "attrs": attrs})
+
+
+def read_spans(task_directory: str) -> List[Dict]:
+    path = os.path.join(task_directory, SPANS_NAME)
+    if not os.path.exists(path):
+        return []
+    spans = []
+    with open(path) as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return sorted(spans, key=lambda s: s["start"])
+
+
+def summarize_spans(task_directory: str, since: Optional[float] = None) -> Dict:
+    """Count and total seconds per span name, for spans that started after `since`."""
+    summary = {}
+    for s in read_spans(task_directory):
+        if since is not None and s["start"] < since:
+            continue
+        entry = summary.setdefault(s["name"], {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] = round(entry["seconds"] + s["duration"], 6)
+    return summary
+
+
+def to_chrome_trace(spans: List[Dict]) -> Dict:
+    """Chrome trace event format (complete events), loadable in chrome://tracing and Perfetto."""
+    events = [{"name": s["name"], "cat": s["name"].split(".")[0], "ph": "X",
+               "ts": int(s["start"] * 1e6), "dur": int(s["duration"] * 1e6),
+               "pid": s["pid"], "tid": s["tid"], "args": s.get("attrs", {})} for s in spans]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _otel_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otel(spans: List[Dict], trace_name: str) -> Dict:
+    """OpenTelemetry OTLP/JSON layout (resourceSpans / scopeSpans / spans), one trace per task."""
+    trace_id = hashlib.md5(trace_name.encode()).hexdigest()
+    otel_spans = []
+    for s in spans:
+        otel_span = {
+            "traceId": trace_id,
+            "spanId": s["span_id"],
+            "name": s["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(int(s["start"] * 1e9)),
+            "endTimeUnixNano": str(int((s["start"] + s["duration"]) * 1e9)),
+            "attributes": [{"key": k, "value": _otel_value(v)} for k, v in s.get("attrs", {}).items()]
+                          + [{"key": "process.pid", "value": _otel_value(s["pid"])}],
+        }
+        if s.get("parent_id"):
+            otel_span["parentSpanId"] = s["parent_id"]
+        otel_spans.append(otel_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "visual_sketchpad"}},
+                                    {"key": "vsp.task", "value": {"stringValue": trace_name}}]},
+        "scopeSpans": [{"scope": {"name": "visual_sketchpad.spans"}, "spans": otel_spans}],
+    }]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the spans of a task directory.")
+    parser.add_argument("task_directory", type=str)
+    parser.add_argument("--format", type=str, choices=["chrome", "otel"], default="chrome")
+    parser.add_argument("--output", type=str, default=None, help="Defaults to spans.<format>.json in the task directory")
+    args = parser.parse_args()
+
+    spans = read_spans(args.task_directory)
+    if args.format == "chrome":
+        exported = to_chrome_trace(spans)
+    else:
+        exported = to_otel(spans, os.path.basename(os.path.normpath(args.task_directory)))
+    output = args.output or os.path.join(args.task_directory, f"spans.{args.format}.json")
+    with open(output, "w") as f:
+        json.dump(exported, f)
+    print(f"{len(spans)} spans -> {output}")
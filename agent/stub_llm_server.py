@@ -0,0 +1,295 @@
+"""An offline, OpenAI-compatible stand-in for the LLM provider.
+
+It answers POST /v1/chat/completions with scripted THOUGHT/ACTION replies in the format of
+ReACTPrompt and MathPrompt, so the whole agent loop (run_agent -> SketchpadUserAgent -> CodeExecutor)
+can be exercised without network access or API costs.
+
+The reply is picked by the number of assistant messages already in the request, so concurrent
+conversations each walk through the script independently. Latency and injected errors are drawn
+from a generator seeded by (seed, request, attempt), so a rerun sees the same latencies and the
+same failures, and a retried request does not fail forever.
+
+Serve:
+    python stub_llm_server.py serve --port 8765 --latency_ms 800 --jitter_ms 200 --error_rate 0.05
+
+Benchmark the agent-side overhead of a task against the stub (starts the server in-process):
+    python stub_llm_server.py bench --task graph_connectivity --workers 4 --latency_ms 0
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+# one reply per turn; the last one is repeated if a conversation runs past the end of the script
+DEFAULT_SCRIPT = [
+    """THOUGHT 0: I will draw a small image to look at the problem.
+ACTION 0:
+```python
+from PIL import Image, ImageDraw
+canvas = Image.new("RGB", (256, 256), "white")
+draw = ImageDraw.Draw(canvas)
+draw.rectangle([32, 32, 224, 224], outline="black", width=3)
+display(canvas)
+print("drawn")
+```""",
+    """THOUGHT 1: Let me compute something from the drawing.
+ACTION 1:
+```python
+import numpy as np
+pixels = np.array(canvas)
+print(int((pixels < 128).sum()))
+```""",
+    """THOUGHT 2: I have enough information to answer.
+ACTION 2: No action needed.
+ANSWER: yes. TERMINATE""",
+]
+
+
+def load_script(path: str) -> List[str]:
+    """A script is a JSON list of reply strings, or a JSONL file with one string (or {"content": ...}) per line."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        script = json.loads(text)
+    except json.JSONDecodeError:
+        script = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [item["content"] if isinstance(item, dict) else item for item in script]
+
+
+def _text_length(messages) -> int:
+    n = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            n += len(content)
+        elif isinstance(content, list):
+            n += sum(len(item.get("text", "")) for item in content if isinstance(item, dict))
+    return n
+
+
+class StubLLM:
+    """The scripted replies, latency and error injection behind the HTTP handler.
+
+    Args:
+        script (List[str]): replies, one per turn.
+        latency_ms (float): mean response latency.
+        jitter_ms (float): latency is uniform in [latency_ms - jitter_ms, latency_ms + jitter_ms].
+        error_rate (float): probability that a request fails with `error_status`.
+        error_status (int): HTTP status of injected errors, e.g. 429 or 500.
+        seed (int): seed of the latency and error draws.
+    """
+
+    def __init__(self, script: Optional[List[str]] = None, latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, error_status: int = 500, seed: int = 0):
+        self.script = script or DEFAULT_SCRIPT
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.seed = seed
+        self._attempts = defaultdict(int)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0}
+
+    def _rng(self, body: bytes) -> random.Random:
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            attempt = self._attempts[digest]
+            self._attempts[digest] += 1
+            self.stats["requests"] += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def handle(self, body: bytes):
+        """Return (status, response dict, delay in seconds) for a chat completion request body."""
+        rng = self._rng(body)
+        delay = max(0.0, self.latency_ms + rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            error = {"error": {"message": "Injected error from the stub LLM server.", "type": "server_error",
+                               "code": self.error_status}}
+            return self.error_status, error, delay
+
+        request = json.loads(body)
+        messages = request.get("messages", [])
+        turn = sum(1 for message in messages if message.get("role") == "assistant")
+        content = self.script[min(turn, len(self.script) - 1)]
+        prompt_tokens = _text_length(messages) // 4
+        completion_tokens = len(content) // 4
+        response = {
+            "id": f"chatcmpl-stub-{rng.getrandbits(64):016x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+                "logprobs": None,
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        return 200, response, delay
+
+
+def make_handler(stub: StubLLM):
+
+    class StubHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status: int, payload: Dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model", "owned_by": "stub"}]})
+            else:
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            status, payload, delay = stub.handle(body)
+            time.sleep(delay)
+            self._send_json(status, payload)
+
+        def log_message(self, format, *args):
+            # keep the agent's output readable
+            pass
+
+    return StubHandler
+
+
+def start_server(stub: StubLLM, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub in a daemon thread and return the server. Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), make_handler(stub))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def server_base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+
+def _latency_stats(values):
+    return {"count": len(values), "mean": round(sum(values) / len(values), 4) if values else None,
+            "p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95)}
+
+
+def summarize_traces(task_output_dir: str) -> Dict:
+    """Per-phase latencies from the trace.jsonl files of a task output directory.
+    `llm` is the time from a user message to the planner's reply, `agent` the time from the
+    planner's reply to the next user message (parsing, code execution, tools).
+    `phases` sums the spans recorded for every instance (see spans.py)."""
+    from trace_writer import TRACE_NAME, read_trace
+
+    llm, agent, durations = [], [], []
+    phases = {}
+    turns = 0
+    for name in sorted(os.listdir(task_output_dir)):
+        task_directory = os.path.join(task_output_dir, name)
+        if not os.path.exists(os.path.join(task_directory, TRACE_NAME)):
+            continue
+        records = read_trace(task_directory)
+        if not records or records[-1]["type"] != "end":
+            continue
+        durations.append(records[-1]["time"] - records[0]["time"])
+        for phase_name, phase in records[-1].get("phases", {}).items():
+            total = phases.setdefault(phase_name, {"count": 0, "seconds": 0.0})
+            total["count"] += phase["count"]
+            total["seconds"] = round(total["seconds"] + phase["seconds"], 6)
+        messages = [r for r in records if r["type"] == "message"]
+        for previous, current in zip(messages, messages[1:]):
+            elapsed = current["time"] - previous["time"]
+            if current["message"].get("role") == "assistant":
+                llm.append(elapsed)
+                turns += 1
+            else:
+                agent.append(elapsed)
+    return {"instances": len(durations), "turns": turns, "instance_seconds": _latency_stats(durations),
+            "llm_seconds": _latency_stats(llm), "agent_seconds": _latency_stats(agent), "phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI-compatible stub for the agent's LLM.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ["serve", "bench"]:
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--script", type=str, default=None, help="JSON or JSONL file with one reply per turn")
+        sub.add_argument("--latency_ms", type=float, default=0.0)
+        sub.add_argument("--jitter_ms", type=float, default=0.0)
+        sub.add_argument("--error_rate", type=float, default=0.0)
+        sub.add_argument("--error_status", type=int, default=500)
+        sub.add_argument("--seed", type=int, default=0)
+        if name == "serve":
+            sub.add_argument("--host", type=str, default="127.0.0.1")
+            sub.add_argument("--port", type=int, default=8765)
+        else:
+            sub.add_argument("--task", type=str, default="graph_connectivity")
+            sub.add_argument("--output_dir", type=str, default="outputs_stub")
+            sub.add_argument("--workers", type=int, default=1)
+            sub.add_argument("--async_chats", type=int, default=0)
+    args = parser.parse_args()
+
+    stub = StubLLM(script=load_script(args.script) if args.script else None, latency_ms=args.latency_ms,
+                   jitter_ms=args.jitter_ms, error_rate=args.error_rate, error_status=args.error_status,
+                   seed=args.seed)
+
+    if args.command == "serve":
+        server = start_server(stub, args.host, args.port)
+        print(f"[STUB_LLM] Serving on {server_base_url(server)}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    server = start_server(stub)
+    # set before run_task (and config) is imported, so worker processes inherit them
+    os.environ["VSP_LLM_BASE_URL"] = server_base_url(server)
+    os.environ["VSP_LLM_API_KEY"] = "stub"
+    os.environ["VSP_LLM_CACHE"] = "bypass"
+    from run_task import run_task, task_type_of
+
+    task_type, task_name = task_type_of(args.task)
+    start = time.time()
+    run_task(args.task, args.output_dir, task_type=task_type, task_name=task_name,
+             workers=args.workers, resume=False, async_chats=args.async_chats)
+    wall_seconds = time.time() - start
+    server.shutdown()
+
+    report = summarize_traces(os.path.join(args.output_dir, args.task))
+    report.update({"task": args.task, "workers": args.workers, "async_chats": args.async_chats,
+                   "wall_seconds": round(wall_seconds, 3),
+                   "turns_per_second": round(report["turns"] / wall_seconds, 3) if wall_seconds > 0 else None,
+                   "stub": {"latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+                            "seed": args.seed, **stub.stats}})
+    with open(os.path.join(args.output_dir, args.task, "bench_report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Test script for the retried LLM calls of the async conversations.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import asyncio
+
+
+def test_async_llm_retry():
+    """A retried LLM call resends the same request: the context and the cache lookup are not redone."""
+    print("=" * 60)
+    print("Testing async LLM retries")
+    print("=" * 60)
+
+    import httpx
+    import openai
+
+    import config
+    from multimodal_conversable_agent import MultimodalConversableAgent
+
+    class FlakyClient:
+        def __init__(self, failures):
+            self.failures = failures
+            self.requests = []
+
+        def create(self, context=None, messages=None):
+            self.requests.append((context, messages))
+            if len(self.requests) <= self.failures:
+                raise openai.APIConnectionError(request=httpx.Request("POST", "http://llm/v1/chat/completions"))
+            return "response"
+
+        def extract_text_or_completion_object(self, response):
+            return [f"reply after {len(self.requests)} requests"]
+
+    backoff = config.ASYNC_LLM_CONFIG.get("backoff_base")
+    config.ASYNC_LLM_CONFIG["backoff_base"] = 0.0
+    try:
+        print("\n[Test 1] Retried call...")
+        agent = MultimodalConversableAgent("planner", llm_config=False)
+        agent.client = FlakyClient(failures=2)
+        messages = [{"role": "user", "content": "hello", "context": {"task": 1}}]
+        assert asyncio.run(agent.a_generate_oai_reply(messages=messages)) == (True, "reply after 3 requests")
+        assert len(agent.client.requests) == 3
+        # every attempt got the context, although it was popped off the message before the first one
+        assert [context for context, _ in agent.client.requests] == [{"task": 1}] * 3
+        assert agent.client.requests[0][1] == agent.client.requests[2][1]
+        assert "context" not in messages[-1]
+        print("✅ 2 connection errors, 3 identical requests")
+
+        print("\n[Test 2] Same reply as the sync path...")
+        agent.client = FlakyClient(failures=0)
+        assert agent.generate_oai_reply(messages=[{"role": "user", "content": "hello"}]) == (True, "reply after 1 requests")
+        agent.client = None
+        assert asyncio.run(agent.a_generate_oai_reply(messages=messages)) == (False, None)
+        print("✅ sync reply, no client")
+    finally:
+        config.ASYNC_LLM_CONFIG["backoff_base"] = backoff
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_async_llm_retry()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script for the Boxes type returned by the vision tools.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import pickle
+
+import numpy as np
+
+
+def test_boxes():
+    """Boxes converts and tests boxes in bulk, and still behaves like the old list of tuples."""
+    print("=" * 60)
+    print("Testing Boxes")
+    print("=" * 60)
+
+    from boxes import Boxes
+
+    print("\n[Test 1] Conversions match the old per-box loops...")
+    centers = [[0.5, 0.5, 0.2, 0.4], [0.1, 0.2, 0.2, 0.2]]
+    boxes = Boxes(centers, format="cxcywh")
+    assert boxes == [(box[0] - box[2] / 2, box[1] - box[3] / 2, box[2], box[3]) for box in centers]
+    masks = [[10, 20, 30, 40], [0, 0, 100, 50]]
+    w, h = 100, 50
+    assert Boxes.from_pixels(masks, w, h) == [(b[0] / w, b[1] / h, b[2] / w, b[3] / h) for b in masks]
+    assert np.allclose(boxes.to("cxcywh"), centers)
+    assert np.allclose(boxes.to("xyxy")[0], [0.4, 0.3, 0.6, 0.7])
+    assert np.allclose(Boxes(boxes.to("xyxy"), format="xyxy").array, boxes.array)
+    print("✅ cxcywh / xywh / xyxy and pixel coordinates")
+
+    print("\n[Test 2] List behaviour...")
+    assert len(boxes) == 2
+    assert isinstance(boxes[0], tuple) and all(type(v) is float for v in boxes[0])
+    assert list(boxes) == boxes.tolist()
+    assert repr(boxes) == repr(boxes.tolist())
+    assert len(boxes[1:]) == 1 and isinstance(boxes[1:], Boxes)
+    assert boxes + [(0.0, 0.0, 1.0, 1.0)] == boxes.tolist() + [(0.0, 0.0, 1.0, 1.0)]
+    assert not Boxes([]) and len(Boxes([])) == 0
+    assert pickle.loads(pickle.dumps(boxes)) == boxes
+    print("✅ indexing, iteration, repr, slicing, concatenation, pickling")
+
+    print("\n[Test 3] A real list...")
+    assert isinstance(boxes, list)
+    assert json.loads(json.dumps(boxes)) == [list(box) for box in boxes]
+    grown = boxes.copy()
+    assert isinstance(grown, Boxes) and grown is not boxes
+    grown.append((0.9, 0.9, 0.1, 0.1))
+    grown.extend([(0.0, 0.0, 0.1, 0.1)])
+    grown.insert(0, (0.5, 0.0, 0.1, 0.1))
+    assert len(grown) == 5 and len(boxes) == 2
+    assert grown.array.shape == (5, 4) and np.allclose(grown.array[-1], [0.0, 0.0, 0.1, 0.1])
+    grown.sort()
+    assert grown[0] == (0.0, 0.0, 0.1, 0.1)
+    assert grown.pop() == (0.9, 0.9, 0.1, 0.1)
+    grown.remove((0.0, 0.0, 0.1, 0.1))
+    assert grown.array.shape == (3, 4) and grown.near_margin().shape == (3,)
+    print("✅ append, extend, insert, sort, pop, remove, copy and json, with the array following along")
+
+    print("\n[Test 4] Margin and IoU tests...")
+    edge = Boxes([[0.0, 0.3, 0.2, 0.2], [0.3, 0.3, 0.2, 0.2], [0.8, 0.8, 0.2, 0.2]])
+    assert edge.near_margin().tolist() == [True, False, True]
+    assert Boxes([]).near_margin().all()
+    iou = edge.iou([[0.3, 0.3, 0.2, 0.2], [0.4, 0.3, 0.2, 0.2]])
+    assert iou.shape == (3, 2)
+    assert np.isclose(iou[1, 0], 1.0) and np.isclose(iou[1, 1], 1 / 3) and iou[0, 0] == 0
+    print("✅ near_margin and pairwise IoU")
+
+    print("\n[Test 5] The array is built once...")
+    many = Boxes(np.random.default_rng(0).random((500, 4)) * 0.5)
+    array = many.array
+    assert not array.flags.writeable
+    many.to("xyxy"), many.to_pixels(640, 480), many.area(), many.near_margin(), many.iou(many[:10])
+    assert many.array is array
+    many.append((0.1, 0.1, 0.1, 0.1))
+    assert many.array is not array and many.array.shape == (501, 4) and many.array is many.array
+    many[0] = (0.0, 0.0, 0.5, 0.5)
+    del many[1]
+    assert many.array.shape == (500, 4) and np.allclose(many.array[0], [0.0, 0.0, 0.5, 0.5])
+    many += [(0.2, 0.2, 0.2, 0.2)]
+    assert isinstance(many, Boxes) and np.allclose(many.array[-1], [0.2, 0.2, 0.2, 0.2])
+    restored = pickle.loads(pickle.dumps(many))
+    assert restored == many and np.array_equal(restored.array, many.array)
+    print("✅ shared by the bulk calls, rebuilt only after the items change")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_boxes()
+    sys.exit(0 if success else 1)
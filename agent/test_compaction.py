@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Test script for the compaction of the chat history sent to the LLM.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+
+def _image_item(image):
+    return {"type": "image_url", "image_url": {"url": image}}
+
+
+def _history(images, observation_text):
+    # task prompt with an image, then one code / observation pair per image, then the last message
+    messages = [{"role": "user", "content": [{"type": "text", "text": "task"}, _image_item(images[0])]}]
+    for image in images[1:]:
+        messages.append({"role": "assistant", "content": "ACTION: " + "x" * 3000})
+        messages.append({"role": "user", "content": [{"type": "text", "text": observation_text}, _image_item(image)]})
+    messages.append({"role": "assistant", "content": "last"})
+    return messages
+
+
+def test_history_compactor():
+    """Older images and observations are shrunk in the request; the first, last and stored messages are not."""
+    print("=" * 60)
+    print("Testing HistoryCompactor")
+    print("=" * 60)
+
+    from compaction import HistoryCompactor
+
+    images = [Image.new("RGB", (800, 400), (i * 40, 0, 0)) for i in range(5)]
+    observation = "o" * 5000
+    messages = _history(images, observation)
+    original = [dict(message) for message in messages]
+
+    print("\n[Test 1] Thumbnails for the older images...")
+    compactor = HistoryCompactor(keep_last_images=2, older_images="thumbnail", thumbnail_long_side=100, max_text_chars=1000)
+    compacted = compactor.compact(messages)
+    sent_images = [item["image_url"]["url"] for message in compacted for item in compactor._content_items(message)
+                   if compactor._is_image(item)]
+    assert sent_images[0] is images[0]  # the task image is never touched
+    assert [image.size for image in sent_images[1:3]] == [(100, 50), (100, 50)]
+    assert sent_images[3] is images[3] and sent_images[4] is images[4]
+    assert compacted[0] is messages[0] and compacted[-1] is messages[-1]
+    assert messages == original and messages[2]["content"][1]["image_url"]["url"] is images[1]
+    print("✅ 2 images kept, 2 thumbnails, task image unchanged, history not modified")
+
+    print("\n[Test 2] Observations truncated, code kept...")
+    text = compacted[2]["content"][0]["text"]
+    assert len(text) < 1100 and text.startswith("o" * 500) and text.endswith("o" * 500)
+    assert "[4000 characters truncated]" in text
+    assert all(compacted[i]["content"] == messages[i]["content"] for i in range(1, len(messages) - 1, 2))
+    actions = sorted({d["action"] for d in compactor.log})
+    assert actions == ["thumbnail", "truncate_text"] and all(d["turn"] == 0 for d in compactor.log)
+    print("✅ head and tail of the observations, assistant messages as they were")
+
+    print("\n[Test 3] Thumbnails are reused across turns...")
+    again = compactor.compact(messages)
+    assert again[2]["content"][1]["image_url"]["url"] is compacted[2]["content"][1]["image_url"]["url"]
+    assert {d["turn"] for d in compactor.log} == {0, 1}
+    print("✅ the same thumbnail object, so it is encoded once")
+
+    print("\n[Test 4] Placeholders, short histories and clear...")
+    compactor = HistoryCompactor(keep_last_images=1, older_images="placeholder", max_text_chars=None)
+    compacted = compactor.compact(messages)
+    assert compacted[2]["content"][1] == {"type": "text", "text": "[image 800x400 omitted, it was shown earlier]"}
+    assert compacted[2]["content"][0]["text"] == observation
+    assert compactor.summary()["settings"]["older_images"] == "placeholder"
+    assert compactor.compact(messages[:2]) == messages[:2]
+    compactor.clear()
+    assert compactor.log == [] and compactor._n_calls == 0
+    print("✅ text placeholders, nothing to do under 3 messages, log cleared")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_history_compactor()
+    sys.exit(0 if success else 1)
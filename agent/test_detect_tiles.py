@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Test script for the batched tile detection behind sliding_window_detection.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+
+def test_detect_tiles():
+    """Only a backend without tile batching or missing vision tools fall back; server failures are raised."""
+    print("=" * 60)
+    print("Testing _detect_tiles")
+    print("=" * 60)
+
+    import tools
+    from expert_clients import ExpertUnavailableError
+    from tool_backends import BackendRegistry, ToolBackend
+
+    class TileBackend(ToolBackend):
+        TOOLS = ("detection", "detect_tiles")
+        error = None
+
+        def get_name(self):
+            return "tiles"
+
+        def detect_tiles(self, image, objects, tiles, box_threshold, text_threshold):
+            if self.error is not None:
+                raise self.error
+            return [{"tile": tile} for tile in tiles]
+
+    class AnnotatingBackend(TileBackend):
+        # a box in the middle of the first tile only, annotated like the server does
+        def get_name(self):
+            return "annotating"
+
+        def detect_tiles(self, image, objects, tiles, box_threshold, text_threshold):
+            results = [{"tile": tile, "boxes": [], "phrases": []} for tile in tiles]
+            results[0].update(boxes=[[0.5, 0.5, 0.2, 0.2]], phrases=objects[:1],
+                              annotated_image=Image.new("RGB", (10, 10), (255, 0, 0)))
+            return results
+
+    BackendRegistry.register("tiles", TileBackend)
+    BackendRegistry.register("annotating", AnnotatingBackend)
+    backends = dict(tools.TOOL_BACKEND_CONFIG)
+    available, tool_cache = tools.VISION_TOOLS_AVAILABLE, tools.tool_cache
+    tools.TOOL_BACKEND_CONFIG.update({"detection": "tiles", "fallback": ""})
+    tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = True, None
+    image, tiles = Image.new("RGB", (40, 40)), [[0, 0, 20, 20], [20, 20, 40, 40]]
+    try:
+        print("\n[Test 1] Batched results...")
+        assert tools._detect_tiles(image, ["cat"], tiles) == [{"tile": tile} for tile in tiles]
+        print("✅ one result per tile")
+
+        print("\n[Test 2] Fallbacks to per tile detection...")
+        backend = BackendRegistry.get("tiles", {})
+        backend.error = NotImplementedError()
+        assert tools._detect_tiles(image, ["cat"], tiles) is None
+        backend.error = None
+        tools.VISION_TOOLS_AVAILABLE = False
+        assert tools._detect_tiles(image, ["cat"], tiles) is None
+        tools.VISION_TOOLS_AVAILABLE = True
+        print("✅ no tile batching, no vision tools")
+
+        print("\n[Test 3] Server failures are not swallowed...")
+        for error in (ExpertUnavailableError("detection server down"), RuntimeError("server failed: 500")):
+            backend.error = error
+            try:
+                tools._detect_tiles(image, ["cat"], tiles)
+                assert False, "the error should be raised"
+            except RuntimeError as e:
+                assert e is error
+        print("✅ unavailable expert and HTTP 500 are raised")
+
+        print("\n[Test 4] The server's annotated tiles...")
+        from tool_cache import ToolResultCache
+
+        tools.TOOL_BACKEND_CONFIG["detection"] = "annotating"
+        tools.tool_cache = ToolResultCache()
+        for _ in range(2):  # computed, then from the cache
+            results = tools._detect_tiles(image, ["cat"], tiles)
+            assert results[0]["annotated_image"].getpixel((0, 0)) == (255, 0, 0)
+            assert "annotated_image" not in results[1] and "image_index" not in results[1]
+        assert tools.tool_cache.stats["memory_hits"] == 1
+        patches, boxes = tools.sliding_window_detection(image, ["cat"])
+        assert len(patches) == len(boxes) == 1
+        assert patches[0].annotated_image.getpixel((0, 0)) == (255, 0, 0)
+        assert patches[0].original_image.size == (13, 13)
+        print("✅ the kept tile is the server's image, also from the cache")
+    finally:
+        tools.TOOL_BACKEND_CONFIG.clear()
+        tools.TOOL_BACKEND_CONFIG.update(backends)
+        tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = available, tool_cache
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_detect_tiles()
+    sys.exit(0 if success else 1)
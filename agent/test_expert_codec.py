@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Test script for the compact response modes: the servers' encoders against the agent's decoders.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vision_experts"))
+
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def test_expert_codec():
+    """RLE masks and float16 depth round-trip from the server encoding to the agent decoding."""
+    print("=" * 60)
+    print("Testing Expert Response Codec")
+    print("=" * 60)
+
+    from expert_codec import decode_rle, decode_region_mask, decode_depth
+    from response_codec import mask_rle, depth_float16
+
+    print("\n[Test 1] RLE masks...")
+    rng = np.random.default_rng(0)
+    masks = [
+        rng.random((37, 53)) > 0.5,
+        np.zeros((10, 20), dtype=bool),
+        np.ones((10, 20), dtype=bool),
+        np.pad(np.ones((5, 7), dtype=bool), ((3, 4), (2, 6))),
+    ]
+    for mask in masks:
+        rle = mask_rle(mask.astype(np.uint8) * 255)
+        assert rle["size"] == list(mask.shape)
+        assert sum(rle["counts"]) == mask.size
+        assert np.array_equal(decode_rle(rle), mask)
+        assert np.array_equal(decode_region_mask({"mask_rle": rle}), mask)
+    # a mask that starts with a foreground pixel starts with an empty run of zeros
+    assert mask_rle(masks[2])["counts"] == [0, 200]
+    print("✅ random, empty, full and boxed masks")
+
+    print("\n[Test 2] PNG masks and regions without a mask...")
+    buffer = io.BytesIO()
+    Image.fromarray(masks[3].astype(np.uint8) * 255, "L").save(buffer, format="PNG")
+    region = {"mask_png_base64": base64.b64encode(buffer.getvalue()).decode("ascii")}
+    assert np.array_equal(decode_region_mask(region), masks[3])
+    assert decode_region_mask({"bbox": [0, 0, 1, 1]}) is None
+    print("✅ full mode decodes, bboxes mode has no mask")
+
+    print("\n[Test 3] float16 depth...")
+    depth = (rng.random((24, 31)) * 10).astype(np.float32)
+    data = {"height": 24, "width": 31}
+    base64_data = dict(data, depth_float16_base64=base64.b64encode(depth_float16(depth)).decode("ascii"))
+    binary_data = dict(data, depth_float16=depth_float16(depth))
+    for depth_data in (base64_data, binary_data):
+        decoded = decode_depth(depth_data)
+        assert decoded.shape == depth.shape and decoded.dtype == np.float16
+        assert np.allclose(decoded, depth, rtol=1e-3, atol=1e-2)
+    assert decode_depth(data) is None and decode_depth(None) is None
+    print("✅ base64 (gradio) and raw bytes (HTTP) depth")
+
+    print("\n[Test 4] segment_masks and depth_values decode the compact responses...")
+    import tools
+    from boxes import Boxes
+    from tool_backends import BackendRegistry, ToolBackend
+
+    segment = np.zeros((20, 30), dtype=bool)
+    segment[5:15, 10:20] = True
+
+    class CompactBackend(ToolBackend):
+        TOOLS = ("segment_and_mark", "depth")
+
+        def get_name(self):
+            return "compact"
+
+        def segment_and_mark(self, image, granularity, alpha, anno_mode, response_mode="bboxes"):
+            # the segmentation model works at half the size of the input
+            assert response_mode == "rle"
+            regions = [{"id": 1, "bbox": [10, 5, 10, 10], "mask_rle": mask_rle(segment)}]
+            return Image.new("RGB", (30, 20)), Boxes.from_pixels([[10, 5, 10, 10]], 30, 20), regions
+
+        def depth(self, image, response_mode="colored"):
+            assert response_mode == "float16"
+            return Image.new("RGB", image.size), {"height": 24, "width": 31, "depth_float16": depth_float16(depth)}
+
+    BackendRegistry.register("compact", CompactBackend)
+    backends = dict(tools.TOOL_BACKEND_CONFIG)
+    available, tool_cache = tools.VISION_TOOLS_AVAILABLE, tools.tool_cache
+    tools.TOOL_BACKEND_CONFIG.update({"segment_and_mark": "compact", "depth": "compact", "fallback": ""})
+    tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = True, None
+    try:
+        masks = tools.segment_masks(Image.new("RGB", (60, 40)))
+        assert len(masks) == 1 and masks[0].shape == (40, 60) and masks[0].dtype == bool
+        assert masks[0].sum() == 4 * segment.sum() and masks[0][10:30, 20:40].all()
+        values = tools.depth_values(Image.new("RGB", (31, 24)))
+        assert values.dtype == np.float32 and np.allclose(values, depth, rtol=1e-3, atol=1e-2)
+    finally:
+        tools.TOOL_BACKEND_CONFIG.clear()
+        tools.TOOL_BACKEND_CONFIG.update(backends)
+        tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = available, tool_cache
+    print("✅ masks at the input size, float32 depth")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_expert_codec()
+    sys.exit(0 if success else 1)
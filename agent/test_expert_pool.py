@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Test script for the balancing of calls across the replicas of a vision expert.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeReplica:
+    def __init__(self, address, healthy=True):
+        self.address = address
+        self.is_healthy = healthy
+        self.health_checks = 0
+
+    def healthy(self):
+        self.health_checks += 1
+        return self.is_healthy
+
+    def get(self):
+        return self
+
+    def reset(self, client):
+        pass
+
+
+def test_expert_pool():
+    """Calls go to the least loaded replica, ties start at a random replica, failed replicas are ejected."""
+    print("=" * 60)
+    print("Testing ExpertPool")
+    print("=" * 60)
+
+    from expert_clients import ExpertPool, ExpertUnavailableError
+
+    print("\n[Test 1] Ties don't always go to the first replica...")
+    first_choices = set()
+    for _ in range(50):
+        pool = ExpertPool("depth", [FakeReplica("a"), FakeReplica("b"), FakeReplica("c")])
+        first_choices.add(pool.call(lambda replica: replica.address, use_gradio=False))
+    assert len(first_choices) > 1, first_choices
+    print(f"✅ first calls of new pools went to {sorted(first_choices)}")
+
+    print("\n[Test 2] Round robin when idle, least outstanding when busy...")
+    pool = ExpertPool("depth", [FakeReplica("a"), FakeReplica("b")])
+    addresses = [pool.call(lambda replica: replica.address, use_gradio=False) for _ in range(4)]
+    assert addresses[0] != addresses[1] and addresses[:2] == addresses[2:], addresses
+    busy = pool._acquire(exclude=())
+    for _ in range(3):
+        assert pool.call(lambda replica: replica.address, use_gradio=False) != pool.replicas[busy].address
+    pool._release(busy)
+    print("✅ alternating replicas, busy replica avoided")
+
+    print("\n[Test 3] A failed replica is ejected and the call retried on the other one...")
+    down, up = FakeReplica("down", healthy=False), FakeReplica("up")
+    pool = ExpertPool("depth", [down, up], call_retries=1, eject_seconds=60)
+
+    def call(replica):
+        if replica is down:
+            raise ExpertUnavailableError("down")
+        return replica.address
+
+    assert [pool.call(call, use_gradio=False) for _ in range(3)] == ["up"] * 3
+    # round robin reaches the down replica once, after that it is ejected
+    assert pool.stats["ejections"] == 1 and pool.stats["retries"] == 1 and pool.status()[0]["ejected"]
+    # once the ejection is over, the replica is health checked before it gets calls again
+    pool._ejected_until[0] = 1.0
+    checks = down.health_checks
+    assert pool.call(call, use_gradio=False) == "up"
+    assert down.health_checks == checks + 1 and pool.status()[0]["ejected"]
+    down.is_healthy = True
+    pool._ejected_until[0] = 1.0
+    assert pool._readmit(0) and pool._ejected_until[0] == 0.0
+    print("✅ ejected, health checked and taken back")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_expert_pool()
+    sys.exit(0 if success else 1)
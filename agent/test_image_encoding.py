@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Test script for the image encoding cache used by MultimodalConversableAgent.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from PIL import Image
+
+
+def _history(image_a, image_b):
+    return [
+        {"role": "system", "content": [{"type": "text", "text": "You are a helpful AI assistant."}]},
+        {"role": "user", "content": [
+            {"type": "text", "text": "OBSERVATION: "},
+            {"type": "image_url", "image_url": {"url": image_a}},
+        ]},
+        {"role": "assistant", "content": "THOUGHT 1: ..."},
+        {"role": "user", "content": [
+            {"type": "text", "text": "OBSERVATION: "},
+            {"type": "image_url", "image_url": {"url": image_b}},
+        ]},
+    ]
+
+
+def test_image_encoding_cache():
+    """Each image is encoded once per conversation, and the payload matches autogen's encoding."""
+    print("=" * 60)
+    print("Testing Image Encoding Cache")
+    print("=" * 60)
+
+    from image_encoding import ImageEncodingCache, ImageSendPolicy
+
+    image_a = Image.new("RGB", (64, 48), color="red")
+    image_b = Image.new("RGB", (32, 32), color="blue")
+    # same pixels as image_a, but a different object
+    image_a_copy = image_a.copy()
+
+    cache = ImageEncodingCache()
+    messages = _history(image_a, image_b)
+
+    print("\n[Test 1] First turn encodes every image...")
+    formatted = cache.format_messages(messages)
+    assert formatted[1]["content"][1]["image_url"]["url"] == ImageSendPolicy().encode(image_a)[0]
+    assert formatted[3]["content"][1]["image_url"]["url"].startswith("data:image/png;base64,")
+    assert cache.turns[0]["encoded"] == 2
+    # the chat history itself still holds the PIL images
+    assert messages[1]["content"][1]["image_url"]["url"] is image_a
+    print("✅ 2 images encoded, history untouched")
+
+    print("\n[Test 2] Later turns hit the cache...")
+    cache.format_messages(messages + _history(image_a_copy, image_b)[1:2])
+    assert cache.turns[1]["encoded"] == 0
+    assert cache.turns[1]["identity_hits"] == 2
+    assert cache.turns[1]["hash_hits"] == 1
+    print("✅ no re-encoding, identical content found by hash")
+
+    print("\n[Test 3] Summary and clear...")
+    summary = cache.summary()
+    assert summary["images_sent"] == 5
+    assert summary["images_encoded"] == 2
+    assert summary["cache_hits"] == 3
+    cache.clear()
+    assert cache.summary()["images_sent"] == 0
+    print("✅ summary counts hits and misses")
+
+    print("\n[Test 4] Send policy downscales and re-encodes...")
+    policy = ImageSendPolicy(max_long_side=32, format="JPEG", quality=70, detail="low")
+    cache = ImageEncodingCache(policy)
+    formatted = cache.format_messages(_history(image_a, image_b))
+    image_url = formatted[1]["content"][1]["image_url"]
+    assert image_url["url"].startswith("data:image/jpeg;base64,")
+    assert image_url["detail"] == "low"
+    assert policy.prepare(image_a).size == (32, 24)
+    assert cache.turns[0]["estimated_image_tokens"] == 2 * 85
+    # the agent-side image is untouched
+    assert image_a.size == (64, 48)
+    assert ImageSendPolicy().estimate_tokens((1024, 1024)) == 170 * 4 + 85
+    print("✅ JPEG at 32px, detail=low, token estimate")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_image_encoding_cache()
+    sys.exit(0 if success else 1)
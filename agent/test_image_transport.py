@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Test script for moving images to and from the vision expert servers in memory.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import socket
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+
+def _image():
+    # a gradient, so a lossy encoding changes the pixels a little and a broken one a lot
+    x = np.linspace(0, 255, 64, dtype=np.uint8)
+    return Image.fromarray(np.stack([np.tile(x, (48, 1)), np.tile(x[:48, None], (1, 64)), np.full((48, 64), 90, np.uint8)], axis=2))
+
+
+def test_encode_decode():
+    """PNG round-trips exactly, JPEG within its quality, and JSON outputs are read parsed or from a file."""
+    print("=" * 60)
+    print("Testing ImageTransport encode / decode")
+    print("=" * 60)
+
+    from image_transport import ImageTransport
+
+    image = _image()
+
+    print("\n[Test 1] Formats...")
+    png = ImageTransport("png")
+    assert png.format == "PNG" and png.encode(image)[:8] == b"\x89PNG\r\n\x1a\n"
+    assert png.decode(png.encode(image)).tobytes() == image.tobytes()
+    rgba = image.convert("RGBA")
+    assert png.decode(png.encode(rgba)).mode == "RGBA"
+    jpeg = ImageTransport("jpg", quality=90)
+    data = jpeg.encode(rgba)  # JPEG has no alpha, the image is converted
+    assert jpeg.format == "JPEG" and data[:2] == b"\xff\xd8"
+    decoded = jpeg.decode(data)
+    assert decoded.size == image.size and decoded.mode == "RGB"
+    error = np.abs(np.asarray(decoded, dtype=np.int16) - np.asarray(image, dtype=np.int16)).mean()
+    assert error < 3, error
+    assert len(ImageTransport("JPEG", quality=30).encode(image)) < len(data)
+    try:
+        ImageTransport("BMP")
+        assert False, "unsupported formats should be rejected"
+    except ValueError:
+        pass
+    print(f"✅ PNG lossless, JPEG mean error {error:.2f} at quality 90, smaller at lower quality")
+
+    print("\n[Test 2] The temp file fallback and JSON outputs...")
+    path = os.path.join(tempfile.mkdtemp(), "image.jpg")
+    jpeg.save(image, path)
+    with open(path, "rb") as f:
+        assert f.read() == jpeg.encode(image)
+    assert jpeg.download_image(None, path).size == image.size
+    regions = [{"bbox": [1, 2, 3, 4]}]
+    assert png.download_json(None, regions) is regions and png.download_json(None, {"boxes": []}) == {"boxes": []}
+    json_path = os.path.join(tempfile.mkdtemp(), "regions.json")
+    with open(json_path, "w") as f:
+        json.dump(regions, f)
+    assert png.download_json(None, json_path) == regions
+    assert png.download_json(None, {"path": json_path}) == regions
+    print("✅ same bytes as encode, parsed outputs as is, files read")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+def test_upload():
+    """Images are uploaded to a gradio server from memory, and its outputs fetched back into memory."""
+    print("=" * 60)
+    print("Testing ImageTransport upload / fetch")
+    print("=" * 60)
+
+    import gradio as gr
+    import httpx
+    from gradio_client import Client
+
+    from image_transport import ImageTransport
+
+    def flip(image):
+        return image.transpose(Image.FLIP_LEFT_RIGHT), {"size": list(image.size)}
+
+    demo = gr.Interface(fn=flip, inputs=gr.Image(type="pil"), outputs=[gr.Image(type="pil", format="png"), gr.JSON()],
+                         api_name="predict")
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    demo.launch(server_name="127.0.0.1", server_port=port, prevent_thread_lock=True, quiet=True)
+    image = _image()
+    try:
+        print("\n[Test 1] Upload, predict, fetch...")
+        client = Client(f"http://127.0.0.1:{port}/", download_files=False, verbose=False)
+        # with a pooled session, and with one connection per request
+        for transport in (ImageTransport("PNG", session=httpx.Client()), ImageTransport("JPEG", quality=95)):
+            value = transport.upload(client, image)
+            assert value["mime_type"] == f"image/{transport.format.lower()}" and value["size"] == len(transport.encode(image))
+            assert value["orig_name"].endswith((".png", ".jpg"))
+            output_image, data = client.predict(value, api_name="/predict")
+            assert isinstance(output_image, dict) and output_image.get("url")  # not downloaded by gradio_client
+            flipped = transport.download_image(client, output_image)
+            assert flipped.size == image.size and transport.download_json(client, data) == {"size": [64, 48]}
+            if transport.format == "PNG":
+                assert flipped.convert("RGB").tobytes() == image.transpose(Image.FLIP_LEFT_RIGHT).tobytes()
+        print("✅ PNG pixels unchanged through the server, JPEG uploaded as JPEG")
+
+        print("\n[Test 2] Upload failures fall back to a temp file...")
+
+        class NoUploadRoute:
+            upload_url = None
+
+        class BrokenServer:
+            upload_url = f"http://127.0.0.1:{port}/no_such_route"
+            headers = {"x-test": "1"}
+
+        transport = ImageTransport("PNG", timeout=5.0)
+        assert transport.upload(NoUploadRoute(), image) is None
+        assert transport.upload(BrokenServer(), image) is None
+        print("✅ None without an upload route or when the upload fails")
+    finally:
+        demo.close()
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_encode_decode() and test_upload()
+    sys.exit(0 if success else 1)
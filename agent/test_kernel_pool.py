@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Test script for the pool of warm jupyter kernels.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+
+
+def _output(kernel, code):
+    result = kernel.run(code)
+    assert result.exit_code == 0, result.output
+    return result.output.strip()
+
+
+def test_kernel_pool():
+    """Leased kernels come back reset, are recycled when due, and a kernel that can't be reset is dropped."""
+    print("=" * 60)
+    print("Testing Kernel Pool")
+    print("=" * 60)
+
+    from kernel_pool import KernelPool
+
+    pool = KernelPool(size=1, use_custom_tools=False, max_tasks_per_kernel=2, max_memory_mb=0)
+    work_a, work_b = tempfile.mkdtemp(), tempfile.mkdtemp()
+    try:
+        print("\n[Test 1] A released kernel is reset for the next task...")
+        kernel = pool.acquire(work_a)
+        _output(kernel, "leftover = 42")
+        assert _output(kernel, "import os; print(os.environ['VSP_WORKING_DIR'])") == work_a
+        pool.release(kernel)
+        kernel_again = pool.acquire(work_b)
+        assert kernel_again is kernel
+        assert _output(kernel, "print('leftover' in globals())") == "False"
+        assert _output(kernel, "import os; print(os.environ['VSP_WORKING_DIR'])") == work_b
+        assert _output(kernel, "print(Image.__name__)") == "PIL.Image"
+        print("✅ namespace cleared, VSP_WORKING_DIR set, init code re-run")
+
+        print("\n[Test 2] Recycling after max_tasks_per_kernel and when broken...")
+        pool.release(kernel)
+        assert kernel.n_tasks == 0  # the second task triggered a restart
+        kernel = pool.acquire(work_a)
+        kernel.broken = True
+        pool.release(kernel)
+        assert not kernel.broken and kernel.n_tasks == 0
+        print("✅ restarted kernels are handed out again")
+
+        print("\n[Test 3] A kernel that fails to reset twice is dropped, not leaked...")
+        kernel = pool.acquire(work_a)
+        pool.release(kernel)
+
+        def failing_reset(working_dir, use_custom_tools):
+            raise RuntimeError("reset failed")
+
+        kernel.reset = failing_reset
+        try:
+            pool.acquire(work_b)
+            assert False, "acquire should raise"
+        except RuntimeError:
+            pass
+        assert kernel not in pool._kernels
+        # the slot is free again: the next task gets a new kernel instead of blocking forever
+        new_kernel = pool.acquire(work_b)
+        assert new_kernel is not kernel
+        pool.release(new_kernel)
+        print("✅ the pool keeps its size")
+
+        print("\n[Test 4] A kernel that fails to restart is replaced outside the lock...")
+        import kernel_pool
+
+        kernel = pool.acquire(work_a)
+        kernel.broken = True
+
+        def failing_recycle():
+            raise RuntimeError("restart failed")
+
+        kernel.recycle = failing_recycle
+        lock_held = []
+        pooled_kernel = kernel_pool.PooledKernel
+
+        def start_kernel(*args):
+            lock_held.append(pool._lock.locked())
+            return pooled_kernel(*args)
+
+        kernel_pool.PooledKernel = start_kernel
+        try:
+            pool.release(kernel)
+        finally:
+            kernel_pool.PooledKernel = pooled_kernel
+        assert lock_held == [False]
+        assert kernel not in pool._kernels and len(pool._kernels) == 1 and pool._starting == 0
+        replacement = pool.acquire(work_b)
+        assert replacement is not kernel and _output(replacement, "print(1 + 1)") == "2"
+        print("✅ a new kernel is started without blocking acquire, and leased next")
+    finally:
+        pool.close()
+
+    print("\n[Test 5] A kernel given back after close is stopped...")
+    stopped = []
+    replacement.stop = lambda: stopped.append(replacement)
+    pool.release(replacement)
+    assert stopped == [replacement] and pool._idle.empty() and replacement not in pool._kernels
+    try:
+        pool.acquire(work_a)
+        assert False, "a closed pool should not lease kernels"
+    except RuntimeError:
+        pass
+    print("✅ not put back in the pool, no replacement started")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_kernel_pool()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test script for the LLM completion cache and its record / replay / bypass modes.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+
+from PIL import Image
+
+
+def test_completion_cache():
+    """Keys ignore credentials and image encodings; each mode serves, records or skips as documented."""
+    print("=" * 60)
+    print("Testing CompletionCache")
+    print("=" * 60)
+
+    from image_encoding import ImageSendPolicy
+    from llm_cache import CompletionCache, CompletionCacheMiss
+    from multimodal_conversable_agent import MultimodalConversableAgent
+
+    llm_config = {"config_list": [{"model": "gpt-4o", "api_key": "secret"}], "temperature": 0}
+    image = Image.new("RGB", (8, 8), (0, 128, 255))
+    messages = [{"role": "user", "content": [{"type": "text", "text": "what is this?"},
+                                             {"type": "image_url", "image_url": {"url": image}}]}]
+
+    print("\n[Test 1] Keys...")
+    key = CompletionCache.make_key(llm_config, messages)
+    other_key = {"config_list": [{"model": "gpt-4o", "api_key": "another secret"}], "temperature": 0}
+    assert key == CompletionCache.make_key(other_key, messages)
+    same_pixels = [dict(messages[0], content=[messages[0]["content"][0],
+                                              {"type": "image_url", "image_url": {"url": image.copy()}}])]
+    assert key == CompletionCache.make_key(llm_config, same_pixels)
+    assert key != CompletionCache.make_key(dict(llm_config, temperature=1), messages)
+    assert key != CompletionCache.make_key(llm_config, messages, ImageSendPolicy(max_long_side=512))
+    other_image = [dict(messages[0], content=[messages[0]["content"][0],
+                                              {"type": "image_url", "image_url": {"url": Image.new("RGB", (8, 8))}}])]
+    assert key != CompletionCache.make_key(llm_config, other_image)
+    print("✅ same key without the API key and for equal pixels, new key for parameters, policy and images")
+
+    print("\n[Test 2] Modes...")
+    directory = tempfile.mkdtemp()
+    cache = CompletionCache(directory, mode="record")
+    assert cache.lookup(key) is None
+    cache.store(key, "a cat")
+    assert cache.lookup(key) == "a cat"
+    cache.close()
+    replay = CompletionCache(directory, mode="replay")
+    assert replay.lookup(key) == "a cat"
+    replay.store("new", "ignored")
+    try:
+        replay.lookup("new")
+        assert False, "a replay miss should raise"
+    except CompletionCacheMiss:
+        pass
+    bypass = CompletionCache(directory, mode="bypass")
+    assert bypass.lookup(key) is None
+    try:
+        CompletionCache(directory, mode="replay_only")
+        assert False, "unknown modes should be rejected"
+    except ValueError:
+        pass
+    print("✅ record stores and serves, replay only serves, bypass ignores the cache")
+
+    print("\n[Test 3] In front of the LLM call...")
+
+    class CountingClient:
+        calls = 0
+
+        def create(self, context=None, messages=None):
+            CountingClient.calls += 1
+            return "response"
+
+        def extract_text_or_completion_object(self, response):
+            return [f"reply {CountingClient.calls}"]
+
+    def agent(mode, cache_directory=directory):
+        planner = MultimodalConversableAgent("planner", llm_config=False,
+                                             completion_cache=CompletionCache(cache_directory, mode=mode))
+        planner.client = CountingClient()
+        return planner
+
+    history = [{"role": "user", "content": "2 + 2?"}]
+    recorder = agent("record")
+    assert recorder.generate_oai_reply(messages=list(history)) == (True, "reply 1")
+    assert recorder.generate_oai_reply(messages=list(history)) == (True, "reply 1")
+    assert CountingClient.calls == 1 and recorder.completion_cache_stats == {"hits": 1, "misses": 1}
+    assert agent("replay").generate_oai_reply(messages=list(history)) == (True, "reply 1")
+    assert agent("bypass").generate_oai_reply(messages=list(history)) == (True, "reply 2")
+    try:
+        agent("replay", tempfile.mkdtemp()).generate_oai_reply(messages=list(history))
+        assert False, "a replay miss should fail the call"
+    except CompletionCacheMiss:
+        pass
+    assert CountingClient.calls == 2
+    print("✅ a recorded reply skips the LLM, replay runs offline")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_completion_cache()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-process (local) backend of the vision tools, with stand-in models.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from PIL import Image
+
+
+def test_local_backend():
+    """Tools set to "local" in TOOL_BACKEND_CONFIG run in process and return what the remote tools return."""
+    print("=" * 60)
+    print("Testing LocalBackend")
+    print("=" * 60)
+
+    import torch
+
+    import tools
+    from boxes import Boxes
+    from tool_backends import BackendRegistry, LocalBackend, backend_name, get_backend
+
+    calls = []
+    loads = []
+
+    def depth_model(tensor):
+        calls.append(("depth", tuple(tensor.shape)))
+        # relative depth growing from left to right
+        return torch.linspace(0, 1, tensor.shape[-1]).repeat(1, tensor.shape[-2], 1)
+
+    def depth_transform(sample):
+        return {"image": sample["image"].transpose(2, 0, 1).astype(np.float32)}
+
+    def detection_transform(image, target):
+        return torch.zeros(3, image.height, image.width), target
+
+    def predict(model, image, caption, box_threshold, text_threshold, device):
+        calls.append(("detection", caption, device))
+        return torch.tensor([[0.5, 0.5, 0.2, 0.2], [0.25, 0.3, 0.1, 0.2]]), torch.tensor([0.9, 0.8]), ["cat", "cat"]
+
+    class StubbedLocalBackend(LocalBackend):
+        # everything but the checkpoints
+        def _load_depth(self):
+            loads.append("depth")
+            return depth_model, depth_transform
+
+        def _load_grounding_dino(self):
+            loads.append("detection")
+            return None, detection_transform, predict
+
+    BackendRegistry.register("local", StubbedLocalBackend)
+    backends = dict(tools.TOOL_BACKEND_CONFIG)
+    available, tool_cache = tools.VISION_TOOLS_AVAILABLE, tools.tool_cache
+    tools.TOOL_BACKEND_CONFIG.update({"detection": "local", "depth": "local", "fallback": ""})
+    tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = True, None
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (48, 64, 3), dtype=np.uint8))
+    try:
+        print("\n[Test 1] Per tool backends...")
+        assert [backend_name(tool) for tool in ("detection", "detect_tiles", "depth", "segment_and_mark")] == \
+            ["local", "local", "local", "remote"]
+        local = get_backend("local")
+        assert isinstance(local, StubbedLocalBackend) and local.device == "cpu"
+        assert not local.supports("segment_and_mark")
+        try:
+            local.segment_and_mark(image, 1.8, 0.1, ["Mask"])
+            assert False, "segment_and_mark has no local version"
+        except NotImplementedError:
+            pass
+        print("✅ detection and depth local, segment_and_mark remote")
+
+        print("\n[Test 2] detection...")
+        output_image, boxes = tools.detection(image, ["cat"])
+        assert calls[-1] == ("detection", "cat", "cpu")
+        assert isinstance(output_image, tools.AnnotatedImage) and output_image.original_image is image
+        assert output_image.annotated_image.size == image.size and output_image.annotated_image.mode == "RGB"
+        assert output_image.annotated_image.tobytes() != image.tobytes()
+        assert isinstance(boxes, Boxes) and boxes.array.shape == (2, 4)
+        assert np.allclose(boxes.array, [[0.4, 0.4, 0.2, 0.2], [0.2, 0.2, 0.1, 0.2]])
+        print("✅ annotated image at the input size, xywh Boxes")
+
+        print("\n[Test 3] depth...")
+        depth_map = tools.depth(image)
+        assert calls[-1] == ("depth", (1, 3, 48, 64))
+        assert isinstance(depth_map, Image.Image) and depth_map.size == image.size and depth_map.mode == "RGB"
+        values = tools.depth_values(image)
+        assert values.dtype == np.float32 and values.shape == (48, 64)
+        assert values[0, 0] < values[0, -1] and np.allclose(values[0], values[-1])
+        _, depth_data = local.depth(image, response_mode="full")
+        assert {"depth_map_grayscale_base64", "depth_map_colored_base64"} <= set(depth_data)
+        print("✅ colored map at the input size, float16 depth values, full response mode")
+
+        print("\n[Test 4] sliding_window_detection without tile batching...")
+        n_calls = len(calls)
+        patches, patch_boxes = tools.sliding_window_detection(image, ["cat"])
+        # no detect_tiles on the local backend: one detection per tile
+        assert len(calls) - n_calls == 16 and len(patches) == len(patch_boxes) == 16
+        assert patches[0].annotated_image.size == patches[0].original_image.size
+        assert loads == ["detection", "depth"]
+        print("✅ one local detection per tile, each model loaded once")
+    finally:
+        BackendRegistry.register("local", LocalBackend)
+        tools.TOOL_BACKEND_CONFIG.clear()
+        tools.TOOL_BACKEND_CONFIG.update(backends)
+        tools.VISION_TOOLS_AVAILABLE, tools.tool_cache = available, tool_cache
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_local_backend()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test script for resuming a task run and its manifest, with stand-in instance runs.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import tempfile
+
+
+def _read_manifest(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_run_task():
+    """Finished instances are skipped on resume, failed ones rerun with retry_failed, one manifest record per run."""
+    print("=" * 60)
+    print("Testing run_task")
+    print("=" * 60)
+
+    import run_task
+    from trace_writer import TraceWriter
+
+    root = tempfile.mkdtemp()
+    names = ["a", "b", "c", "d", "e"]
+    for name in names:
+        os.makedirs(os.path.join(root, "tasks", "demo", "processed", name))
+    os.makedirs(os.path.join(root, "agent"))
+    output_dir = os.path.join(root, "outputs", "demo")
+
+    def trace(name, error=None, end=True):
+        writer = TraceWriter(os.path.join(output_dir, name), instance=name)
+        writer.write_message({"role": "user", "content": "task"})
+        if error:
+            writer.write_event("error", error=error)
+        if end:
+            writer.write_event("end", n_messages=1)
+        writer.close()
+
+    def output_json(name, content):
+        with open(os.path.join(output_dir, name, "output.json"), "w") as f:
+            json.dump(content, f)
+
+    print("\n[Test 1] instance_is_done...")
+    trace("a")
+    trace("b", error="LLM unavailable")
+    trace("c", end=False)  # a crash in the middle of the run
+    os.makedirs(os.path.join(output_dir, "d"))
+    output_json("d", {"error": "kernel died"})  # written before traces existed
+    instance = lambda name: os.path.join(root, "tasks", "demo", "processed", name) + "/"
+    assert [run_task.instance_is_done(instance(name), output_dir) for name in names] == \
+        [True, True, False, True, False]
+    assert [run_task.instance_is_done(instance(name), output_dir, retry_failed=True) for name in names] == \
+        [True, False, False, False, False]
+    output_json("d", [{"role": "user", "content": "task"}])
+    assert run_task.instance_is_done(instance("d"), output_dir, retry_failed=True)
+    print("✅ done and failed traces, unfinished traces, old output.json files, missing outputs")
+
+    runs = []
+
+    def run_instance(task_instance, output_dir, task_type="vision", task_name=None):
+        name = os.path.basename(task_instance.rstrip('/'))
+        runs.append(name)
+        if name == "e":
+            return {"instance": task_instance.rstrip('/'), "status": "failed", "error": "RuntimeError: boom"}
+        return {"instance": task_instance.rstrip('/'), "status": "done"}
+
+    async def a_run_instance(task_instance, output_dir, task_type="vision", task_name=None, kernel_pool=None):
+        return run_instance(task_instance, output_dir, task_type, task_name)
+
+    stubs = {"run_instance": run_instance, "a_run_instance": a_run_instance, "get_default_pool": lambda size=None: None}
+    originals = {name: getattr(run_task, name) for name in stubs}
+    cwd = os.getcwd()
+    manifest_path = os.path.join(output_dir, run_task.MANIFEST_NAME)
+    try:
+        for name, stub in stubs.items():
+            setattr(run_task, name, stub)
+        # instances are found relative to the agent directory
+        os.chdir(os.path.join(root, "agent"))
+
+        print("\n[Test 2] A resumed run skips the finished instances...")
+        run_task.run_task("demo", os.path.join(root, "outputs"))
+        assert runs == ["c", "e"]
+        records = _read_manifest(manifest_path)
+        assert [os.path.basename(record["instance"]) for record in records] == ["c", "e"]
+        assert [record["status"] for record in records] == ["done", "failed"] and records[1]["error"] == "RuntimeError: boom"
+        print("✅ the unfinished and missing instances run, one manifest record each")
+
+        print("\n[Test 3] retry_failed, no resume and async chats...")
+        trace("c")
+        trace("e", error="RuntimeError: boom")
+        runs.clear()
+        run_task.run_task("demo", os.path.join(root, "outputs"), retry_failed=True)
+        assert runs == ["b", "e"]
+        runs.clear()
+        run_task.run_task("demo", os.path.join(root, "outputs"), resume=False, async_chats=2)
+        assert sorted(runs) == names
+        records = _read_manifest(manifest_path)
+        assert len(records) == 2 + 2 + len(names)
+        assert sorted(os.path.basename(record["instance"]) for record in records[4:]) == names
+        print("✅ failed instances rerun, everything reruns without resume, records appended")
+    finally:
+        os.chdir(cwd)
+        for name, original in originals.items():
+            setattr(run_task, name, original)
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_run_task()
+    sys.exit(0 if success else 1)
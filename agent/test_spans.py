@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test script for the timing spans and their chrome / OpenTelemetry exports.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import tempfile
+import threading
+import time
+
+
+def test_spans():
+    """Spans nest, go to the spans file of their context, and are summarized and exported as documented."""
+    print("=" * 60)
+    print("Testing spans")
+    print("=" * 60)
+
+    import config
+    from spans import (SPANS_NAME, read_spans, reset_output, set_output, span, summarize_spans, to_chrome_trace,
+                       to_otel)
+
+    directory = tempfile.mkdtemp()
+    working_dir = os.environ.pop("VSP_WORKING_DIR", None)
+    token = set_output(directory)
+    try:
+        print("\n[Test 1] Nested spans...")
+        with span("turn", turn=1) as attrs:
+            with span("execute"):
+                time.sleep(0.02)
+            attrs["exit_code"] = 0
+        try:
+            with span("llm_call"):
+                raise TimeoutError("slow provider")
+        except TimeoutError:
+            pass
+        spans = {s["name"]: s for s in read_spans(directory)}
+        assert spans["execute"]["parent_id"] == spans["turn"]["span_id"] and spans["turn"]["parent_id"] is None
+        assert spans["turn"]["attrs"] == {"turn": 1, "exit_code": 0}
+        assert spans["turn"]["duration"] >= spans["execute"]["duration"] >= 0.02
+        assert spans["llm_call"]["attrs"] == {"error": "TimeoutError"} and spans["llm_call"]["parent_id"] is None
+        print("✅ parent ids, durations, attributes set in the block, errors recorded and raised")
+
+        print("\n[Test 2] The decorator form...")
+
+        @span("detection", backend="remote")
+        def detection(fail=False):
+            with span("detection.inference"):
+                if fail:
+                    raise RuntimeError("server down")
+            return "boxes"
+
+        try:
+            detection(fail=True)
+        except RuntimeError:
+            pass
+        with span("turn", turn=2):
+            assert detection() == "boxes"
+        calls = [s for s in read_spans(directory) if s["name"] == "detection"]
+        assert [s["attrs"] for s in calls] == [{"backend": "remote", "error": "RuntimeError"}, {"backend": "remote"}]
+        turn = [s for s in read_spans(directory) if s["name"] == "turn"][-1]
+        inference = [s for s in read_spans(directory) if s["name"] == "detection.inference"]
+        assert calls[1]["parent_id"] == turn["span_id"] and inference[1]["parent_id"] == calls[1]["span_id"]
+        print("✅ a span per call, fresh attributes each time, nested in the caller's span")
+    finally:
+        reset_output(token)
+
+    print("\n[Test 3] The spans file of each context...")
+    task_a, task_b, kernel_dir = tempfile.mkdtemp(), tempfile.mkdtemp(), tempfile.mkdtemp()
+
+    def run_task(task_directory, name):
+        token = set_output(task_directory)
+        try:
+            with span(name):
+                time.sleep(0.01)
+        finally:
+            reset_output(token)
+
+    threads = [threading.Thread(target=run_task, args=(task_a, "a")), threading.Thread(target=run_task, args=(task_b, "b"))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [s["name"] for s in read_spans(task_a)] == ["a"] and [s["name"] for s in read_spans(task_b)] == ["b"]
+    with span("nowhere"):
+        pass
+    os.environ["VSP_WORKING_DIR"] = kernel_dir
+    try:
+        with span("upload"):
+            pass
+    finally:
+        if working_dir is None:
+            del os.environ["VSP_WORKING_DIR"]
+        else:
+            os.environ["VSP_WORKING_DIR"] = working_dir
+    assert [s["name"] for s in read_spans(kernel_dir)] == ["upload"]
+    config.SPANS_CONFIG["enabled"] = False
+    try:
+        token = set_output(task_a)
+        with span("disabled") as attrs:
+            attrs["ignored"] = True
+        reset_output(token)
+    finally:
+        config.SPANS_CONFIG["enabled"] = True
+    assert len(read_spans(task_a)) == 1
+    print("✅ one file per task, VSP_WORKING_DIR in the kernel, nothing without an output or when disabled")
+
+    print("\n[Test 4] Summaries...")
+    summary_dir = tempfile.mkdtemp()
+    records = [{"name": "execute", "start": 100.0, "duration": 0.5}, {"name": "execute", "start": 101.0, "duration": 0.25},
+               {"name": "llm_call", "start": 102.0, "duration": 2.0}, {"name": "execute", "start": 90.0, "duration": 9.0}]
+    with open(os.path.join(summary_dir, SPANS_NAME), "w") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records) + '{"name": "torn')
+    assert summarize_spans(summary_dir) == {"execute": {"count": 3, "seconds": 9.75}, "llm_call": {"count": 1, "seconds": 2.0}}
+    assert summarize_spans(summary_dir, since=100.0) == {"execute": {"count": 2, "seconds": 0.75},
+                                                          "llm_call": {"count": 1, "seconds": 2.0}}
+    assert summarize_spans(tempfile.mkdtemp()) == {}
+    print("✅ count and seconds per name, since, torn lines skipped")
+
+    print("\n[Test 5] Exports...")
+    spans = read_spans(directory)
+    chrome = to_chrome_trace(spans)
+    assert chrome["displayTimeUnit"] == "ms" and len(chrome["traceEvents"]) == len(spans)
+    event = [e for e in chrome["traceEvents"] if e["name"] == "detection.inference"][0]
+    source = [s for s in spans if s["name"] == "detection.inference"][0]
+    assert event["ph"] == "X" and event["cat"] == "detection"
+    assert event["ts"] == int(source["start"] * 1e6) and event["dur"] == int(source["duration"] * 1e6)
+    assert (event["pid"], event["tid"]) == (source["pid"], source["tid"])
+
+    otel = to_otel(spans, "task_1")
+    assert json.loads(json.dumps(otel)) == otel
+    resource = otel["resourceSpans"][0]
+    assert {"key": "vsp.task", "value": {"stringValue": "task_1"}} in resource["resource"]["attributes"]
+    otel_spans = resource["scopeSpans"][0]["spans"]
+    assert len(otel_spans) == len(spans) and len({s["traceId"] for s in otel_spans}) == 1
+    assert otel_spans[0]["traceId"] == to_otel(spans, "task_1")["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["traceId"]
+    by_id = {s["spanId"]: s for s in otel_spans}
+    execute = [s for s in otel_spans if s["name"] == "execute"][0]
+    assert by_id[execute["parentSpanId"]]["name"] == "turn"
+    assert int(execute["endTimeUnixNano"]) > int(execute["startTimeUnixNano"])
+    turn = [s for s in otel_spans if s["name"] == "turn"][0]
+    assert "parentSpanId" not in turn
+    assert {"key": "turn", "value": {"intValue": "1"}} in turn["attributes"]
+    detection = [s for s in otel_spans if s["name"] == "detection"][0]
+    assert {"key": "backend", "value": {"stringValue": "remote"}} in detection["attributes"]
+    print("✅ chrome complete events in microseconds, OTLP spans with parents and typed attributes")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_spans()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Test script for the offline stub of the LLM provider and the bench summary of its runs.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import tempfile
+import time
+
+
+def _request(n_assistant, question="2 + 2?"):
+    messages = [{"role": "user", "content": question}]
+    for i in range(n_assistant):
+        messages += [{"role": "assistant", "content": f"reply {i}"}, {"role": "user", "content": "output"}]
+    return {"model": "stub-model", "messages": messages}
+
+
+def test_stub_llm():
+    """Scripted replies by turn, and latencies and injected errors that repeat for a fixed seed."""
+    print("=" * 60)
+    print("Testing StubLLM")
+    print("=" * 60)
+
+    import httpx
+
+    from stub_llm_server import DEFAULT_SCRIPT, StubLLM, server_base_url, start_server
+
+    print("\n[Test 1] Replies over HTTP...")
+    stub = StubLLM(latency_ms=50)
+    server = start_server(stub)
+    base_url = server_base_url(server)
+    try:
+        with httpx.Client(timeout=10) as client:
+            start = time.perf_counter()
+            response = client.post(f"{base_url}/chat/completions", json=_request(0))
+            assert time.perf_counter() - start >= 0.05
+            assert response.status_code == 200
+            reply = response.json()
+            assert reply["model"] == "stub-model" and reply["choices"][0]["message"]["content"] == DEFAULT_SCRIPT[0]
+            assert reply["usage"]["total_tokens"] == reply["usage"]["prompt_tokens"] + reply["usage"]["completion_tokens"]
+            contents = [client.post(f"{base_url}/chat/completions", json=_request(n)).json()["choices"][0]["message"]["content"]
+                        for n in (1, 2, 7)]
+            assert contents == [DEFAULT_SCRIPT[1], DEFAULT_SCRIPT[2], DEFAULT_SCRIPT[2]]
+            assert client.get(f"{base_url}/models").json()["data"][0]["id"] == "stub"
+            assert client.post(f"{base_url}/embeddings", json={}).status_code == 404
+        assert stub.stats == {"requests": 4, "errors": 0}
+    finally:
+        server.shutdown()
+    print("✅ one scripted reply per turn, the last one repeated, the configured latency")
+
+    print("\n[Test 2] The same seed, the same latencies and errors...")
+    bodies = [json.dumps(_request(n % 3, question=f"question {n}")).encode() for n in range(20)]
+    # every body twice: a retried request gets a new draw
+    bodies = [body for body in bodies for _ in range(2)]
+
+    def draws(seed):
+        stub = StubLLM(latency_ms=100, jitter_ms=50, error_rate=0.3, error_status=429, seed=seed)
+        return [(status, round(delay, 9)) for status, _, delay in (stub.handle(body) for body in bodies)], stub.stats
+
+    first, stats = draws(seed=7)
+    assert draws(seed=7) == (first, stats)
+    assert draws(seed=8)[0] != first
+    assert {status for status, _ in first} == {200, 429} and stats["errors"] == sum(status == 429 for status, _ in first)
+    assert all(0.05 <= delay <= 0.15 for _, delay in first)
+    # a retry is drawn again, so an error does not repeat forever
+    assert [first[i][0] for i in range(0, len(first), 2)] != [first[i][0] for i in range(1, len(first), 2)]
+
+    def over_http(seed):
+        server = start_server(StubLLM(error_rate=0.3, error_status=429, seed=seed))
+        try:
+            with httpx.Client(timeout=10) as client:
+                responses = [client.post(f"{server_base_url(server)}/chat/completions", content=body,
+                                         headers={"Content-Type": "application/json"}) for body in bodies]
+        finally:
+            server.shutdown()
+        return [(response.status_code, response.json().get("id")) for response in responses]
+
+    statuses = over_http(seed=7)
+    assert statuses == over_http(seed=7)
+    assert [status for status, _ in statuses] == [status for status, _ in first]
+    assert all(status == 200 or response_id is None for status, response_id in statuses)
+    print(f"✅ {stats['errors']} of {len(bodies)} requests failed with 429, identically on every run")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+def test_summarize_traces():
+    """Per instance, per turn and per phase latencies from the traces of a task."""
+    print("=" * 60)
+    print("Testing summarize_traces")
+    print("=" * 60)
+
+    from stub_llm_server import summarize_traces
+    from trace_writer import TRACE_NAME
+
+    task_output_dir = tempfile.mkdtemp()
+
+    def trace(name, records):
+        os.makedirs(os.path.join(task_output_dir, name))
+        with open(os.path.join(task_output_dir, name, TRACE_NAME), "w") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def message(role, t):
+        return {"type": "message", "time": t, "message": {"role": role, "content": "..."}}
+
+    trace("a", [{"type": "start", "time": 0.0}, message("user", 0.0), message("assistant", 2.0),
+                message("user", 2.5), message("assistant", 4.5),
+                {"type": "end", "time": 5.0, "phases": {"execute": {"count": 1, "seconds": 0.4},
+                                                        "llm_call": {"count": 2, "seconds": 3.9}}}])
+    trace("b", [{"type": "start", "time": 10.0}, message("user", 10.0), message("assistant", 11.0),
+                {"type": "end", "time": 11.5, "phases": {"llm_call": {"count": 1, "seconds": 0.9}}}])
+    # a run that did not finish, and an instance that never started
+    trace("c", [{"type": "start", "time": 20.0}, message("user", 20.0), message("assistant", 25.0)])
+    os.makedirs(os.path.join(task_output_dir, "d"))
+    with open(os.path.join(task_output_dir, "manifest.jsonl"), "w") as f:
+        f.write("{}\n")
+
+    print("\n[Test 1] Aggregates...")
+    summary = summarize_traces(task_output_dir)
+    assert summary["instances"] == 2 and summary["turns"] == 3
+    assert summary["instance_seconds"] == {"count": 2, "mean": 3.25, "p50": 5.0, "p95": 5.0}
+    assert summary["llm_seconds"] == {"count": 3, "mean": 1.6667, "p50": 2.0, "p95": 2.0}
+    assert summary["agent_seconds"] == {"count": 1, "mean": 0.5, "p50": 0.5, "p95": 0.5}
+    assert summary["phases"] == {"execute": {"count": 1, "seconds": 0.4}, "llm_call": {"count": 3, "seconds": 4.8}}
+    empty = summarize_traces(tempfile.mkdtemp())
+    assert empty["instances"] == 0 and empty["llm_seconds"] == {"count": 0, "mean": None, "p50": None, "p95": None}
+    print("✅ finished instances only, LLM and agent time per turn, phases summed over instances")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_stub_llm() and test_summarize_traces()
+    sys.exit(0 if success else 1)
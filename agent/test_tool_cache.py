@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for the cache of the vision tool results.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+def test_tool_result_cache():
+    """Hits are copies, both tiers serve them, and concurrent identical calls reach the expert once."""
+    print("=" * 60)
+    print("Testing ToolResultCache")
+    print("=" * 60)
+
+    from tool_cache import ToolResultCache
+
+    image = Image.new("RGB", (16, 12), (30, 60, 90))
+    output = Image.new("RGB", (16, 12), (255, 0, 0))
+    data = {"boxes": [[0.1, 0.2, 0.3, 0.4]]}
+
+    print("\n[Test 1] Keys follow the pixels and the parameters...")
+    key = ToolResultCache.make_key("detection", image, objects=["cat"], box_threshold=0.35)
+    assert key == ToolResultCache.make_key("detection", image.copy(), box_threshold=0.35, objects=["cat"])
+    assert key != ToolResultCache.make_key("detection", image, objects=["dog"], box_threshold=0.35)
+    assert key != ToolResultCache.make_key("depth", image, objects=["cat"], box_threshold=0.35)
+    print("✅ same pixels and parameters, same key")
+
+    print("\n[Test 2] Copy on put and on get...")
+    cache = ToolResultCache(memory_entries=2)
+    cache.put(key, [output], data)
+    output.putpixel((0, 0), (0, 0, 0))
+    data["boxes"].append([0, 0, 1, 1])
+    images, hit = cache.get(key)
+    assert images[0].getpixel((0, 0)) == (255, 0, 0) and hit == {"boxes": [[0.1, 0.2, 0.3, 0.4]]}
+    images[0].putpixel((0, 0), (0, 0, 0))
+    hit["boxes"].clear()
+    images, hit = cache.get(key)
+    assert images[0].getpixel((0, 0)) == (255, 0, 0) and len(hit["boxes"]) == 1
+    print("✅ changing the inputs or a hit does not change the cache")
+
+    print("\n[Test 3] Memory LRU and disk tier...")
+    cache.put("b", [], 1)
+    cache.get(key)
+    cache.put("c", [], 2)
+    assert cache.get("b") is None and cache.get(key) is not None
+    directory = tempfile.mkdtemp()
+    ToolResultCache(directory=directory).put(key, [output], {"n": 1})
+    restarted = ToolResultCache(directory=directory)
+    images, hit = restarted.get(key)
+    assert images[0].tobytes() == output.tobytes() and hit == {"n": 1}
+    assert restarted.stats == {"memory_hits": 0, "disk_hits": 1, "misses": 0}
+    restarted.get(key)
+    assert restarted.stats["memory_hits"] == 1
+    print("✅ least recently used evicted, PNG round trip through the disk tier")
+
+    print("\n[Test 4] Concurrent identical calls share one request...")
+    import tools
+
+    tool_cache = tools.tool_cache
+    tools.tool_cache = ToolResultCache()
+    calls = []
+    started = threading.Event()
+
+    def slow_expert():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return [output], {"boxes": []}
+
+    def failing_expert():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("expert down")
+
+    try:
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            results = list(pool.map(lambda _: tools._cached_call("detection", image, slow_expert, objects=["cat"]),
+                                    range(6)))
+        assert len(calls) == 1 and all(result[1] == {"boxes": []} for result in results)
+        assert len({id(result[0][0]) for result in results}) == 6  # every caller got its own copy
+        assert not tools._inflight
+
+        # a call waiting on a failed one makes its own request
+        started.clear()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            failed = pool.submit(tools._cached_call, "depth", image, failing_expert)
+            started.wait()
+            waiting = pool.submit(tools._cached_call, "depth", image, slow_expert)
+            try:
+                failed.result()
+                assert False, "the failed call should raise"
+            except RuntimeError:
+                pass
+            assert waiting.result()[1] == {"boxes": []} and len(calls) == 2
+    finally:
+        tools.tool_cache = tool_cache
+    print("✅ one expert call for 6 callers, a failure is retried by the waiting call")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_tool_result_cache()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test script for the static check that picks the tool calls to prefetch.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_find_prefetchable_calls():
+    """Only calls whose arguments can't change before the block reaches them are prefetched."""
+    print("=" * 60)
+    print("Testing find_prefetchable_calls")
+    print("=" * 60)
+
+    from tool_prefetch import find_prefetchable_calls, should_prefetch
+
+    image_1, image_2 = object(), object()
+    namespace = {"image_1": image_1, "image_2": image_2}
+
+    print("\n[Test 1] Literals and untouched variables...")
+    code = ("output_image, boxes = detection(image_1, ['cat', 'dog'], box_threshold=0.3)\n"
+            "depth_map = depth(image_2)\n"
+            "display(output_image)\n")
+    calls = find_prefetchable_calls(code, namespace)
+    assert calls == [("detection", [image_1, ["cat", "dog"]], {"box_threshold": 0.3}),
+                     ("depth", [image_2], {})], calls
+    assert should_prefetch(code)
+    # without a namespace the calls are found, their values are not
+    assert [name for name, _, _ in find_prefetchable_calls(code)] == ["detection", "depth"]
+    print("✅ both calls, with their argument values")
+
+    print("\n[Test 2] Assigned or unknown variables...")
+    code = ("image_1 = image_1.rotate(90)\n"
+            "a = detection(image_1, ['cat'])\n"
+            "b = depth(crop_image(image_2, 0, 0, 0.5, 0.5))\n"
+            "c = depth(image_3)\n")
+    assert find_prefetchable_calls(code, namespace) == []
+    print("✅ reassigned, computed and undefined arguments are skipped")
+
+    print("\n[Test 3] Variables that may be changed in place...")
+    mutations = [
+        "ImageDraw.Draw(image_1).rectangle((0, 0, 10, 10))\n",
+        "image_1.paste((255, 0, 0), (0, 0, 5, 5))\n",
+        "image_1.info['note'] = 1\n",
+        "image_1.size_hint = 3\n",
+        "helper(images=[image_1])\n",
+    ]
+    for mutation in mutations:
+        code = mutation + "a = depth(image_1)\nb = segment_and_mark(image_2)\n"
+        calls = find_prefetchable_calls(code, namespace)
+        assert calls == [("segment_and_mark", [image_2], {})], (mutation, calls)
+        assert not should_prefetch(code)
+    # passing an image to two expert tools is not a mutation
+    code = "a = depth(image_1)\nb = segment_and_mark(image_1)\n"
+    assert len(find_prefetchable_calls(code, namespace)) == 2
+    print("✅ receivers and arguments of other calls are skipped")
+
+    print("\n[Test 4] Shadowed tools, **kwargs and broken code...")
+    assert find_prefetchable_calls("depth = lambda x: x\na = depth(image_1)\n", namespace) == []
+    assert find_prefetchable_calls("a = depth(**options)\n", namespace) == []
+    assert find_prefetchable_calls("a = depth(image_1\n", namespace) == []
+    print("✅ nothing to prefetch")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_find_prefetchable_calls()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Test script for the append-only conversation trace and the output.json rebuilt from it.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import tempfile
+
+from PIL import Image
+
+
+def test_trace_writer():
+    """Messages are streamed with images stored once, and the last run can be read back as the old output.json."""
+    print("=" * 60)
+    print("Testing TraceWriter")
+    print("=" * 60)
+
+    from trace_writer import (TRACE_IMAGE_DIR, TRACE_NAME, TraceWriter, load_messages, read_trace,
+                              rebuild_output_json, trace_is_complete, trace_outcome)
+    from utils import image_to_base64
+
+    directory = tempfile.mkdtemp()
+    image = Image.new("RGB", (6, 4), (200, 10, 10))
+    messages = [
+        {"role": "user", "content": [{"type": "text", "text": "task"}, {"type": "image_url", "image_url": {"url": image}}]},
+        {"role": "assistant", "content": "ACTION: display(image_1)"},
+        {"role": "user", "content": [{"type": "text", "text": "output"}, {"type": "image_url", "image_url": {"url": image.copy()}}]},
+    ]
+
+    print("\n[Test 1] Streaming a run...")
+    writer = TraceWriter(directory, instance="demo")
+    assert trace_outcome(directory) is None and not trace_is_complete(directory)
+    for message in messages:
+        writer.write_message(message, sender=message["role"])
+    assert isinstance(messages[0]["content"][1]["image_url"]["url"], Image.Image)  # the chat history is not changed
+    # a crash here leaves a readable, incomplete trace
+    assert [record["type"] for record in read_trace(directory)] == ["start", "message", "message", "message"]
+    assert not trace_is_complete(directory)
+    writer.write_event("end", n_messages=3)
+    writer.close()
+    writer.write_event("after close")  # ignored
+    records = read_trace(directory)
+    assert [record["seq"] for record in records] == [0, 1, 2, 3, 4] and records[0]["instance"] == "demo"
+    assert os.listdir(os.path.join(directory, TRACE_IMAGE_DIR)) == [os.path.basename(
+        records[1]["message"]["content"][1]["image_url"]["path"])]
+    assert trace_is_complete(directory) and trace_outcome(directory) == "done"
+    print("✅ one record per message, identical images stored once, end record")
+
+    print("\n[Test 2] Loading the messages back...")
+    loaded = load_messages(directory)
+    assert [message["role"] for message in loaded] == ["user", "assistant", "user"]
+    assert loaded[0]["content"][1]["image_url"]["url"] == image_to_base64(image)
+    assert loaded[1]["content"] == messages[1]["content"]
+    pil_loaded = load_messages(directory, inline_images=False)
+    assert pil_loaded[2]["content"][1]["image_url"]["url"].convert("RGB").tobytes() == image.tobytes()
+    path = rebuild_output_json(directory)
+    with open(path) as f:
+        assert json.load(f) == loaded
+    print("✅ base64 images like the old output.json, or PIL images")
+
+    print("\n[Test 3] A rerun replaces the last run, a failed run is reported...")
+    writer = TraceWriter(directory, instance="demo")
+    writer.write_message(messages[1])
+    writer.write_event("error", error="LLM unavailable")
+    writer.write_event("end", n_messages=0)
+    writer.close()
+    assert [record["type"] for record in read_trace(directory)] == ["start", "message", "error", "end"]
+    assert load_messages(directory) == {"error": "LLM unavailable"}
+    assert trace_is_complete(directory) and trace_outcome(directory) == "failed"
+    # a line cut by a crash is skipped
+    with open(os.path.join(directory, TRACE_NAME), "a") as f:
+        f.write('{"type": "mess')
+    assert len(read_trace(directory)) == 4
+    print("✅ the records after the last start, error outcome, torn lines ignored")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_trace_writer()
+    sys.exit(0 if success else 1)
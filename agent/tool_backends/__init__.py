@@ -0,0 +1,52 @@
+import threading
+
+from .base import ToolBackend, VisionToolsUnavailableError
+from .remote import RemoteBackend
+from .local import LocalBackend
+
+class BackendRegistry:
+    _backends = {
+        "remote": RemoteBackend,
+        "local": LocalBackend,
+    }
+    _instances = {}
+    _lock = threading.Lock()
+    
+    @classmethod
+    def register(cls, name: str, backend_class):
+        cls._backends[name] = backend_class
+        cls._instances.pop(name, None)
+    
+    @classmethod
+    def get(cls, name: str, config: dict) -> ToolBackend:
+        # one instance per backend, so models and connections are shared by all the tools
+        if name not in cls._backends:
+            raise ValueError(f"Unknown tool backend: {name}")
+        if name not in cls._instances:
+            with cls._lock:
+                if name not in cls._instances:
+                    cls._instances[name] = cls._backends[name](config)
+        return cls._instances[name]
+    
+    @classmethod
+    def list_backends(cls):
+        return list(cls._backends.keys())
+
+
+def backend_name(tool_name: str) -> str:
+    """The backend selected for a tool in TOOL_BACKEND_CONFIG. detect_tiles follows detection."""
+    from config import TOOL_BACKEND_CONFIG
+    
+    if tool_name == "detect_tiles":
+        tool_name = "detection"
+    return TOOL_BACKEND_CONFIG.get(tool_name, "remote")
+
+
+def get_backend(name: str) -> ToolBackend:
+    from config import TOOL_BACKEND_CONFIG
+    
+    return BackendRegistry.get(name, TOOL_BACKEND_CONFIG.get(name, {}))
+
+
+# Export for easy imports
+__all__ = ['ToolBackend', 'VisionToolsUnavailableError', 'BackendRegistry', 'RemoteBackend', 'LocalBackend', 'backend_name', 'get_backend']
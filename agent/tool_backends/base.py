@@ -0,0 +1,56 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+
+class VisionToolsUnavailableError(RuntimeError):
+    """The vision tools can't run in this environment, e.g. the expert client packages are not installed.
+    Not raised for a server that fails or can't be reached."""
+
+
+class ToolBackend(ABC):
+    """Abstract base class for the backends that run the vision tools' models.
+
+    A backend returns the raw tool results, before caching and post-processing (done in tools.py):
+        segment_and_mark -> (annotated image, Boxes, regions)
+        detection -> (annotated image, Boxes)
+        depth -> (colored depth map, depth data dict or None)
+        detect_tiles -> per tile results, the tiles with detections with their "annotated_image",
+                        or None if the backend can't batch tiles
+    """
+
+    # the tools this backend can run
+    TOOLS: Tuple[str, ...] = ()
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+
+    @abstractmethod
+    def get_name(self) -> str:
+        """Return backend name for logging and cache keys."""
+        pass
+
+    def supports(self, tool_name: str) -> bool:
+        return tool_name in self.TOOLS
+
+    def cache_params(self) -> Dict[str, Any]:
+        """Settings that change the results, added to the tool cache key."""
+        return {}
+
+    def _unsupported(self, tool_name: str):
+        raise NotImplementedError(f"The {self.get_name()} backend does not run {tool_name}.")
+
+    def segment_and_mark(self, image: Image.Image, granularity: float, alpha: float, anno_mode: List[str],
+                         response_mode: str = "bboxes"):
+        self._unsupported("segment_and_mark")
+
+    def detection(self, image: Image.Image, objects: List[str], box_threshold: float, text_threshold: float):
+        self._unsupported("detection")
+
+    def depth(self, image: Image.Image, response_mode: str = "colored"):
+        self._unsupported("depth")
+
+    def detect_tiles(self, image: Image.Image, objects: List[str], tiles: List[List[float]], box_threshold: float,
+                     text_threshold: float) -> Optional[List[Dict]]:
+        return None
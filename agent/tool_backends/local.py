@@ -0,0 +1,144 @@
+import base64
+import io
+import os
+import sys
+import threading
+from typing import Any, Dict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from boxes import Boxes
+from spans import span
+
+from .base import ToolBackend
+
+
+def _add_path(path: str):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def _png_base64(array: np.ndarray) -> str:
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class LocalBackend(ToolBackend):
+    """In-process versions of the experts, on CPU by default, for offline runs, CI and small latency-sensitive jobs.
+
+    They use the model code under vision_experts/ with smaller checkpoints: Depth-Anything ViT-S
+    (depth_anything_vits14) and GroundingDINO SwinT, whose deformable attention runs through
+    multi_scale_deformable_attn_pytorch when the CUDA ops are not built or the device is the CPU.
+    segment_and_mark needs Semantic-SAM on a GPU and has no local version.
+
+    Models are loaded on first use, and one forward pass runs at a time per model (torch already
+    uses all `num_threads` for one pass).
+    """
+
+    TOOLS = ("detection", "depth")
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        import torch
+
+        self.device = config.get("device", "cpu")
+        if config.get("num_threads"):
+            torch.set_num_threads(config["num_threads"])
+        self._models = {}
+        self._load_lock = threading.Lock()
+        self._run_locks = {"depth": threading.Lock(), "detection": threading.Lock()}
+
+    def get_name(self) -> str:
+        return "local"
+
+    def cache_params(self) -> Dict[str, Any]:
+        return {"depth_encoder": self.config.get("depth_encoder", "vits"),
+                "grounding_dino_checkpoint": os.path.basename(self.config.get("grounding_dino_checkpoint", ""))}
+
+    def _model(self, name: str):
+        if name not in self._models:
+            with self._load_lock:
+                if name not in self._models:
+                    with span(f"{name}.load", backend="local"):
+                        self._models[name] = self._load_depth() if name == "depth" else self._load_grounding_dino()
+        return self._models[name]
+
+    def _load_depth(self):
+        from torchvision.transforms import Compose
+
+        _add_path(self.config["depth_anything_dir"])
+        from depth_anything.dpt import DepthAnything
+        from depth_anything.util.transform import Resize, NormalizeImage, PrepareForNet
+
+        encoder = self.config.get("depth_encoder", "vits")
+        print(f"[TOOL_BACKENDS] Loading Depth-Anything {encoder} on {self.device}")
+        model = DepthAnything.from_pretrained(f"LiheYoung/depth_anything_{encoder}14").to(self.device).eval()
+        # the transform of depthanything_server.py
+        transform = Compose([
+            Resize(width=518, height=518, resize_target=False, keep_aspect_ratio=True, ensure_multiple_of=14,
+                   resize_method='lower_bound', image_interpolation_method=cv2.INTER_CUBIC),
+            NormalizeImage(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
+            PrepareForNet(),
+        ])
+        return model, transform
+
+    def _load_grounding_dino(self):
+        directory = self.config["grounding_dino_dir"]
+        _add_path(directory)
+        import groundingdino.datasets.transforms as T
+        from groundingdino.util.inference import load_model, predict
+
+        print(f"[TOOL_BACKENDS] Loading GroundingDINO on {self.device}")
+        model = load_model(os.path.join(directory, self.config["grounding_dino_config"]),
+                           os.path.join(directory, self.config["grounding_dino_checkpoint"]), device=self.device)
+        # the transform of groundingdino.util.inference.load_image
+        transform = T.Compose([
+            T.RandomResize([800], max_size=1333),
+            T.ToTensor(),
+            T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ])
+        return model, transform, predict
+
+    def depth(self, image, response_mode="colored"):
+        import torch
+        import torch.nn.functional as F
+
+        model, transform = self._model("depth")
+        array = np.asarray(image.convert("RGB"))
+        h, w = array.shape[:2]
+        tensor = torch.from_numpy(transform({'image': array / 255.0})['image']).unsqueeze(0).to(self.device)
+        with span("depth.inference", backend="local"), self._run_locks["depth"], torch.no_grad():
+            depth = model(tensor)
+        depth = F.interpolate(depth[None], (h, w), mode='bilinear', align_corners=False)[0, 0]
+
+        depth_min, depth_max = float(depth.min()), float(depth.max())
+        normalized = ((depth - depth_min) / (depth_max - depth_min) * 255.0).cpu().numpy().astype(np.uint8)
+        colored = cv2.applyColorMap(normalized, cv2.COLORMAP_INFERNO)[:, :, ::-1].copy()
+
+        # the depth data of the server's response modes
+        depth_data = {"height": int(h), "width": int(w), "depth_min": depth_min, "depth_max": depth_max}
+        if response_mode == "float16":
+            raw = depth.to(torch.float16).cpu().numpy().astype("<f2")
+            depth_data["depth_float16_base64"] = base64.b64encode(raw.tobytes()).decode("ascii")
+        elif response_mode != "colored":
+            depth_data["depth_map_grayscale_base64"] = _png_base64(normalized)
+            depth_data["depth_map_colored_base64"] = _png_base64(colored)
+        return Image.fromarray(colored), depth_data
+
+    def detection(self, image, objects, box_threshold, text_threshold):
+        model, transform, predict = self._model("detection")
+        # annotated by the detection server's code (vision_experts/annotation.py)
+        _add_path(self.config["vision_experts_dir"])
+        from annotation import annotate_image
+
+        image_source = image.convert("RGB")
+        tensor, _ = transform(image_source, None)
+        with span("detection.inference", backend="local"), self._run_locks["detection"]:
+            boxes, logits, phrases = predict(model=model, image=tensor, caption=', '.join(objects),
+                                             box_threshold=box_threshold, text_threshold=text_threshold,
+                                             device=self.device)
+        boxes = boxes.tolist()
+        return annotate_image(image_source, boxes, phrases), Boxes(boxes, format="cxcywh")
@@ -0,0 +1,221 @@
+import base64
+import json
+import sys
+import tempfile
+from typing import Any, Dict
+
+from boxes import Boxes
+from config import IMAGE_TRANSPORT_CONFIG
+from image_transport import ImageTransport
+from spans import span
+
+from .base import ToolBackend, VisionToolsUnavailableError
+
+
+def _file_wrapper():
+    # Try different ways to import 'file' (depends on gradio_client version)
+    try:
+        from gradio_client import file
+    except ImportError:
+        try:
+            from gradio_client.utils import file
+        except ImportError:
+            # In some versions, file might not be needed or has a different name
+            file = None
+    return file
+
+
+class RemoteBackend(ToolBackend):
+    """The vision expert servers at SOM_ADDRESS, GROUNDING_DINO_ADDRESS and DEPTH_ANYTHING_ADDRESS.
+    Connections and replicas are handled by expert_clients.py, images are moved by image_transport.py.
+
+    A call goes to the server's binary HTTP route (/v1/<tool>, see vision_experts/fast_api.py): one POST
+    with the encoded image, answered with the PNG output and its data. Servers without the route (older
+    ones, or launched with EXPERT_FAST_API=0) are called through their gradio API.
+    """
+
+    TOOLS = ("segment_and_mark", "detection", "depth", "detect_tiles")
+
+    def __init__(self, config: Dict[str, Any]):
+        super().__init__(config)
+        try:
+            import gradio_client  # noqa: F401
+            import expert_clients
+        except ImportError as e:
+            raise VisionToolsUnavailableError(f"Vision tools are not available ({e}). This function requires vision expert services.")
+        self.expert_clients = expert_clients
+        self.file = _file_wrapper()
+        # how images are sent to the vision experts. Lossless PNG by default.
+        self.image_transport = ImageTransport.from_config(IMAGE_TRANSPORT_CONFIG, session=expert_clients.http_session())
+        # (server, tool) pairs whose server has none of the optional inputs, e.g. response_mode on an older server
+        self._unsupported_params = set()
+        self._detect_tiles_supported = True
+        self.protocol = config.get("protocol", "auto")
+        if self.protocol not in ("auto", "http", "gradio"):
+            raise ValueError(f"Unknown expert protocol: {self.protocol}")
+        self.wire = None
+        if self.protocol != "gradio":
+            if config.get("vision_experts_dir") and config["vision_experts_dir"] not in sys.path:
+                sys.path.append(config["vision_experts_dir"])
+            import wire
+            self.wire = wire
+        # replica addresses without the HTTP routes
+        self._no_http = set()
+
+    def get_name(self) -> str:
+        return "remote"
+
+    def cache_params(self) -> Dict[str, Any]:
+        # a lossy transport changes what the expert sees
+        return {"transport": [self.image_transport.format, self.image_transport.quality]}
+
+    def _wrap_file(self, filepath):
+        """Wrap a file path for gradio_client.predict() calls.
+        Uses the 'file' wrapper if available, otherwise returns the path directly."""
+        if self.file is not None:
+            return self.file(filepath)
+        # In newer versions, gradio_client might accept paths directly
+        return filepath
+
+    def call_expert(self, tool_name, image, *args, api_name=None, expert=None, **params):
+        # upload the image from memory and run the expert. If the upload route can't be used,
+        # fall back to a temp file that gradio_client uploads itself.
+        # `params` are optional keyword inputs; servers that don't have them are called without.
+        # Returns the client that ran the call, to download its outputs, and the outputs.
+        image_transport = self.image_transport
+
+        def run(client):
+            tmp_file = None
+            with span(f"{tool_name}.upload"):
+                image_value = image_transport.upload(client, image)
+                if image_value is None:
+                    tmp_file = tempfile.NamedTemporaryFile(suffix=f".{image_transport.format.lower()}", delete=True)
+                    image_transport.save(image, tmp_file.name)
+                    image_value = self._wrap_file(tmp_file.name)
+            key = (getattr(client, "src", id(client)), tool_name)
+            try:
+                with span(f"{tool_name}.inference"):
+                    if params and key not in self._unsupported_params:
+                        try:
+                            return client, client.predict(image_value, *args, api_name=api_name, **params)
+                        except (TypeError, ValueError) as e:
+                            # gradio_client rejects unknown keyword inputs before sending anything
+                            if "key-word" not in str(e):
+                                raise
+                            print(f"[VSP_TOOLS] The {tool_name} server has no {', '.join(params)} input, using its full response")
+                            self._unsupported_params.add(key)
+                    return client, client.predict(image_value, *args, api_name=api_name)
+            finally:
+                if tmp_file is not None:
+                    tmp_file.close()
+
+        return self.expert_clients.get_expert(expert or tool_name).call(run)
+
+    def call_http(self, tool_name, route, image, expert=None, **request):
+        """Run the expert's /v1/<route> with the image and `request`, returns the response document.
+        None if the server has no such route, to call its gradio API instead."""
+        if self.protocol == "gradio":
+            return None
+        wire = self.wire
+
+        def run(replica):
+            if replica.address in self._no_http:
+                return None
+            with span(f"{tool_name}.upload"):
+                body = wire.pack({"image": self.image_transport.encode(image), **request})
+            with span(f"{tool_name}.inference"):
+                response = self.expert_clients.http_session().post(
+                    f"{replica.address}/v1/{route}", content=body, headers={"Content-Type": wire.MEDIA_TYPE},
+                    timeout=self.image_transport.timeout)
+            if response.status_code in (404, 405) and self.protocol == "auto":
+                print(f"[VSP_TOOLS] The {tool_name} server at {replica.address} has no /v1/{route} route, using its gradio API")
+                self._no_http.add(replica.address)
+                return None
+            if response.status_code != 200:
+                raise RuntimeError(f"The {tool_name} server at {replica.address} failed: {response.status_code} {response.text}")
+            with span(f"{tool_name}.download"):
+                return wire.unpack(response.content)
+
+        return self.expert_clients.get_expert(expert or tool_name).call(run, use_gradio=False)
+
+    def segment_and_mark(self, image, granularity, alpha, anno_mode, response_mode="bboxes"):
+        response = self.call_http("segment_and_mark", "segment_and_mark", image, slider=granularity, alpha=alpha,
+                                  label_mode="Number", anno_mode=anno_mode, response_mode=response_mode)
+        if response is not None:
+            annotated_image, masks_data = self.image_transport.decode(response["image"]), response["data"]
+        else:
+            som_client, outputs = self.call_expert("segment_and_mark", image, granularity, alpha, "Number", anno_mode,
+                                                   response_mode=response_mode)
+
+            with span("segment_and_mark.download"):
+                annotated_image = self.image_transport.download_image(som_client, outputs[0])
+                # the masks are either parsed data or a JSON file
+                masks_data = self.image_transport.download_json(som_client, outputs[1])
+        w, h = annotated_image.size
+
+        bboxes = Boxes.from_pixels([mask['bbox'] for mask in masks_data], w, h)
+        if response_mode == "bboxes":
+            # an older server sends the masks anyway, don't keep them
+            masks_data = [{k: v for k, v in mask.items() if not k.startswith("mask_")} for mask in masks_data]
+        return annotated_image, bboxes, masks_data
+
+    def detection(self, image, objects, box_threshold, text_threshold):
+        response = self.call_http("detection", "detection", image, text=', '.join(objects),
+                                  box_threshold=box_threshold, text_threshold=text_threshold)
+        if response is not None:
+            annotated_image, boxes_data = self.image_transport.decode(response["image"]), response["data"]
+        else:
+            gd_client, outputs = self.call_expert("detection", image, ', '.join(objects), box_threshold, text_threshold,
+                                                  api_name="/predict")
+
+            with span("detection.download"):
+                annotated_image = self.image_transport.download_image(gd_client, outputs[0])
+                # process boxes, either parsed data or a JSON file
+                boxes_data = self.image_transport.download_json(gd_client, outputs[1])
+
+        # the server's boxes are center x, center y, width, height
+        return annotated_image, Boxes(boxes_data['boxes'], format="cxcywh")
+
+    def depth(self, image, response_mode="colored"):
+        response = self.call_http("depth", "depth", image, response_mode=response_mode)
+        if response is not None:
+            return self.image_transport.decode(response["image"]), response["data"]
+        da_client, outputs = self.call_expert("depth", image, response_mode=response_mode)
+        # the colored map and the depth data. Servers without the depth data output return only the map.
+        if isinstance(outputs, (list, tuple)):
+            image_output, data_output = outputs[0], outputs[1] if len(outputs) > 1 else None
+        else:
+            image_output, data_output = outputs, None
+        with span("depth.download"):
+            depth_image = self.image_transport.download_image(da_client, image_output)
+            depth_data = self.image_transport.download_json(da_client, data_output) if data_output is not None else None
+        return depth_image, depth_data
+
+    def detect_tiles(self, image, objects, tiles, box_threshold, text_threshold):
+        response = self.call_http("detect_tiles", "detect_tiles", image, expert="detection", text=', '.join(objects),
+                                  tiles=tiles, box_threshold=box_threshold, text_threshold=text_threshold)
+        if response is not None:
+            return self._tile_results(response["data"]["tiles"])
+        if not self._detect_tiles_supported:
+            self._unsupported("detect_tiles")
+        try:
+            gd_client, outputs = self.call_expert("detect_tiles", image, ', '.join(objects), json.dumps(tiles),
+                                                  box_threshold, text_threshold, api_name="/detect_tiles",
+                                                  expert="detection")
+        except ValueError as e:
+            # gradio_client raises ValueError for an unknown api_name
+            print(f"[VSP_TOOLS] Detection server has no /detect_tiles, falling back to one call per tile ({e})")
+            self._detect_tiles_supported = False
+            self._unsupported("detect_tiles")
+        with span("detect_tiles.download"):
+            return self._tile_results(self.image_transport.download_json(gd_client, outputs)["tiles"])
+
+    def _tile_results(self, tile_results):
+        # the tiles with detections come annotated by the server, as PNG bytes on the binary API and base64
+        # on the gradio API. Older servers don't annotate the tiles.
+        for result in tile_results:
+            if "image_png" in result:
+                result["annotated_image"] = self.image_transport.decode(result.pop("image_png"))
+            elif "image_png_base64" in result:
+                result["annotated_image"] = self.image_transport.decode(base64.b64decode(result.pop("image_png_base64")))
+        return tile_results
@@ -0,0 +1,102 @@
+import copy
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from image_encoding import image_content_hash
+
+
+class ToolResultCache:
+    """Cache of the raw results of the vision tools (segment_and_mark, detection, depth).
+
+    The key is the tool name, the content hash of the input image and the tool parameters, so the
+    same call on the same pixels hits the cache no matter which PIL object holds them. Results are
+    cached before post-processing, and every lookup returns copies, so callers can't alter the cache.
+
+    There are two tiers: an in-process LRU of `memory_entries` results, and an optional on-disk tier
+    (diskcache, shared by all kernels and reruns) of at most `max_size_mb`, where images are stored as PNG.
+    """
+
+    def __init__(self, memory_entries: int = 64, directory: Optional[str] = None, max_size_mb: float = 2048):
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if directory:
+            import diskcache
+            self._disk = diskcache.Cache(directory, size_limit=int(max_size_mb * 1024 * 1024),
+                                         eviction_policy="least-recently-used")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "ToolResultCache":
+        return cls(
+            memory_entries=config.get("memory_entries", 64),
+            directory=config.get("directory") if config.get("disk", True) else None,
+            max_size_mb=config.get("max_size_mb", 2048),
+        )
+
+    @staticmethod
+    def make_key(tool_name: str, image: Image.Image, **params) -> str:
+        payload = json.dumps({"tool": tool_name, "image": image_content_hash(image), "params": params},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def _copy(images: List[Image.Image], data):
+        return [image.copy() for image in images], copy.deepcopy(data)
+
+    def get(self, key: str):
+        """Return (images, data) for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return self._copy(*entry)
+
+        if self._disk is not None:
+            stored = self._disk.get(key)
+            if stored is not None:
+                images = []
+                for data in stored["images"]:
+                    image = Image.open(io.BytesIO(data))
+                    image.load()
+                    images.append(image)
+                self._remember(key, images, stored["data"])
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                return self._copy(images, stored["data"])
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def _remember(self, key: str, images: List[Image.Image], data):
+        with self._lock:
+            self._memory[key] = (images, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key: str, images: List[Image.Image], data):
+        images, data = self._copy(images, data)
+        self._remember(key, images, data)
+        if self._disk is not None:
+            encoded = []
+            for image in images:
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG")
+                encoded.append(buffer.getvalue())
+            self._disk.set(key, {"images": encoded, "data": data})
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
@@ -0,0 +1,89 @@
+import ast
+from typing import Dict, List, Optional, Tuple
+
+# the tools that call a remote expert, and so are worth starting early
+PREFETCHABLE_TOOLS = ("segment_and_mark", "detection", "depth")
+
+
+class _NotStatic(Exception):
+    pass
+
+
+def _assigned_names(tree: ast.AST) -> set:
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            names.add(node.id)
+    return names
+
+
+def _escaped_names(tree: ast.AST) -> set:
+    # variables the code may change in place: the receiver or an argument of any call other than a
+    # prefetchable tool call (e.g. image_1.paste(...), ImageDraw.Draw(image_1)), and the object of an
+    # attribute or item assignment (image_1.info[...] = ...)
+    names = set()
+
+    def add(node):
+        names.update(child.id for child in ast.walk(node) if isinstance(child, ast.Name))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id in PREFETCHABLE_TOOLS:
+                continue
+            if isinstance(node.func, ast.Attribute):
+                add(node.func.value)
+            for arg in node.args:
+                add(arg)
+            for keyword in node.keywords:
+                add(keyword.value)
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            add(node.value)
+    return names
+
+
+def _static_value(node: ast.AST, namespace: Optional[Dict], assigned: set):
+    # the value of an argument known before the code runs: a literal, or a variable the code neither
+    # reassigns nor hands to other code that could change it in place
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        values = [_static_value(element, namespace, assigned) for element in node.elts]
+        return values if isinstance(node, ast.List) else tuple(values)
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    if isinstance(node, ast.Name) and node.id not in assigned:
+        if namespace is None:
+            return None
+        if node.id in namespace:
+            return namespace[node.id]
+    raise _NotStatic()
+
+
+def find_prefetchable_calls(code: str, namespace: Optional[Dict] = None) -> List[Tuple[str, list, dict]]:
+    """The calls to the expert tools in `code` whose arguments are known before the code runs,
+    as (tool name, args, kwargs). Without a namespace only the calls are found, with None as argument values.
+    A variable counts as known if the code doesn't assign it and doesn't pass it to (or call a method of)
+    anything but the expert tools, so it can't be mutated in place before the tool call."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    assigned = _assigned_names(tree) | _escaped_names(tree)
+    calls = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in PREFETCHABLE_TOOLS):
+            continue
+        if node.func.id in assigned or any(keyword.arg is None for keyword in node.keywords):
+            continue
+        try:
+            args = [_static_value(arg, namespace, assigned) for arg in node.args]
+            kwargs = {keyword.arg: _static_value(keyword.value, namespace, assigned) for keyword in node.keywords}
+        except _NotStatic:
+            continue
+        calls.append((node.func.id, args, kwargs))
+    return calls
+
+
+def should_prefetch(code: str) -> bool:
+    """True if the code has at least two expert tool calls that can be started ahead, so they can overlap."""
+    return len(find_prefetchable_calls(code)) >= 2
@@ -4,51 +4,162 @@ import numpy as np
 import tempfile
 import time, os
 import cv2, json, sys, random
+import threading
+import inspect
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from matplotlib import colormaps
 from matplotlib.colors import Normalize
+from spans import span
+from image_transport import ImageTransport
+from tool_cache import ToolResultCache
+from boxes import Boxes
+from tool_backends import VisionToolsUnavailableError, backend_name, get_backend
+from tool_prefetch import find_prefetchable_calls
+from config import TOOL_BACKEND_CONFIG, TOOL_CACHE_CONFIG, TOOL_FANOUT_CONFIG
 
 # Try to import vision tools (may not be available for all task types)
 try:
     from gradio_client import Client
-    # Try different ways to import 'file' (depends on gradio_client version)
-    try:
-        from gradio_client import file
-    except ImportError:
-        try:
-            from gradio_client.utils import file
-        except ImportError:
-            # In some versions, file might not be needed or has a different name
-            file = None
     
     from multimodal_conversable_agent import MultimodalConversableAgent
-    from config import SOM_ADDRESS, GROUNDING_DINO_ADDRESS, DEPTH_ANYTHING_ADDRESS
-    
-    # Initialize vision expert clients
-    som_client = Client(SOM_ADDRESS)
-    gd_client = Client(GROUNDING_DINO_ADDRESS)
-    da_client = Client(DEPTH_ANYTHING_ADDRESS)
+    import expert_clients
     
+    # the vision expert clients are created on first use (see expert_clients.py),
+    # so importing the tools doesn't wait on the expert servers
     VISION_TOOLS_AVAILABLE = True
     print("✅ Vision tools successfully loaded")
 except ImportError as e:
-    # Vision tools not available (e.g., for geometry tasks)
-    print(f"Note: Vision tools not available ({e}). Geometry and other non-vision tools will still work.")
-    som_client = None
-    gd_client = None
-    da_client = None
-    VISION_TOOLS_AVAILABLE = False
-    file = None
-
-
-# Helper function to wrap file paths for gradio_client
-def _wrap_file(filepath):
-    """Wrap a file path for gradio_client.predict() calls.
-    Uses the 'file' wrapper if available, otherwise returns the path directly."""
-    if file is not None:
-        return file(filepath)
+    # the in-process backends don't need the expert servers
+    VISION_TOOLS_AVAILABLE = any(TOOL_BACKEND_CONFIG.get(tool, "remote") != "remote"
+                                 for tool in ("segment_and_mark", "detection", "depth"))
+    if VISION_TOOLS_AVAILABLE:
+        print(f"Note: Vision expert servers not available ({e}). Tools with a local backend will still work.")
     else:
-        # In newer versions, gradio_client might accept paths directly
-        return filepath
+        # Vision tools not available (e.g., for geometry tasks)
+        print(f"Note: Vision tools not available ({e}). Geometry and other non-vision tools will still work.")
+
+
+def __getattr__(name):
+    # som_client, gd_client and da_client connect on first access
+    if name in ("som_client", "gd_client", "da_client"):
+        return getattr(expert_clients, name) if "expert_clients" in globals() else None
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def set_image_transport(format="PNG", quality=95):
+    """Choose how images are encoded for the vision experts: "PNG" (lossless) or "JPEG" / "WEBP" with a quality."""
+    remote = get_backend("remote")
+    remote.image_transport = ImageTransport(format=format, quality=quality, timeout=remote.image_transport.timeout,
+                                            session=remote.image_transport.session)
+
+
+def _run_backend(tool_name, image, run, **params):
+    # run a tool on the backend selected for it (see tool_backends/), through the tool cache.
+    # If that backend fails and TOOL_BACKEND_CONFIG has a fallback, the call is run there instead.
+    if not VISION_TOOLS_AVAILABLE:
+        raise VisionToolsUnavailableError("Vision tools are not available. This function requires vision expert services.")
+    name = backend_name(tool_name)
+    fallback = TOOL_BACKEND_CONFIG.get("fallback")
+    try:
+        backend = get_backend(name)
+        return _cached_call(tool_name, image, lambda: run(backend), backend=name, **backend.cache_params(), **params)
+    except NotImplementedError:
+        raise
+    except Exception as e:
+        if not fallback or fallback == name:
+            raise
+        print(f"[VSP_TOOLS] The {name} backend failed for {tool_name} ({e}), using the {fallback} backend")
+    backend = get_backend(fallback)
+    return _cached_call(tool_name, image, lambda: run(backend), backend=fallback, **backend.cache_params(), **params)
+
+
+# results of earlier calls with the same image and parameters, in this process and on disk
+tool_cache = ToolResultCache.from_config(TOOL_CACHE_CONFIG) if TOOL_CACHE_CONFIG["enabled"] else None
+
+
+# cache key -> Event of the call computing it, so concurrent identical calls hit the expert once
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _cached_call(tool_name, image, compute, **params):
+    # return the (images, data) of a tool call, from the cache or from compute().
+    # While a call is in flight, an identical call waits for it instead of sending its own request.
+    if tool_cache is None:
+        return compute()
+    key = tool_cache.make_key(tool_name, image, **params)
+    while True:
+        with span(f"{tool_name}.cache") as attrs:
+            cached = tool_cache.get(key)
+            attrs["hit"] = cached is not None
+        if cached is not None:
+            return cached
+        
+        with _inflight_lock:
+            event = _inflight.get(key)
+            owner = event is None
+            if owner:
+                event = _inflight[key] = threading.Event()
+        if not owner:
+            # look the result up again once the other call is done. If it failed, this call tries itself.
+            with span(f"{tool_name}.wait"):
+                event.wait()
+            continue
+        
+        try:
+            images, data = compute()
+            tool_cache.put(key, images, data)
+            return images, data
+        finally:
+            with _inflight_lock:
+                del _inflight[key]
+            event.set()
+
+
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_FANOUT_CONFIG.get("max_workers", 8), thread_name_prefix="vsp_tool")
+
+
+def submit(tool, *args, **kwargs):
+    """Start a tool call in the background and return a concurrent.futures.Future of its result.
+    Calls to different experts overlap, so the wait is the longest call instead of their sum.
+
+    Example:
+        depth_future = submit(depth, image_1)
+        som_future = submit(segment_and_mark, image_1)
+        depth_map = depth_future.result()
+        output_image, bboxes = som_future.result()
+    """
+    context = contextvars.copy_context()
+    return _tool_executor.submit(context.run, tool, *args, **kwargs)
+
+
+def prefetch_tool_calls(code, namespace):
+    """Start the expert tool calls of a code block in the background before the block runs.
+    Only calls whose arguments are known beforehand are started. When the block reaches them,
+    they find the result in the tool cache, or wait for the call in flight."""
+    if tool_cache is None or not VISION_TOOLS_AVAILABLE:
+        return []
+    # prefetch the raw expert calls: the tools print and post-process when the code block calls them
+    tools = {"segment_and_mark": (segment_and_mark, _segment_and_mark_raw),
+             "detection": (detection, _detection_raw),
+             "depth": (depth, _depth_raw)}
+    futures = []
+    for name, args, kwargs in find_prefetchable_calls(code, namespace):
+        tool, raw = tools[name]
+        try:
+            arguments = inspect.signature(tool).bind(*args, **kwargs).arguments
+        except TypeError:
+            # a wrong call fails in the code block itself
+            continue
+        # the call hashes and sends a snapshot of the images, taken before the block runs: whatever the block
+        # does to them meanwhile, the cached result belongs to the pixels it is keyed on
+        arguments = {key: value.copy() if isinstance(value, Image.Image) else value for key, value in arguments.items()}
+        future = submit(raw, **arguments)
+        # errors are raised again by the call in the code block itself
+        future.add_done_callback(lambda f: f.exception())
+        futures.append(future)
+    return futures
 
 
 class AnnotatedImage:
@@ -60,6 +171,43 @@ class AnnotatedImage:
 
 
 
+def _segment_and_mark_raw(image, granularity=1.8, alpha=0.1, anno_mode=['Mask', 'Mark'], response_mode="bboxes"):
+    # the expert call of segment_and_mark, cached, without the post-processing.
+    # Returns the annotated image, the bboxes and the server's regions, whose masks depend on `response_mode`:
+    # none with "bboxes", RLE with "rle", PNG base64 with "full" (see segment_masks).
+    def run(backend):
+        annotated_image, bboxes, regions = backend.segment_and_mark(image, granularity, alpha, anno_mode, response_mode)
+        return [annotated_image], (bboxes, regions)
+    
+    (annotated_image,), (bboxes, regions) = _run_backend("segment_and_mark", image, run, granularity=granularity,
+                                                         alpha=alpha, anno_mode=list(anno_mode),
+                                                         response_mode=response_mode)
+    return annotated_image, bboxes, regions
+
+
+def _detection_raw(image, objects, box_threshold=0.35, text_threshold=0.25):
+    # the expert call of detection, cached, without the post-processing
+    def run(backend):
+        annotated_image, processed_boxes = backend.detection(image, objects, box_threshold, text_threshold)
+        return [annotated_image], processed_boxes
+    
+    (annotated_image,), processed_boxes = _run_backend("detection", image, run, objects=list(objects),
+                                                       box_threshold=box_threshold, text_threshold=text_threshold)
+    return annotated_image, processed_boxes
+
+
+def _depth_raw(image, response_mode="colored"):
+    # the expert call of depth, cached. Returns the colored depth map and the server's depth data, which has
+    # the raw float16 depth with response_mode="float16" (see depth_values).
+    def run(backend):
+        depth_image, depth_data = backend.depth(image, response_mode)
+        return [depth_image], depth_data
+    
+    (output_image,), depth_data = _run_backend("depth", image, run, response_mode=response_mode)
+    return output_image, depth_data
+
+
+@span("segment_and_mark")
 def segment_and_mark(image, granularity:float = 1.8, alpha:float = 0.1, anno_mode:list = ['Mask', 'Mark']):
     """Use a segmentation model to segment the image, and add colorful masks on the segmented objects. Each segment is also labeled with a number.
     The annotated image is returned along with the bounding boxes of the segmented objects.
@@ -73,7 +221,7 @@ def segment_and_mark(image, granularity:float = 1.8, alpha:float = 0.1, anno_mod
 
     Returns:
         output_image (AnnotatedImage): the original image annotated with colorful masks and number labels. Each mask is labeled with a number. The number label starts at 1.
-        bboxes (List): listthe bounding boxes of the masks.The order of the boxes is the same as the order of the number labels.
+        bboxes (Boxes): a list of (x, y, w, h) tuples, the bounding boxes of the masks. The order of the boxes is the same as the order of the number labels.
         
     Example:
         User request: I want to find a seat close to windows, where should I sit?
@@ -93,34 +241,9 @@ def segment_and_mark(image, granularity:float = 1.8, alpha:float = 0.1, anno_mod
     """
     print("[VSP_TOOL_USED] segment_and_mark")
     
-    if not VISION_TOOLS_AVAILABLE or som_client is None:
-        raise RuntimeError("Vision tools are not available. This function requires vision expert services.")
-    
-    with tempfile.NamedTemporaryFile(delete=True) as tmp_file:
-        image.save(tmp_file.name, 'JPEG')
-        image = tmp_file.name
-
-        outputs = som_client.predict(_wrap_file(image), granularity, alpha, "Number", anno_mode)
-
-        original_image = Image.open(image)
-        output_image = Image.open(outputs[0])
-        
-        output_image = AnnotatedImage(output_image, original_image)
-        
-        w,h = output_image.annotated_image.size
-        
-        # Check if outputs[1] is a file path (string) or already parsed data
-        masks_data = outputs[1]
-        if isinstance(masks_data, str):
-            # It's a file path, load the JSON
-            with open(masks_data, 'r') as f:
-                masks_data = json.load(f)
-        
-        bboxes = []
-        
-        for mask in masks_data:
-            bbox = mask['bbox']
-            bboxes.append((bbox[0]/w, bbox[1]/h, bbox[2]/w, bbox[3]/h))
+    annotated_image, bboxes, _ = _segment_and_mark_raw(image, granularity, alpha, anno_mode)
+    # the caller's image is the original, no need to decode what was sent
+    output_image = AnnotatedImage(annotated_image, image)
         
     # Apply post-processing (transparent to LLM)
     from post_processors import apply_postprocess
@@ -129,6 +252,7 @@ def segment_and_mark(image, granularity:float = 1.8, alpha:float = 0.1, anno_mod
     return output_image, bboxes
 
 
+@span("detection")
 def detection(image, objects, box_threshold:float = 0.35, text_threshold:float = 0.25):
     """Object detection using Grounding DINO model. It returns the annotated image and the bounding boxes of the detected objects.
     The text can be simple noun, or simple phrase (e.g., 'bus', 'red car'). Cannot be too hard or the model will break.
@@ -142,43 +266,18 @@ def detection(image, objects, box_threshold:float = 0.35, text_threshold:float =
 
     Returns:
         output_image (AnnotatedImage): the original image, annotated with bounding boxes. Each box is labeled with the detected object, and an index.
-        processed boxes (List): listthe bounding boxes of the detected objects
+        processed boxes (Boxes): a list of (x, y, w, h) tuples, the bounding boxes of the detected objects
     
     Example:
         image = Image.open("sample_img.jpg")
         output_image, boxes = detection(image, ["bus"])
         display(output_image.annotated_image)
-        print(boxes) # [[0.24, 0.21, 0.3, 0.4], [0.6, 0.3, 0.2, 0.3]]
+        print(boxes) # [(0.24, 0.21, 0.3, 0.4), (0.6, 0.3, 0.2, 0.3)]
     """
     print("[VSP_TOOL_USED] detection")
     
-    if not VISION_TOOLS_AVAILABLE or gd_client is None:
-        raise RuntimeError("Vision tools are not available. This function requires vision expert services.")
-    
-    with tempfile.NamedTemporaryFile(delete=True) as tmp_file:
-        image.save(tmp_file.name, 'JPEG')
-        image = tmp_file.name
-    
-        outputs = gd_client.predict(_wrap_file(image), ', '.join(objects), box_threshold, text_threshold)
-        
-        # process images
-        original_image = Image.open(image)
-        output_image = Image.open(outputs[0])
-        output_image = AnnotatedImage(output_image, original_image)
-        
-        # process boxes
-        # Check if outputs[1] is a file path (string) or already parsed data
-        boxes_data = outputs[1]
-        if isinstance(boxes_data, str):
-            # It's a file path, load the JSON
-            with open(boxes_data, 'r') as f:
-                boxes_data = json.load(f)
-        
-        boxes = boxes_data['boxes']
-        processed_boxes = []
-        
-        for box in boxes:
-            processed_boxes.append((box[0]-box[2]/2, box[1] - box[3]/2, box[2], box[3]))
+    annotated_image, processed_boxes = _detection_raw(image, objects, box_threshold, text_threshold)
+    output_image = AnnotatedImage(annotated_image, image)
         
     # Apply post-processing (transparent to LLM)
     from post_processors import apply_postprocess
@@ -188,6 +287,7 @@ def detection(image, objects, box_threshold:float = 0.35, text_threshold:float =
 
 
 
+@span("depth")
 def depth(image):
     """Depth estimation using DepthAnything model. It returns the depth map of the input image. 
     A colormap is used to represent the depth. It uses Inferno colormap. The closer the object, the warmer the color.
@@ -207,18 +307,69 @@ def depth(image):
     """
     print("[VSP_TOOL_USED] depth")
     
-    if not VISION_TOOLS_AVAILABLE or da_client is None:
-        raise RuntimeError("Vision tools are not available. This function requires vision expert services.")
-    
-    with tempfile.NamedTemporaryFile(delete=True) as tmp_file:
-        image.save(tmp_file.name, 'JPEG')
-        image = tmp_file.name
-        outputs = da_client.predict(_wrap_file(image))
-    output_image = Image.open(outputs)
+    output_image, _ = _depth_raw(image)
     
     return output_image
 
 
+@span("segment_masks")
+def segment_masks(image, granularity:float = 1.8):
+    """The pixel masks of the segments that segment_and_mark numbers, for exact areas, overlaps or pixel colors of a segment.
+
+    Args:
+        image (PIL.Image.Image): the input image
+        granularity (float, optional): the same granularity as in segment_and_mark. Defaults to 1.8.
+
+    Returns:
+        masks (List[np.ndarray]): one boolean (height, width) array per segment, at the size of the input image.
+            masks[0] is the segment labeled 1 by segment_and_mark with the same granularity.
+
+    Example:
+        output_image, bboxes = segment_and_mark(image)
+        masks = segment_masks(image)
+        print(masks[4].mean()) # the fraction of the image covered by segment 5
+    """
+    print("[VSP_TOOL_USED] segment_masks")
+    from expert_codec import decode_region_mask
+
+    # the masks come run-length encoded, at the size the segmentation model worked at
+    _, _, regions = _segment_and_mark_raw(image, granularity, response_mode="rle")
+    masks = []
+    for region in regions:
+        mask = decode_region_mask(region)
+        if mask is None:
+            raise RuntimeError(f"The segmentation server returned a region without a mask: {region}")
+        if mask.shape != (image.height, image.width):
+            mask = np.array(Image.fromarray(mask).resize(image.size, Image.NEAREST))
+        masks.append(mask)
+    return masks
+
+
+@span("depth_values")
+def depth_values(image):
+    """The relative depth of every pixel as numbers, for comparing depths exactly instead of reading colors off the depth map.
+
+    Args:
+        image (PIL.Image.Image): the input image
+
+    Returns:
+        depth (np.ndarray): a float32 (height, width) array at the size of the input image. Larger values are
+            closer to the camera. The values are relative (inverse depth), not meters.
+
+    Example:
+        values = depth_values(image)
+        print(values[120, 300] > values[80, 40]) # True if pixel (x=300, y=120) is closer than pixel (x=40, y=80)
+    """
+    print("[VSP_TOOL_USED] depth_values")
+    from expert_codec import decode_depth
+
+    _, depth_data = _depth_raw(image, response_mode="float16")
+    values = decode_depth(depth_data)
+    if values is None:
+        raise RuntimeError("The depth server did not return the raw depth (it may predate response_mode).")
+    return values.astype(np.float32)
+
+
 def crop_image(image, x:float, y:float, width:float, height:float):
     """Crop the image based on the normalized coordinates.
     Return the cropped image.
@@ -277,6 +428,42 @@ def zoom_in_image_by_bbox(image, box, padding=0.05):
     return crop_image(image, x, y, w, h)
         
 
+def _detect_tiles(image, objects, tiles, box_threshold=0.35, text_threshold=0.25):
+    # run detection on all the tiles of one image in a single request to the detection backend.
+    # Returns the per tile results, or None if the backend can't batch tiles.
+    # The tiles with detections have the server's "annotated_image".
+    def run(backend):
+        tile_results = backend.detect_tiles(image, objects, tiles, box_threshold, text_threshold)
+        if tile_results is None:
+            return [], None
+        # the annotated tiles are cached as images, the rest as data
+        images, data = [], []
+        for result in tile_results:
+            result = dict(result)
+            annotated_image = result.pop("annotated_image", None)
+            if annotated_image is not None:
+                result["image_index"] = len(images)
+                images.append(annotated_image)
+            data.append(result)
+        return images, data
+    
+    try:
+        images, tile_results = _run_backend("detect_tiles", image, run, objects=list(objects), tiles=tiles,
+                                            box_threshold=box_threshold, text_threshold=text_threshold)
+    except NotImplementedError:
+        return None
+    except VisionToolsUnavailableError:
+        # no vision tools, let detection() report it. Server failures are raised.
+        return None
+    if tile_results is None:
+        return None
+    for result in tile_results:
+        if "image_index" in result:
+            result["annotated_image"] = images[result.pop("image_index")]
+    return tile_results
+
+
+@span("sliding_window_detection")
 def sliding_window_detection(image: Image.Image, objects):
     """Deal with the case when the user query is asking about objects that are not seen by the model.
     In that case, the most common reason is that the object is too small such that both the vision-language model and the object detection model fail to detect it.
@@ -305,11 +492,6 @@ def sliding_window_detection(image: Image.Image, objects):
         print(possible_boxes[0]) # [[0.24, 0.21, 0.3, 0.4], [0.6, 0.3, 0.2, 0.3]]
     """
     
-    def check_if_box_margin(box, margin=0.005):
-        x_margin = min(box[0], 1-box[0]-box[2])
-        y_margin = min(box[1], 1-box[1]-box[3])
-        return x_margin < margin or y_margin < margin
-    
     # # first try to detect the object
     # annotated_img, detection_boxes = detection(image, text)
     
@@ -319,26 +501,39 @@ def sliding_window_detection(image: Image.Image, objects):
     # if not detected, do sliding window search
     box_width = 1/3
     box_height = 1/3
+    tiles = [[float(x), float(y), box_width, box_height]
+             for x in np.arange(0, 7/9, 2/9) for y in np.arange(0, 7/9, 2/9)]
 
     possible_patches = []
     possible_boxes = []
     
-    for x in np.arange(0, 7/9, 2/9):
-        for y in np.arange(0, 7/9, 2/9):
-            cropped_img = crop_image(image, x, y, box_width, box_height)
-            annotated_img, detection_boxes= detection(cropped_img, objects)
-            
-            # if one of the boxes is not too close to the edge, save it
-            margin_flag = True
-            for box in detection_boxes:
-                if not check_if_box_margin(box):
-                    margin_flag = False
-                    break
-            
-            # if the object is detected and the box is not too close to the edge
-            if len(detection_boxes) != 0 and not margin_flag:
-                possible_patches.append(annotated_img)
-                possible_boxes.append(detection_boxes)
+    # one request for all the tiles. Servers without /detect_tiles get one detection call per tile.
+    tile_results = _detect_tiles(image, objects, tiles)
+    
+    for tile_idx, (x, y, w, h) in enumerate(tiles):
+        cropped_img = crop_image(image, x, y, w, h)
+        if tile_results is None:
+            annotated_img, detection_boxes = detection(cropped_img, objects)
+        else:
+            result = tile_results[tile_idx]
+            detection_boxes = Boxes(result["boxes"], format="cxcywh")
+            annotated_img = result.get("annotated_image")
+        
+        # if one of the boxes is not too close to the edge, save it
+        margin_flag = bool(detection_boxes.near_margin(margin=0.005).all())
+        
+        # if the object is detected and the box is not too close to the edge
+        if len(detection_boxes) != 0 and not margin_flag:
+            if tile_results is not None:
+                if annotated_img is None:
+                    # a server that doesn't annotate the tiles: detect the kept tile again to get its image
+                    annotated_img, detection_boxes = detection(cropped_img, objects)
+                else:
+                    # the tile as the server annotated it, like detection() returns it
+                    from post_processors import apply_postprocess
+                    annotated_img = apply_postprocess(AnnotatedImage(annotated_img, cropped_img), detection_boxes, "detection")
+            possible_patches.append(annotated_img)
+            possible_boxes.append(detection_boxes)
 
     return possible_patches, possible_boxes
 
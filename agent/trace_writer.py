@@ -0,0 +1,155 @@
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from image_encoding import image_content_hash
+
+TRACE_NAME = "trace.jsonl"
+TRACE_IMAGE_DIR = "trace_images"
+
+
+class TraceWriter:
+    """Append-only JSONL trace of one conversation, written while it happens.
+
+    Every message is written as one record as soon as it enters the chat history, so a crash
+    loses at most the message in flight. Images are not inlined: each one is saved once under
+    trace_images/<content hash>.png and referenced by its path relative to the task directory.
+
+    Record types: "start", "message", "error", "end". A file may hold several runs of the same
+    instance; readers use the records after the last "start".
+    """
+
+    def __init__(self, task_directory: str, **start_fields):
+        self.task_directory = task_directory
+        self.path = os.path.join(task_directory, TRACE_NAME)
+        os.makedirs(os.path.join(task_directory, TRACE_IMAGE_DIR), exist_ok=True)
+        self._file = open(self.path, "a", buffering=1)
+        self._saved_images = set()
+        self._seq = 0
+        self.write_event("start", **start_fields)
+
+    def _write(self, record: Dict):
+        if self._file is None:
+            return
+        record["seq"] = self._seq
+        record["time"] = round(time.time(), 3)
+        self._seq += 1
+        self._file.write(json.dumps(record, default=str) + "\n")
+
+    def _store_image(self, image: Image.Image) -> str:
+        key = image_content_hash(image)
+        rel_path = os.path.join(TRACE_IMAGE_DIR, f"{key}.png")
+        if key not in self._saved_images:
+            abs_path = os.path.join(self.task_directory, rel_path)
+            if not os.path.exists(abs_path):
+                image.save(abs_path, format="PNG")
+            self._saved_images.add(key)
+        return rel_path
+
+    def _serialize_content(self, content):
+        if not isinstance(content, list):
+            return content
+        items = []
+        for item in content:
+            if isinstance(item, dict) and "image_url" in item and isinstance(item["image_url"].get("url"), Image.Image):
+                item = {"type": "image_url", "image_url": {"path": self._store_image(item["image_url"]["url"])}}
+            items.append(item)
+        return items
+
+    def write_message(self, message: Dict, **fields):
+        message = dict(message)
+        if "content" in message:
+            message["content"] = self._serialize_content(message["content"])
+        self._write({"type": "message", "message": message, **fields})
+
+    def write_event(self, type: str, **fields):
+        self._write({"type": type, **fields})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_trace(task_directory: str) -> List[Dict]:
+    """Return the records of the last run in the trace of a task directory."""
+    records = []
+    with open(os.path.join(task_directory, TRACE_NAME)) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # a line cut by a crash
+                continue
+            if record.get("type") == "start":
+                records = []
+            records.append(record)
+    return records
+
+
+def trace_is_complete(task_directory: str) -> bool:
+    """True if the last run in the trace reached its "end" record."""
+    if not os.path.exists(os.path.join(task_directory, TRACE_NAME)):
+        return False
+    records = read_trace(task_directory)
+    return len(records) > 0 and records[-1].get("type") == "end"
+
+
+def trace_outcome(task_directory: str) -> Optional[str]:
+    """"done" or "failed" (the conversation raised and an "error" record was written) for a
+    complete trace, None if there is no trace or the last run did not finish."""
+    if not os.path.exists(os.path.join(task_directory, TRACE_NAME)):
+        return None
+    records = read_trace(task_directory)
+    if not records or records[-1].get("type") != "end":
+        return None
+    return "failed" if any(record.get("type") == "error" for record in records) else "done"
+
+
+def load_messages(task_directory: str, inline_images: bool = True):
+    """Rebuild the message list of the last run, in the format of the old output.json.
+
+    Images are inlined as base64 PNG (as utils.custom_encoder did) or, with inline_images=False,
+    loaded as PIL images. If the run failed, {'error': ...} is returned, as run_agent used to save.
+    """
+    from utils import image_to_base64
+
+    messages = []
+    for record in read_trace(task_directory):
+        if record["type"] == "error":
+            return {"error": record.get("error")}
+        if record["type"] != "message":
+            continue
+        message = record["message"]
+        if isinstance(message.get("content"), list):
+            content = []
+            for item in message["content"]:
+                if isinstance(item, dict) and "path" in item.get("image_url", {}):
+                    image = Image.open(os.path.join(task_directory, item["image_url"]["path"]))
+                    image.load()
+                    item = {"type": "image_url", "image_url": {"url": image_to_base64(image) if inline_images else image}}
+                content.append(item)
+            message = dict(message, content=content)
+        messages.append(message)
+    return messages
+
+
+def rebuild_output_json(task_directory: str, output_path: Optional[str] = None) -> str:
+    """Write the old-style output.json of a task directory from its trace. Returns the path written."""
+    output_path = output_path or os.path.join(task_directory, "output.json")
+    with open(output_path, "w") as f:
+        json.dump(load_messages(task_directory), f, indent=4)
+    return output_path
+
+
+if __name__ == "__main__":
+    # python trace_writer.py <task directory> [<task directory> ...]
+    for task_directory in sys.argv[1:]:
+        print(rebuild_output_json(task_directory))
@@ -3,6 +3,7 @@ import cv2
 import numpy as np
 import os
 import io
+import sys
 import base64
 from PIL import Image
 import torch
@@ -12,6 +13,13 @@ from torchvision.transforms import Compose
 from depth_anything.dpt import DepthAnything
 from depth_anything.util.transform import Resize, NormalizeImage, PrepareForNet
 
+# vision_experts/batching.py, fast_api.py, response_codec.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batching import MicroBatcher
+from fast_api import open_image, png_bytes, serve
+from response_codec import depth_float16
+from result_cache import cached, ResultCache
+
 
 transform = Compose([
         Resize(
@@ -30,6 +38,17 @@ transform = Compose([
 DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
 model = DepthAnything.from_pretrained('LiheYoung/depth_anything_vitl14').to(DEVICE).eval()
 
+# Requests are handled by WORKERS threads: preprocessing and the colormap / PNG encoding of different
+# requests overlap, only the model forward runs one at a time (in the scheduler's worker thread).
+# Images arriving within MAX_WAIT_MS of each other whose resized shapes match share a forward pass of
+# at most MAX_BATCH_SIZE images; DEPTH_MAX_BATCH_SIZE=1 runs every image on its own.
+WORKERS = int(os.environ.get("DEPTH_WORKERS", "8"))
+MAX_BATCH_SIZE = int(os.environ.get("DEPTH_MAX_BATCH_SIZE", "4"))
+MAX_WAIT_MS = float(os.environ.get("DEPTH_MAX_WAIT_MS", "5"))
+
+# depth maps by image pixels (see vision_experts/result_cache.py)
+result_cache = ResultCache.from_env("depth_anything")
+
 
 def _image_to_base64(img: np.ndarray) -> str:
     """Convert numpy array image to PNG base64 string (without data: prefix)"""
@@ -41,26 +60,53 @@ def _image_to_base64(img: np.ndarray) -> str:
     return base64.b64encode(buf.getvalue()).decode("ascii")
 
 
-def predict_depthmap(image):
-    original_image = image.copy()
+# response_mode -> what depth_data carries besides the size and the depth range
+#   full:    the normalized grayscale and the colored depth maps as PNG base64 (the default, for old clients)
+#   colored: nothing else, the colored visualization is already the image output
+#   float16: the raw model depth as little-endian float16, row-major (height, width), base64
+RESPONSE_MODES = ["full", "colored", "float16"]
 
-    h, w = image.shape[:2]
 
+def preprocess(image: np.ndarray) -> torch.Tensor:
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) / 255.0
-    image = transform({'image': image})['image']
-    image = torch.from_numpy(image).unsqueeze(0).to(DEVICE)
-    
-    with torch.no_grad():
-        depth = model(image)
-    depth = F.interpolate(depth[None], (h, w), mode='bilinear', align_corners=False)[0, 0]
+    return torch.from_numpy(transform({'image': image})['image'])
+
+
+def infer_batch(requests):
+    """Depth maps at the original size (float32, on the CPU) for a list of (preprocessed image, (h, w)).
+    Images with the same resized shape share a forward pass."""
+    groups = {}
+    for i, (image, _) in enumerate(requests):
+        groups.setdefault(tuple(image.shape), []).append(i)
+
+    results = [None] * len(requests)
+    for indices in groups.values():
+        batch = torch.stack([requests[i][0] for i in indices]).to(DEVICE)
+        with torch.no_grad():
+            depths = model(batch)
+        for i, depth in zip(indices, depths):
+            h, w = requests[i][1]
+            depth = F.interpolate(depth[None, None], (h, w), mode='bilinear', align_corners=False)[0, 0]
+            results[i] = depth.cpu().numpy()
+    return results
+
+
+# the only caller of the model
+scheduler = MicroBatcher(infer_batch, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, name="depth_anything")
+
+
+def predict_depthmap(image, response_mode="full", binary=False):
+    h, w = image.shape[:2]
+
+    depth = cached(result_cache, image, lambda: scheduler.submit((preprocess(image), (h, w))),
+                   model="depth_anything_vitl14")
     
     # Store min/max before normalization for metadata
     depth_min = float(depth.min())
     depth_max = float(depth.max())
     
-    depth = (depth - depth.min()) / (depth.max() - depth.min()) * 255.0
-    depth = depth.cpu().numpy().astype(np.uint8)
-    colored_depth = cv2.applyColorMap(depth, cv2.COLORMAP_INFERNO)[:, :, ::-1]
+    normalized = ((depth - depth_min) / (depth_max - depth_min) * 255.0).astype(np.uint8)
+    colored_depth = cv2.applyColorMap(normalized, cv2.COLORMAP_INFERNO)[:, :, ::-1]
     
     # Convert to PIL for Gradio display
     colored_depth_pil = Image.fromarray(colored_depth)
@@ -71,16 +117,34 @@ def predict_depthmap(image):
         "width": int(w),
         "depth_min": depth_min,
         "depth_max": depth_max,
-        "depth_map_grayscale_base64": _image_to_base64(depth),  # Raw normalized depth
-        "depth_map_colored_base64": _image_to_base64(colored_depth),  # Colored visualization
     }
+    if response_mode == "float16" and binary:
+        depth_data["depth_float16"] = depth_float16(depth)
+    elif response_mode == "float16":
+        depth_data["depth_float16_base64"] = base64.b64encode(depth_float16(depth)).decode("ascii")
+    elif response_mode != "colored":
+        depth_data["depth_map_grayscale_base64"] = _image_to_base64(normalized)  # Raw normalized depth
+        depth_data["depth_map_colored_base64"] = _image_to_base64(colored_depth)  # Colored visualization
     
     return colored_depth_pil, depth_data
 
 
+def fast_depth(request):
+    # request: {"image": bytes, "response_mode"} -> {"image": PNG bytes, "data": depth_data}
+    # the float16 depth is sent as raw bytes, depth_data["depth_float16"], instead of base64
+    image = np.asarray(open_image(request["image"]))
+    response_mode = request.get("response_mode", "full")
+    if response_mode not in RESPONSE_MODES:
+        response_mode = "full"
+    depth_image, depth_data = predict_depthmap(image, response_mode, binary=True)
+    return {"image": png_bytes(depth_image), "data": depth_data}
+
+
 demo = gr.Interface(fn=predict_depthmap, 
                     inputs=[
-                        gr.Image(label="image")
+                        gr.Image(label="image"),
+                        # what the client needs besides the colored map, old clients get "full"
+                        gr.Radio(RESPONSE_MODES, value="full", label="response_mode")
                     ],
                     outputs=[
                         gr.Image(type="pil", label="depth_map_visualization"),
@@ -88,22 +152,10 @@ demo = gr.Interface(fn=predict_depthmap,
                     ]
                     )
 
-# Force serial processing to prevent state corruption from concurrent requests
-# This prevents tensor dimension mismatches caused by thread-unsafe model operations
-# Multiple requests can queue up, but only 1 will be processed at a time
+# Handlers run concurrently, the model is protected by the scheduler above
 demo.queue(
-    concurrency_count=1    # KEY: Process only 1 request at a time (prevents state corruption)
-    # Note: In Gradio 3.x, use concurrency_count; in Gradio 4.x, use default_concurrency_limit
+    default_concurrency_limit=WORKERS
 )
                     
-demo.launch(
-    share=True, 
-    server_name="0.0.0.0", 
-    server_port=7861, 
-    show_api=True
-    # Note: max_threads defaults to 40, which is fine
-    # The key protection is default_concurrency_limit=1 above
-)
-
-
-
+# the UI and gradio API at /, the binary API at /v1/depth (see vision_experts/fast_api.py)
+serve(demo, {"depth": fast_depth}, port=7861)
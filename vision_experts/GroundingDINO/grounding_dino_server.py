@@ -1,58 +1,41 @@
-from groundingdino.util.inference import load_model, load_image, predict, annotate
-import cv2
+import os
+import sys
+from groundingdino.util.inference import load_model, preprocess_caption
+from groundingdino.util.misc import nested_tensor_from_tensor_list
+from groundingdino.util.utils import get_phrases_from_posmap
+import groundingdino.datasets.transforms as T
+import base64
+import io
+import json
 import torch
-import numpy as np
-import supervision as sv
 from PIL import Image
 from typing import List
-from torchvision.ops import box_convert
 import gradio as gr
 
-model = load_model("groundingdino/config/GroundingDINO_SwinT_OGC.py", "weights/groundingdino_swint_ogc.pth")
+# vision_experts/annotation.py, batching.py, fast_api.py, result_cache.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from annotation import annotate_image
+from batching import MicroBatcher
+from fast_api import png_bytes, serve
+from result_cache import ResultCache
 
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
-def annotate(image_source: np.ndarray, boxes: torch.Tensor, logits: torch.Tensor, phrases: List[str]) -> np.ndarray:
-    """    
-    This function annotates an image with bounding boxes and labels.
+# requests arriving within MAX_WAIT_MS of each other run as one batch of at most MAX_BATCH_SIZE images
+MAX_BATCH_SIZE = int(os.environ.get("GD_MAX_BATCH_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("GD_MAX_WAIT_MS", "5"))
 
-    Parameters:
-    image_source (np.ndarray): The source image to be annotated.
-    boxes (torch.Tensor): A tensor containing bounding box coordinates.
-    logits (torch.Tensor): A tensor containing confidence scores for each bounding box.
-    phrases (List[str]): A list of labels for each bounding box.
+model = load_model("groundingdino/config/GroundingDINO_SwinT_OGC.py", "weights/groundingdino_swint_ogc.pth",
+                   device=DEVICE).to(DEVICE)
 
-    Returns:
-    np.ndarray: The annotated image.
-    """
-    h, w, _ = image_source.shape
-    boxes = boxes * torch.Tensor([w, h, w, h])
-    xyxy = box_convert(boxes=boxes, in_fmt="cxcywh", out_fmt="xyxy").numpy()
-    detections = sv.Detections(xyxy=xyxy)
-
-    labels = [
-        f"{phrase} {logit}"
-        for phrase, logit
-        in zip(phrases, logits)
-    ]
-
-    bbox_annotator = sv.BoxAnnotator(color_lookup=sv.ColorLookup.INDEX)
-    label_annotator = sv.LabelAnnotator(color_lookup=sv.ColorLookup.INDEX)
-    annotated_frame = cv2.cvtColor(image_source, cv2.COLOR_RGB2BGR)
-    annotated_frame = bbox_annotator.annotate(scene=annotated_frame, detections=detections)
-    annotated_frame = label_annotator.annotate(scene=annotated_frame, detections=detections, labels=labels)
-    return annotated_frame
+# predictions by image pixels, caption and thresholds (see vision_experts/result_cache.py)
+result_cache = ResultCache.from_env("groundingdino")
 
 
 def detection(image, text, box_threshold=0.35, text_threshold=0.25):
     
-    image_source, image = load_image(image)
-    boxes, logits, phrases = predict(
-        model=model,
-        image=image,
-        caption=text,
-        box_threshold=box_threshold,
-        text_threshold=text_threshold
-    )
+    image_source = Image.open(image).convert("RGB")
+    boxes, logits, phrases = predict_cached([image_source], text, box_threshold, text_threshold)[0]
     
     ret_json = {
         "boxes": boxes.tolist(),
@@ -60,14 +43,141 @@ def detection(image, text, box_threshold=0.35, text_threshold=0.25):
         "phrases": phrases
     }
     
-    annotated_frame = annotate(image_source=image_source, boxes=boxes, logits=range(1, len(boxes)+1), phrases=phrases)
-    
-    annotated_pil_image = Image.fromarray(cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB))
+    annotated_pil_image = annotate_image(image_source, boxes, phrases)
     
     return annotated_pil_image, ret_json
 
 
-demo = gr.Interface(fn=detection, 
+transform = T.Compose(
+    [
+        T.RandomResize([800], max_size=1333),
+        T.ToTensor(),
+        T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ]
+)
+
+
+def predict_requests(requests):
+    """Same as groundingdino's predict, for a list of (image tensor, caption, box_threshold, text_threshold)
+    in a single forward pass. Images of different sizes are padded and masked, captions are padded to the longest."""
+    images = [image for image, _, _, _ in requests]
+    captions = [preprocess_caption(caption=caption) for _, caption, _, _ in requests]
+
+    samples = nested_tensor_from_tensor_list(images).to(DEVICE)
+
+    with torch.no_grad():
+        outputs = model(samples, captions=captions)
+
+    tokenizer = model.tokenizer
+
+    results = []
+    for i, (caption, (_, _, box_threshold, text_threshold)) in enumerate(zip(captions, requests)):
+        tokenized = tokenizer(caption)
+        prediction_logits = outputs["pred_logits"][i].cpu().sigmoid()  # (nq, 256)
+        prediction_boxes = outputs["pred_boxes"][i].cpu()  # (nq, 4)
+
+        mask = prediction_logits.max(dim=1)[0] > box_threshold
+        logits = prediction_logits[mask]
+        boxes = prediction_boxes[mask]
+        phrases = [
+            get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer).replace('.', '')
+            for logit
+            in logits
+        ]
+        results.append((boxes, logits.max(dim=1)[0], phrases))
+    return results
+
+
+# the only caller of the model: concurrent requests (and the tiles of a request) are batched together
+scheduler = MicroBatcher(predict_requests, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, name="groundingdino")
+
+
+def predict_cached(images: List[Image.Image], text, box_threshold, text_threshold):
+    """(boxes, logits, phrases) for each image, from the result cache, the misses in one scheduler submission.
+    An image another request is already predicting waits for that prediction instead of running again."""
+    params = {"model": "groundingdino_swint_ogc", "caption": text,
+              "box_threshold": box_threshold, "text_threshold": text_threshold}
+
+    def predict(indices):
+        predictions = scheduler.submit_many([(transform(images[i], None)[0], text, box_threshold, text_threshold)
+                                             for i in indices])
+        return [(boxes.numpy(), logits.numpy(), phrases) for boxes, logits, phrases in predictions]
+
+    if result_cache is None:
+        results = predict(range(len(images)))
+    else:
+        results = result_cache.get_or_compute_many([ResultCache.make_key(image, **params) for image in images], predict)
+    return [(torch.from_numpy(boxes), torch.from_numpy(logits), phrases) for boxes, logits, phrases in results]
+
+
+def crop_tile(image_source: Image.Image, tile):
+    # crop a normalized [x, y, w, h] tile, clamped to the image like tools.crop_image does
+    x, y, w, h = tile
+    width, height = image_source.size
+    x = min(max(0, x), 1)
+    y = min(max(0, y), 1)
+    x2 = min(max(0, x + w), 1)
+    y2 = min(max(0, y + h), 1)
+    return image_source.crop((x * width, y * height, x2 * width, y2 * height)), [x, y, x2 - x, y2 - y]
+
+
+def detect_tiles(image, text, tiles, box_threshold=0.35, text_threshold=0.25, binary=False):
+    """Detect objects in several tiles of one image, cropped on the server and run as one batch.
+
+    Args:
+        image: path of the image
+        text: the objects to detect, e.g. "bus, red car"
+        tiles: JSON list of normalized [x, y, w, h] tiles
+        binary: return the annotated tiles as PNG bytes (binary API) instead of base64
+    
+    Returns:
+        {"tiles": [...]}, for each tile: the clamped tile, the boxes (cx, cy, w, h) normalized to the tile,
+        the same boxes normalized to the whole image, the logits and the phrases. The tiles with
+        detections also have the cropped tile annotated like detection's image, in "image_png_base64"
+        ("image_png" with binary).
+    """
+    image_source = Image.open(image).convert("RGB")
+    if isinstance(tiles, str):
+        tiles = json.loads(tiles)
+
+    crops = [crop_tile(image_source, tile) for tile in tiles]
+    predictions = predict_cached([crop for crop, _ in crops], text, box_threshold, text_threshold)
+
+    results = []
+    for (crop, tile), (boxes, logits, phrases) in zip(crops, predictions):
+        tx, ty, tw, th = tile
+        result = {
+            "tile": tile,
+            "boxes": boxes.tolist(),
+            "boxes_global": [[tx + cx * tw, ty + cy * th, bw * tw, bh * th] for cx, cy, bw, bh in boxes.tolist()],
+            "logits": logits.tolist(),
+            "phrases": phrases,
+        }
+        if len(boxes):
+            annotated_png = png_bytes(annotate_image(crop, boxes, phrases))
+            if binary:
+                result["image_png"] = annotated_png
+            else:
+                result["image_png_base64"] = base64.b64encode(annotated_png).decode("ascii")
+        results.append(result)
+    return {"tiles": results}
+
+
+def fast_detection(request):
+    # request: {"image": bytes, "text", "box_threshold", "text_threshold"} -> {"image": PNG bytes, "data": detection_results}
+    annotated_image, data = detection(io.BytesIO(request["image"]), request["text"],
+                                      request.get("box_threshold", 0.35), request.get("text_threshold", 0.25))
+    return {"image": png_bytes(annotated_image), "data": data}
+
+
+def fast_detect_tiles(request):
+    # request: {"image": bytes, "text", "tiles": [[x, y, w, h], ...], "box_threshold", "text_threshold"} -> {"data": tile_results}
+    # the annotated tiles are sent as raw PNG bytes, tile_results["tiles"][i]["image_png"], instead of base64
+    return {"data": detect_tiles(io.BytesIO(request["image"]), request["text"], request["tiles"],
+                                 request.get("box_threshold", 0.35), request.get("text_threshold", 0.25), binary=True)}
+
+
+detection_demo = gr.Interface(fn=detection, 
                     inputs=[
                         gr.Image(type="filepath", label="image"),
                         gr.Text(label="text"),
@@ -77,22 +187,31 @@ demo = gr.Interface(fn=detection,
                     outputs=[
                         gr.Image(type="pil", label="annotated_image"), 
                         gr.JSON(label="detection_results")
-                    ]
+                    ],
+                    api_name="predict"
+                    )
+
+tiles_demo = gr.Interface(fn=detect_tiles,
+                    inputs=[
+                        gr.Image(type="filepath", label="image"),
+                        gr.Text(label="text"),
+                        gr.Text(label="tiles"),
+                        gr.Number(value=0.35, label="box_threshold"),
+                        gr.Number(value=0.25, label="text_threshold")
+                    ],
+                    outputs=gr.JSON(label="tile_results"),
+                    api_name="detect_tiles"
                     )
 
-# Force serial processing to prevent state corruption from concurrent requests
-# This prevents tensor dimension mismatches caused by thread-unsafe model operations
-# Multiple requests can queue up, but only 1 will be processed at a time
+# /predict runs one detection, /detect_tiles a batch of tiles of one image
+demo = gr.TabbedInterface([detection_demo, tiles_demo], ["detection", "detect_tiles"])
+
+# The model is only run by the scheduler's worker thread, so handlers can run concurrently: while one
+# batch is on the GPU, other requests decode their images, queue for the next batch or draw their results.
+# Allow enough concurrent handlers to fill a batch (tiles requests submit several images each).
 demo.queue(
-    concurrency_count=1    # KEY: Process only 1 request at a time (prevents state corruption)
-    # Note: In Gradio 3.x, use concurrency_count; in Gradio 4.x, use default_concurrency_limit
-)
-                    
-demo.launch(
-    share=True, 
-    server_name="0.0.0.0", 
-    server_port=7860, 
-    show_api=True
-    # Note: max_threads defaults to 40, which is fine
-    # The key protection is default_concurrency_limit=1 above
+    default_concurrency_limit=2 * MAX_BATCH_SIZE
 )
+
+# the UI and gradio API at /, the binary API at /v1/detection and /v1/detect_tiles (see vision_experts/fast_api.py)
+serve(demo, {"detection": fast_detection, "detect_tiles": fast_detect_tiles}, port=7860)
@@ -0,0 +1,48 @@
+"""The drawing of GroundingDINO detections, shared by the detection server and the agent's local
+detection backend (agent/tool_backends/local.py), so an annotated image looks the same whichever ran the model.
+"""
+from typing import List
+
+import cv2
+import numpy as np
+import supervision as sv
+from PIL import Image
+
+
+def annotate(image_source: np.ndarray, boxes, logits, phrases: List[str]) -> np.ndarray:
+    """
+    This function annotates an image with bounding boxes and labels.
+
+    Parameters:
+    image_source (np.ndarray): The source image to be annotated.
+    boxes: The normalized (cx, cy, w, h) bounding box coordinates, a tensor, an array or a list.
+    logits: The confidence scores, or any label, for each bounding box.
+    phrases (List[str]): A list of labels for each bounding box.
+
+    Returns:
+    np.ndarray: The annotated image, in BGR.
+    """
+    h, w, _ = image_source.shape
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * np.array([w, h, w, h], dtype=np.float32)
+    xyxy = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+    detections = sv.Detections(xyxy=xyxy)
+
+    labels = [
+        f"{phrase} {logit}"
+        for phrase, logit
+        in zip(phrases, logits)
+    ]
+
+    bbox_annotator = sv.BoxAnnotator(color_lookup=sv.ColorLookup.INDEX)
+    label_annotator = sv.LabelAnnotator(color_lookup=sv.ColorLookup.INDEX)
+    annotated_frame = cv2.cvtColor(image_source, cv2.COLOR_RGB2BGR)
+    annotated_frame = bbox_annotator.annotate(scene=annotated_frame, detections=detections)
+    annotated_frame = label_annotator.annotate(scene=annotated_frame, detections=detections, labels=labels)
+    return annotated_frame
+
+
+def annotate_image(image: Image.Image, boxes, phrases: List[str]) -> Image.Image:
+    """The image returned by detection: each box labeled with its phrase and its index, starting at 1."""
+    annotated_frame = annotate(image_source=np.asarray(image.convert("RGB")), boxes=boxes,
+                               logits=range(1, len(boxes) + 1), phrases=phrases)
+    return Image.fromarray(cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB))
@@ -0,0 +1,96 @@
+"""Dynamic micro-batching for the vision expert servers.
+
+The gradio handlers of a server run concurrently and hand their model inputs to a MicroBatcher.
+One worker thread collects the inputs that arrive within `max_wait_ms` of the first one (up to
+`max_batch_size`), runs them through the model in a single forward pass and hands each handler its
+own result. If a batch fails, its items are retried one at a time, so a bad input only fails its own
+request. Only the worker touches the model, so forwards never overlap, while decoding, drawing
+and JSON work of other requests go on in the handler threads.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """Run `process_batch(items) -> results` (one result per item, in order) on batches of concurrent requests.
+
+    Args:
+        process_batch: the batched model call.
+        max_batch_size (int): the largest batch sent to the model.
+        max_wait_ms (float): how long the first request of a batch waits for others to join it.
+        name (str): for messages and the worker thread.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]], max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.stats = {"batches": 0, "items": 0, "max_batch_size": 0, "split_batches": 0}
+        self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+        self._worker.start()
+
+    def submit_async(self, item) -> Future:
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def submit(self, item):
+        """Run one item and wait for its result."""
+        return self.submit_async(item).result()
+
+    def submit_many(self, items: List[Any]) -> List[Any]:
+        """Run several items of one request; they are batched with each other and with other requests."""
+        futures = [self.submit_async(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, items):
+        results = self.process_batch(items)
+        if len(results) != len(items):
+            raise RuntimeError(f"{self.name}: {len(results)} results for a batch of {len(items)}")
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self._process(items)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    # one bad input (e.g. an image the model can't take) must not fail the requests batched with it:
+                    # run the items one by one, so only the failing ones get the error
+                    print(f"[MICRO_BATCHER] {self.name}: batch of {len(batch)} failed ({e}), retrying the items one by one")
+                    with self._stats_lock:
+                        self.stats["split_batches"] += 1
+                    for item, future in batch:
+                        try:
+                            future.set_result(self._process([item])[0])
+                        except Exception as item_error:
+                            future.set_exception(item_error)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["items"] += len(batch)
+                self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
@@ -0,0 +1,89 @@
+"""Lean HTTP routes for the vision experts, served next to their gradio UI.
+
+A gradio_client call goes through the gradio queue: an upload, a join request, an event stream to
+poll and a download of every output file. Each expert server also registers its handlers here:
+    POST /v1/<name>          one request
+    POST /v1/<name>/batch    {"items": [request, ...]}, run concurrently so they share the expert's batches
+Bodies are wire.py messages: images are sent as encoded image files and returned as PNG bytes,
+with no base64 and no temp files. uvicorn keeps the connections alive between requests.
+
+A handler takes the request document and returns the response document. It runs in a worker
+thread, so it can block on the expert's scheduler or GPU lock like the gradio handlers do.
+"""
+import asyncio
+import io
+import os
+from typing import Any, Callable, Dict
+
+import numpy as np
+from PIL import Image
+
+import wire
+
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def open_image(data: bytes) -> Image.Image:
+    """An RGB image from an encoded image file, as gradio's image input would give it."""
+    image = Image.open(io.BytesIO(data))
+    return image.convert("RGB")
+
+
+def png_bytes(image) -> bytes:
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image.astype(np.uint8) if image.dtype != np.uint8 else image)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def create_app(handlers: Dict[str, Handler]):
+    from fastapi import FastAPI, Request, Response
+    from starlette.concurrency import run_in_threadpool
+
+    app = FastAPI()
+
+    def add_routes(name: str, handler: Handler):
+        async def run_one(request: Request):
+            try:
+                document = wire.unpack(await request.body())
+            except Exception as e:
+                return Response(f"Bad request: {e}", status_code=400)
+            try:
+                result = await run_in_threadpool(handler, document)
+            except Exception as e:
+                return Response(f"{type(e).__name__}: {e}", status_code=500)
+            return Response(wire.pack(result), media_type=wire.MEDIA_TYPE)
+
+        async def run_batch(request: Request):
+            try:
+                items = wire.unpack(await request.body())["items"]
+            except Exception as e:
+                return Response(f"Bad request: {e}", status_code=400)
+            results = await asyncio.gather(*[run_in_threadpool(handler, item) for item in items],
+                                           return_exceptions=True)
+            # a failed item does not fail the others
+            results = [{"error": f"{type(result).__name__}: {result}"} if isinstance(result, Exception) else result
+                       for result in results]
+            return Response(wire.pack({"items": results}), media_type=wire.MEDIA_TYPE)
+
+        app.add_api_route(f"/v1/{name}", run_one, methods=["POST"])
+        app.add_api_route(f"/v1/{name}/batch", run_batch, methods=["POST"])
+
+    for name, handler in handlers.items():
+        add_routes(name, handler)
+    return app
+
+
+def serve(demo, handlers: Dict[str, Handler], port: int):
+    """Serve the gradio demo at / and the handlers at /v1/ on one port.
+    EXPERT_FAST_API=0 launches the gradio demo alone, with a public share link, as before."""
+    if os.environ.get("EXPERT_FAST_API", "1") == "0":
+        demo.launch(share=True, server_name="0.0.0.0", server_port=port, show_api=True)
+        return
+
+    import gradio as gr
+    import uvicorn
+
+    app = gr.mount_gradio_app(create_app(handlers), demo, path="/")
+    uvicorn.run(app, host="0.0.0.0", port=port, timeout_keep_alive=75)
@@ -0,0 +1,25 @@
+"""Encoders of the compact response modes of the SoM and depth servers.
+
+The agent decodes them with agent/expert_codec.py (decode_rle, decode_depth); the two files are the
+two ends of one format, and test_expert_codec.py checks that they round-trip.
+"""
+from typing import Any, Dict
+
+import numpy as np
+
+
+def mask_rle(bin_mask: np.ndarray) -> Dict[str, Any]:
+    """COCO-style uncompressed RLE of a mask: the column-major pixels as run lengths, starting with a run of zeros."""
+    pixels = (bin_mask > 0).ravel(order="F")
+    if pixels.size == 0:
+        return {"size": [int(bin_mask.shape[0]), int(bin_mask.shape[1])], "counts": []}
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], changes, [pixels.size]])).tolist()
+    if pixels[0]:
+        counts = [0] + counts
+    return {"size": [int(bin_mask.shape[0]), int(bin_mask.shape[1])], "counts": counts}
+
+
+def depth_float16(depth: np.ndarray) -> bytes:
+    """The raw depth as little-endian float16, row-major (height, width)."""
+    return np.asarray(depth).astype("<f2").tobytes()
@@ -0,0 +1,183 @@
+"""Cache of model results in the vision expert servers.
+
+The same benchmark images reach the servers again and again, across runs, agents and users. Each
+server caches the output of its model pass (before drawing and encoding), keyed by the hash of the
+decoded pixels and the parameters that change the model output, so a repeated call costs a lookup.
+
+There are two tiers: an in-memory LRU bounded by `max_memory_mb` (the size of the arrays it holds),
+and an optional on-disk tier (diskcache, least recently used eviction) that survives restarts.
+Cached values are shared between requests: callers must not modify them.
+
+Settings, from the environment:
+    EXPERT_CACHE=0               turn the cache off
+    EXPERT_CACHE_MEMORY_MB       size of the memory tier (default 1024)
+    EXPERT_CACHE_DIR             directory of the disk tier, one subdirectory per expert (default: no disk tier)
+    EXPERT_CACHE_DISK_MB         size of the disk tier (default 8192)
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+
+def image_hash(image) -> str:
+    """Content hash of a decoded image (PIL image or array): the same pixels give the same hash."""
+    array = np.ascontiguousarray(np.asarray(image))
+    digest = hashlib.sha256()
+    digest.update(f"{array.shape}{array.dtype}".encode())
+    digest.update(array.data)
+    return digest.hexdigest()
+
+
+def _sizeof(value: Any) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_sizeof(item) for item in value.values()) + 64
+    if isinstance(value, (list, tuple)):
+        return sum(_sizeof(item) for item in value) + 64
+    return 64
+
+
+class ResultCache:
+    """Model results by key, in a memory LRU and an optional disk tier.
+
+    Args:
+        name (str): the expert, for messages and the disk subdirectory.
+        max_memory_mb (float): bound of the memory tier.
+        directory (str, optional): directory of the disk tier, None for memory only.
+        max_disk_mb (float): bound of the disk tier.
+    """
+
+    def __init__(self, name: str, max_memory_mb: float = 1024, directory: Optional[str] = None,
+                 max_disk_mb: float = 8192):
+        self.name = name
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._disk = None
+        if directory:
+            import diskcache
+            self._disk = diskcache.Cache(os.path.join(directory, name), size_limit=int(max_disk_mb * 1024 * 1024),
+                                         eviction_policy="least-recently-used")
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @classmethod
+    def from_env(cls, name: str) -> Optional["ResultCache"]:
+        """The cache configured by the EXPERT_CACHE* variables, None if it is turned off."""
+        if os.environ.get("EXPERT_CACHE", "1") == "0":
+            return None
+        cache = cls(name, max_memory_mb=float(os.environ.get("EXPERT_CACHE_MEMORY_MB", "1024")),
+                    directory=os.environ.get("EXPERT_CACHE_DIR") or None,
+                    max_disk_mb=float(os.environ.get("EXPERT_CACHE_DISK_MB", "8192")))
+        print(f"[RESULT_CACHE] {name}: {cache.max_memory_bytes // (1024 * 1024)} MB in memory"
+              + (f", disk tier in {cache._disk.directory}" if cache._disk is not None else ""))
+        return cache
+
+    @staticmethod
+    def make_key(image, **params) -> str:
+        payload = json.dumps({"image": image_hash(image), "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _remember(self, key: str, value):
+        size = _sizeof(value)
+        if size > self.max_memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted
+
+    def get(self, key: str):
+        """The cached value of `key`, or None on a miss."""
+        value = self._lookup(key)
+        if value is None:
+            with self._lock:
+                self.stats["misses"] += 1
+        return value
+
+    def _lookup(self, key: str):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[0]
+
+        if self._disk is not None:
+            value = self._disk.get(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.stats["disk_hits"] += 1
+                return value
+        return None
+
+    def put(self, key: str, value):
+        self._remember(key, value)
+        if self._disk is not None:
+            self._disk.set(key, value)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]):
+        """The cached value of `key`, computing and caching it on a miss.
+        Concurrent requests for the same key wait for the first one instead of running the model again."""
+        return self.get_or_compute_many([key], lambda indices: [compute()])[0]
+
+    def get_or_compute_many(self, keys: List[str], compute_many: Callable[[List[int]], List[Any]]) -> List[Any]:
+        """The cached values of several keys. The misses that no other request is computing are computed
+        together by `compute_many(indices)` (one value per index, in order), e.g. in one batch of the model;
+        the keys already in flight wait for the request computing them."""
+        results = [None] * len(keys)
+        pending = list(range(len(keys)))
+        while pending:
+            owned, waiting = [], []
+            for i in pending:
+                value = self._lookup(keys[i])
+                if value is not None:
+                    results[i] = value
+                    continue
+                with self._lock:
+                    event = self._inflight.get(keys[i])
+                    if event is None:
+                        event = self._inflight[keys[i]] = threading.Event()
+                        self.stats["misses"] += 1
+                        owned.append((i, event))
+                    else:
+                        waiting.append((i, event))
+            if owned:
+                try:
+                    values = compute_many([i for i, _ in owned])
+                    for (i, _), value in zip(owned, values):
+                        self.put(keys[i], value)
+                        results[i] = value
+                finally:
+                    with self._lock:
+                        for i, _ in owned:
+                            self._inflight.pop(keys[i], None)
+                    for _, event in owned:
+                        event.set()
+            # our own keys are done, so a key repeated in `keys` doesn't wait on itself.
+            # If the request computing a key failed, the next round computes it here.
+            for _, event in waiting:
+                event.wait()
+            pending = [i for i, _ in waiting]
+        return results
+
+
+def cached(cache: Optional[ResultCache], key_image, compute: Callable[[], Any], **params):
+    """compute() through `cache` (None: no cache), keyed by the pixels of `key_image` and `params`."""
+    if cache is None:
+        return compute()
+    return cache.get_or_compute(ResultCache.make_key(key_image, **params), compute)
@@ -19,6 +19,13 @@ from automatic_mask_generator import SemanticSamAutomaticMaskGenerator
 metadata = MetadataCatalog.get('coco_2017_train_panoptic')
 
 def inference_semsam_m2m_auto(model, image, level, all_classes, all_parts, thresh, text_size, hole_scale, island_scale, semantic, refimg=None, reftxt=None, audio_pth=None, video_pth=None, label_mode='1', alpha=0.1, anno_mode=['Mask']):
+    image_ori, sorted_anns = generate_masks_semsam_m2m_auto(model, image, level, text_size)
+    im = render_masks(image_ori, sorted_anns, label_mode=label_mode, alpha=alpha, anno_mode=anno_mode)
+    return im, sorted_anns
+
+
+def generate_masks_semsam_m2m_auto(model, image, level, text_size):
+    """The GPU part of inference_semsam_m2m_auto: the resized image and its masks, largest first."""
     t = []
     t.append(transforms.Resize(int(text_size), interpolation=Image.BICUBIC))
     transform1 = transforms.Compose(t)
@@ -35,34 +42,24 @@ def inference_semsam_m2m_auto(model, image, level, all_classes, all_parts, thres
         )
     outputs = mask_generator.generate(images)
 
-    from visualizer import Visualizer
-    visual = Visualizer(image_ori, metadata=metadata)
     sorted_anns = sorted(outputs, key=(lambda x: x['area']), reverse=True)
-    label = 1
-    # for ann in sorted_anns:
-    #     mask = ann['segmentation']
-    #     color_mask = np.random.random((1, 3)).tolist()[0]
-    #     # color_mask = [int(c*255) for c in color_mask]
-    #     demo = visual.draw_binary_mask_with_number(mask, text=str(label), label_mode=label_mode, alpha=alpha, anno_mode=anno_mode)
-    #     label += 1
-    # im = demo.get_image()
+    return image_ori, sorted_anns
 
-    mask_map = np.zeros(image_ori.shape, dtype=np.uint8)    
-    for i, ann in enumerate(sorted_anns):
+
+def render_masks(image_ori, sorted_anns, label_mode='1', alpha=0.1, anno_mode=['Mask']):
+    """The CPU part of inference_semsam_m2m_auto: draw the numbered masks on the resized image."""
+    visual = Visualizer(image_ori, metadata=metadata)
+    demo = visual.output
+    for label, ann in enumerate(sorted_anns, start=1):
         mask = ann['segmentation']
-        color_mask = np.random.random((1, 3)).tolist()[0]
-        # color_mask = [int(c*255) for c in color_mask]
         demo = visual.draw_binary_mask_with_number(mask, text=str(label), label_mode=label_mode, alpha=alpha, anno_mode=anno_mode)
-        # assign the mask to the mask_map
-        mask_map[mask == 1] = label
-        label += 1
     im = demo.get_image()    
     # fig=plt.figure(figsize=(10, 10))
     # plt.imshow(image_ori)
     # show_anns(outputs)
     # fig.canvas.draw()
     # im=Image.frombytes('RGB', fig.canvas.get_width_height(), fig.canvas.tostring_rgb())
-    return im, sorted_anns
+    return im
 
 
 def remove_small_regions(
@@ -1,7 +1,11 @@
 # som_server.py
 import io
+import os
 import base64
 import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 
 import numpy as np
@@ -13,9 +17,15 @@ import torch
 from semantic_sam.BaseModel import BaseModel
 from semantic_sam import build_model
 from semantic_sam.utils.arguments import load_opt_from_config_file
-from inference_semsam_m2m_auto import inference_semsam_m2m_auto
+from inference_semsam_m2m_auto import generate_masks_semsam_m2m_auto, render_masks
 # ===================================
 
+# vision_experts/fast_api.py, response_codec.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fast_api import open_image, png_bytes, serve
+from response_codec import mask_rle
+from result_cache import cached, ResultCache
+
 # --------- 配置与模型加载 ----------
 semsam_cfg = "semantic_sam_only_sa-1b_swinL.yaml"
 semsam_ckpt = "swinl_only_sam_many2many.pth"
@@ -23,6 +33,16 @@ opt_semsam = load_opt_from_config_file(semsam_cfg)
 
 # 构建与加载权重（需要 GPU）
 model_semsam = BaseModel(opt_semsam, build_model(opt_semsam)).from_pretrained(semsam_ckpt).eval().cuda()
+
+# 流水线：mask 生成持有 GPU 锁，一次只跑一个请求；画图和 region 编码交给 CPU 线程池，
+# 这样上一个请求在画图时，下一个请求已经可以开始跑 GPU
+gpu_lock = threading.Lock()
+RENDER_WORKERS = int(os.environ.get("SOM_RENDER_WORKERS", "4"))
+render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="som-render")
+
+# 缓存 mask 生成的结果，key 为图像像素 + level（见 vision_experts/result_cache.py）；
+# 画图参数（alpha、label_mode、anno_mode）不同的请求也能共用
+result_cache = ResultCache.from_env("semantic_sam")
 # ----------------------------------
 
 
@@ -76,7 +96,20 @@ def _png_base64(mask_uint8_2d_or_3d: np.ndarray) -> str:
     pil.save(buf, format="PNG")
     return base64.b64encode(buf.getvalue()).decode("ascii")
 
-def _build_regions_from_mask(mask_obj: Any) -> List[Dict[str, Any]]:
+# response_mode -> 每个区域附带的 mask 编码
+#   full:   PNG base64（默认，兼容旧客户端）
+#   rle:    非压缩 RLE，比 PNG 编码快得多、也更小
+#   bboxes: 不返回 mask，只有 bbox/area 等元数据
+RESPONSE_MODES = ["full", "bboxes", "rle"]
+
+def _mask_fields(bin_u8: np.ndarray, response_mode: str) -> Dict[str, Any]:
+    if response_mode == "bboxes":
+        return {}
+    if response_mode == "rle":
+        return {"mask_rle": mask_rle(bin_u8)}
+    return {"mask_png_base64": _png_base64(bin_u8)}
+
+def _build_regions_from_mask(mask_obj: Any, response_mode: str = "full") -> List[Dict[str, Any]]:
     """
     将推理返回的 mask 转成“每个编号区域”的列表。
     兼容几种常见形式：
@@ -102,7 +135,7 @@ def _build_regions_from_mask(mask_obj: Any) -> List[Dict[str, Any]]:
                 "score": (float(item["score"]) if "score" in item else None),
                 "area": area,
                 "bbox": bbox,  # [x,y,w,h]
-                "mask_png_base64": _png_base64(bin_u8),
+                **_mask_fields(bin_u8, response_mode),
                 "height": int(bin_u8.shape[0]),
                 "width": int(bin_u8.shape[1]),
             })
@@ -121,7 +154,7 @@ def _build_regions_from_mask(mask_obj: Any) -> List[Dict[str, Any]]:
                 "score": None,
                 "area": area,
                 "bbox": bbox,
-                "mask_png_base64": _png_base64(bin_u8),
+                **_mask_fields(bin_u8, response_mode),
                 "height": int(bin_u8.shape[0]),
                 "width": int(bin_u8.shape[1]),
             })
@@ -137,59 +170,73 @@ def _build_regions_from_mask(mask_obj: Any) -> List[Dict[str, Any]]:
             "score": None,
             "area": area,
             "bbox": bbox,
-            "mask_png_base64": _png_base64(bin_u8),
+            **_mask_fields(bin_u8, response_mode),
             "height": int(bin_u8.shape[0]),
             "width": int(bin_u8.shape[1]),
         }]
 
     # 4) torch.Tensor：转 numpy 后重用逻辑
     if torch.is_tensor(mask_obj):
-        return _build_regions_from_mask(mask_obj.detach().cpu().numpy())
+        return _build_regions_from_mask(mask_obj.detach().cpu().numpy(), response_mode)
 
     # 兜底：未知类型
     return [{"warning": f"unsupported mask type: {type(mask_obj).__name__}"}]
 # -------------- 工具函数到此 --------------
 
 
-@torch.no_grad()
-def inference(image: Image.Image, slider: float, alpha: float, label_mode: str, anno_mode: List[str], *args, **kwargs):
-    """封装一次推理，返回 (可视化图, 原始mask对象)"""
-    _image = image.convert("RGB")
-
-    # slider -> level（沿用你原始的阈值逻辑）
+def _level(slider: float) -> List[int]:
+    """slider -> level（沿用你原始的阈值逻辑）"""
     if slider < 1.5 + 0.14:
-        level = [1]
+        return [1]
     elif slider < 1.5 + 0.28:
-        level = [2]
+        return [2]
     elif slider < 1.5 + 0.42:
-        level = [3]
+        return [3]
     elif slider < 1.5 + 0.56:
-        level = [4]
+        return [4]
     elif slider < 1.5 + 0.70:
-        level = [5]
+        return [5]
     elif slider < 1.5 + 0.84:
-        level = [6]
-    else:
-        level = [6, 1, 2, 3, 4, 5]
+        return [6]
+    return [6, 1, 2, 3, 4, 5]
+
+
+@torch.no_grad()
+def generate_masks(image: Image.Image, slider: float):
+    """GPU 阶段：返回 (缩放后的图, 按面积降序的 masks)，持有 gpu_lock；命中缓存时不占用 GPU"""
+    _image = image.convert("RGB")
+    text_size = 640
+    level = _level(slider)
 
+    def compute():
+        with gpu_lock, torch.autocast(device_type='cuda', dtype=torch.float16):
+            return generate_masks_semsam_m2m_auto(model_semsam, _image, level, text_size)
+
+    return cached(result_cache, _image, compute, model=semsam_ckpt, level=level, text_size=text_size)
+
+
+def render(image_ori: np.ndarray, masks, alpha: float, label_mode: str, anno_mode: List[str], response_mode: str):
+    """CPU 阶段：画编号 mask，并把 masks 转成结构化 regions"""
     label_mode = 'a' if label_mode == 'Alphabet' else '1'
+    output = render_masks(image_ori, masks, label_mode=label_mode, alpha=alpha, anno_mode=anno_mode)
+
+    # 关键：将 masks 转为“每个编号区域”的结构化列表
+    try:
+        regions = _build_regions_from_mask(masks, response_mode)
+    except Exception as e:
+        regions = [{"error": f"{type(e).__name__}: {e}"}]
 
-    text_size, hole_scale, island_scale = 640, 100, 100
-    text, text_part, text_thresh = '', '', '0.0'
+    return _to_pil(output), regions
 
-    with torch.autocast(device_type='cuda', dtype=torch.float16):
-        output, mask = inference_semsam_m2m_auto(
-            model_semsam, _image, level, text, text_part, text_thresh,
-            text_size, hole_scale, island_scale, False,
-            label_mode=label_mode, alpha=alpha, anno_mode=anno_mode,
-            *args, **kwargs
-        )
 
-    # output 统一成 PIL，mask 原样返回给上层做结构化转换
-    return _to_pil(output), mask
+def inference(image: Image.Image, slider: float, alpha: float, label_mode: str, anno_mode: List[str], response_mode: str = "full"):
+    """封装一次推理，返回 (可视化图, regions)"""
+    image_ori, masks = generate_masks(image, slider)
+    # GPU 锁已释放，下一个请求可以开始生成 mask
+    return render_pool.submit(render, image_ori, masks, alpha, label_mode, anno_mode, response_mode).result()
 
 
-def gradio_interface(image, slider, alpha, label_mode, anno_mode):
+def gradio_interface(image, slider, alpha, label_mode, anno_mode, response_mode="full"):
     # Handle None values with defaults (important for API calls)
     if slider is None:
         slider = 1.8
@@ -199,16 +246,19 @@ def gradio_interface(image, slider, alpha, label_mode, anno_mode):
         label_mode = "Number"
     if anno_mode is None:
         anno_mode = ["Mask", "Mark"]
+    if response_mode not in RESPONSE_MODES:
+        response_mode = "full"
     
-    vis_img, raw_mask = inference(image, slider, alpha, label_mode, anno_mode)
+    return inference(image, slider, alpha, label_mode, anno_mode, response_mode)
 
-    # 关键：将 raw_mask 转为“每个编号区域”的结构化列表
-    try:
-        regions = _build_regions_from_mask(raw_mask)
-    except Exception as e:
-        regions = [{"error": f"{type(e).__name__}: {e}"}]
 
-    return vis_img, regions
+def fast_segment_and_mark(request):
+    # request: {"image": bytes, "slider", "alpha", "label_mode", "anno_mode", "response_mode"}
+    #   -> {"image": PNG bytes, "data": regions}
+    vis_img, regions = gradio_interface(open_image(request["image"]), request.get("slider"), request.get("alpha"),
+                                        request.get("label_mode"), request.get("anno_mode"),
+                                        request.get("response_mode", "full"))
+    return {"image": png_bytes(vis_img), "data": regions}
 
 
 # ----------------- Gradio 接口 -----------------
@@ -220,6 +270,8 @@ demo = gr.Interface(
         gr.Number(value=0.1, label="alpha"),
         gr.Radio(["Number", "Alphabet"], value="Number", label="label_mode"),
         gr.CheckboxGroup(["Mask", "Box", "Mark"], value=["Mask", "Mark"], label="anno_mode"),
+        # 客户端按需选择 mask 的返回形式，旧客户端不传时为 full
+        gr.Radio(RESPONSE_MODES, value="full", label="response_mode"),
     ],
     outputs=[
         gr.Image(type="pil", label="segmentation"),
@@ -231,21 +283,13 @@ demo = gr.Interface(
     cache_examples=False,
 )
 
-# Force serial processing to prevent state corruption from concurrent requests
-# This prevents tensor dimension mismatches caused by thread-unsafe model operations
-# Multiple requests can queue up, but only 1 will be processed at a time
+# GPU 阶段由 gpu_lock 串行化，画图由 render_pool 限流；
+# 允许的并发请求数要足够让一个请求跑 GPU 的同时，其他请求在画图
 demo.queue(
-    concurrency_count=1    # KEY: Process only 1 request at a time (prevents state corruption)
-    # Note: In Gradio 3.x, use concurrency_count; in Gradio 4.x, use default_concurrency_limit
+    default_concurrency_limit=RENDER_WORKERS + 1
 )
 
-# 在服务器上建议 0.0.0.0；需要公网临时链接就把 share=True
-demo.launch(
-    share=True, 
-    server_name="0.0.0.0", 
-    server_port=7862
-    # Note: max_threads defaults to 40, which is fine
-    # The key protection is default_concurrency_limit=1 above
-)
+# 界面和 gradio API 在 /，二进制 API 在 /v1/segment_and_mark（见 vision_experts/fast_api.py）
+# EXPERT_FAST_API=0 时和以前一样只启动 gradio，并带公网 share 链接
+serve(demo, {"segment_and_mark": fast_segment_and_mark}, port=7862)
 # ------------------------------------------------
-
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Test script for the drawing of the detections, shared by the detection server and the local backend.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from PIL import Image
+
+
+def test_annotate_image():
+    """Boxes are drawn where the normalized (cx, cy, w, h) boxes are, whatever container they come in."""
+    print("=" * 60)
+    print("Testing annotate_image")
+    print("=" * 60)
+
+    from annotation import annotate, annotate_image
+
+    image = Image.new("RGB", (200, 100), (255, 255, 255))
+    boxes = [[0.5, 0.5, 0.5, 0.5], [0.2, 0.8, 0.1, 0.2]]
+
+    print("\n[Test 1] Boxes on the image...")
+    annotated = annotate_image(image, boxes, ["cat", "dog"])
+    assert annotated.size == image.size and annotated.mode == "RGB"
+    array = np.asarray(annotated)
+    # the first box spans x 50..150, y 25..75: its left edge is drawn, its center is not
+    assert (array[50, 50] != 255).any() and (array[50, 100] == 255).all()
+    assert np.asarray(image).min() == 255  # the input is not drawn on
+    print("✅ box edges drawn, inside and input unchanged")
+
+    print("\n[Test 2] Containers and no detections...")
+    assert annotate_image(image, np.asarray(boxes), ["cat", "dog"]).tobytes() == annotated.tobytes()
+    assert annotate_image(image, [], []).tobytes() == image.tobytes()
+    bgr = annotate(np.asarray(image), boxes, [1, 2], ["cat", "dog"])
+    assert (bgr[:, :, ::-1] == array).all()
+    print("✅ lists and arrays give the same image, annotate returns BGR")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_annotate_image()
+    sys.exit(0 if success else 1)
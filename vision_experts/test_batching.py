@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Test script for the micro-batching of concurrent requests to a vision expert.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_micro_batcher():
+    """Concurrent items are batched, each gets its own result, and a bad item only fails itself."""
+    print("=" * 60)
+    print("Testing MicroBatcher")
+    print("=" * 60)
+
+    from batching import MicroBatcher
+
+    batches = []
+    batches_lock = threading.Lock()
+
+    def double(items):
+        with batches_lock:
+            batches.append(list(items))
+        if any(item < 0 for item in items):
+            raise ValueError("negative input")
+        time.sleep(0.01)
+        return [2 * item for item in items]
+
+    print("\n[Test 1] Concurrent requests share a forward pass...")
+    batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=50, name="double")
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(batcher.submit, range(8)))
+    assert results == [2 * i for i in range(8)]
+    assert max(len(batch) for batch in batches) > 1 and all(len(batch) <= 4 for batch in batches)
+    assert batcher.stats["items"] == 8 and batcher.stats["max_batch_size"] <= 4
+    assert batcher.submit_many([1, 2, 3]) == [2, 4, 6]
+    print(f"✅ 8 requests in {batcher.stats['batches'] - 1} batches, results in order")
+
+    print("\n[Test 2] A failing item is retried alone, the rest of its batch succeeds...")
+    batches.clear()
+    futures = [batcher.submit_async(item) for item in (1, -1, 3)]
+    assert futures[0].result() == 2 and futures[2].result() == 6
+    try:
+        futures[1].result()
+        assert False, "the negative item should fail"
+    except ValueError:
+        pass
+    assert batches[0] == [1, -1, 3] and [1] in batches and [-1] in batches and [3] in batches
+    assert batcher.stats["split_batches"] == 1
+    print("✅ only the bad item gets the error")
+
+    print("\n[Test 3] A wrong number of results fails the batch...")
+    broken = MicroBatcher(lambda items: items[:1], max_batch_size=4, max_wait_ms=50, name="broken")
+    futures = [broken.submit_async(item) for item in (1, 2)]
+    # alone, each item gets its result back
+    assert [future.result() for future in futures] == [1, 2]
+    assert broken.stats["split_batches"] == 1
+    print("✅ the batch is split and retried")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_micro_batcher()
+    sys.exit(0 if success else 1)
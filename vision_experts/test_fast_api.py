@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test script for the binary message format and the HTTP routes of the vision experts.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import io
+
+from PIL import Image
+
+
+def test_wire():
+    """pack / unpack round-trip documents with binary parts at any depth."""
+    print("=" * 60)
+    print("Testing wire")
+    print("=" * 60)
+
+    import wire
+
+    print("\n[Test 1] Round trips...")
+    documents = [
+        {},
+        {"text": "cat, dog", "box_threshold": 0.35, "tiles": [[0, 0, 0.5, 0.5]], "none": None},
+        {"image": b"\x89PNG\x00\x01", "data": {"depth_float16": bytearray(b"\x00\x3c" * 4), "height": 2}},
+        {"items": [{"image": b""}, {"image": memoryview(b"abc"), "nested": [b"x", [b"y", {"z": b"z"}]]}]},
+        [b"a", "b", 1],
+    ]
+
+    def as_bytes(value):
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        if isinstance(value, dict):
+            return {key: as_bytes(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [as_bytes(item) for item in value]
+        return value
+
+    for document in documents:
+        assert wire.unpack(wire.pack(document)) == as_bytes(document)
+    restored = wire.unpack(wire.pack(documents[3]))
+    assert restored["items"][1]["image"] == b"abc" and restored["items"][1]["nested"] == [b"x", [b"y", {"z": b"z"}]]
+    assert restored["items"][0]["image"] == b"" and type(restored["items"][0]["image"]) is bytes
+    assert wire.unpack(wire.pack(documents[1])) == documents[1]
+    print("✅ bytes, bytearray and memoryview come back as bytes, everything else unchanged")
+
+    print("\n[Test 2] Malformed messages...")
+    message = wire.pack(documents[2])
+    for bad in (b"", message[:3], message[:-1], message + b"extra"):
+        try:
+            wire.unpack(bad)
+            assert False, "unpack should fail"
+        except ValueError:
+            pass
+    print("✅ truncated and padded messages are rejected")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+def test_routes():
+    """/v1/<name> runs one request, /v1/<name>/batch runs several and isolates the failed ones."""
+    print("=" * 60)
+    print("Testing fast_api routes")
+    print("=" * 60)
+
+    from fastapi.testclient import TestClient
+
+    import wire
+    from fast_api import create_app, open_image, png_bytes
+
+    def flip(request):
+        if request.get("fail"):
+            raise ValueError("bad input")
+        image = open_image(request["image"]).transpose(Image.FLIP_LEFT_RIGHT)
+        return {"image": png_bytes(image), "data": {"size": list(image.size), "label": request.get("label")}}
+
+    client = TestClient(create_app({"flip": flip}))
+    image = Image.new("RGB", (4, 3), (10, 20, 30))
+    image.putpixel((0, 0), (255, 0, 0))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    request = {"image": buffer.getvalue(), "label": "x"}
+
+    def post(path, document):
+        return client.post(path, content=wire.pack(document), headers={"Content-Type": wire.MEDIA_TYPE})
+
+    print("\n[Test 1] One request...")
+    response = post("/v1/flip", request)
+    assert response.status_code == 200 and response.headers["content-type"] == wire.MEDIA_TYPE
+    result = wire.unpack(response.content)
+    assert result["data"] == {"size": [4, 3], "label": "x"}
+    assert Image.open(io.BytesIO(result["image"])).getpixel((3, 0)) == (255, 0, 0)
+    print("✅ the handler's document, with the PNG as a binary part")
+
+    print("\n[Test 2] Errors...")
+    assert post("/v1/flip", dict(request, fail=True)).status_code == 500
+    assert client.post("/v1/flip", content=b"not a message").status_code == 400
+    assert post("/v1/unknown", request).status_code == 404
+    assert client.get("/v1/flip").status_code == 405
+    print("✅ 500 for a failed handler, 400 for a bad body, 404 / 405 for other routes")
+
+    print("\n[Test 3] Batches...")
+    response = post("/v1/flip/batch", {"items": [request, dict(request, fail=True), dict(request, label="y")]})
+    assert response.status_code == 200
+    items = wire.unpack(response.content)["items"]
+    assert [item.get("data", {}).get("label") for item in items] == ["x", None, "y"]
+    assert items[1] == {"error": "ValueError: bad input"}
+    assert post("/v1/flip/batch", {"not_items": []}).status_code == 400
+    assert wire.unpack(post("/v1/flip/batch", {"items": []}).content) == {"items": []}
+    print("✅ results in order, a failed item does not fail the others")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_wire() and test_routes()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Test script for the cache of model results in the vision expert servers.
+"""
+
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+
+def test_result_cache():
+    """Keys follow the pixels, both tiers serve hits, and concurrent misses run the model once."""
+    print("=" * 60)
+    print("Testing ResultCache")
+    print("=" * 60)
+
+    from result_cache import ResultCache, cached, image_hash
+
+    print("\n[Test 1] Keys...")
+    image = Image.new("RGB", (8, 6), (1, 2, 3))
+    assert image_hash(image) == image_hash(np.asarray(image)) == image_hash(image.copy())
+    assert image_hash(image) != image_hash(Image.new("RGB", (8, 6), (1, 2, 4)))
+    assert image_hash(image) != image_hash(Image.new("RGB", (6, 8), (1, 2, 3)))
+    key = ResultCache.make_key(image, caption="cat", box_threshold=0.35)
+    assert key == ResultCache.make_key(image.copy(), box_threshold=0.35, caption="cat")
+    assert key != ResultCache.make_key(image, caption="cat", box_threshold=0.3)
+    print("✅ same pixels and parameters give the same key")
+
+    print("\n[Test 2] Memory tier bounded by size, least recently used evicted...")
+    cache = ResultCache("test", max_memory_mb=3 / 1024)  # 3 KB
+    for name in ("a", "b", "c"):
+        cache.put(name, np.zeros(1000, dtype=np.uint8))
+    assert cache.get("a") is not None  # a is now the most recently used
+    cache.put("d", np.zeros(1000, dtype=np.uint8))
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("d") is not None
+    cache.put("huge", np.zeros(10_000, dtype=np.uint8))
+    assert cache.get("huge") is None and cache._memory_bytes <= cache.max_memory_bytes
+    assert cache.stats["memory_hits"] == 3 and cache.stats["misses"] == 2
+    print("✅ evicted b, kept a, skipped a value larger than the tier")
+
+    print("\n[Test 3] Disk tier survives a restart...")
+    directory = tempfile.mkdtemp()
+    cache = ResultCache("test", directory=directory)
+    value = (np.arange(4.0), np.ones(2), ["cat", "dog"])
+    cache.put(key, value)
+    restarted = ResultCache("test", directory=directory)
+    hit = restarted.get(key)
+    assert np.array_equal(hit[0], value[0]) and hit[2] == ["cat", "dog"]
+    assert restarted.stats["disk_hits"] == 1
+    assert restarted.get(key) is not None and restarted.stats["memory_hits"] == 1
+    print("✅ read from disk, then from memory")
+
+    print("\n[Test 4] Concurrent identical requests compute once...")
+    cache = ResultCache("test")
+    calls = []
+
+    def slow_model():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: cache.get_or_compute("k", slow_model), range(8)))
+    assert results == ["result"] * 8 and len(calls) == 1 and cache.stats["misses"] == 1
+    assert cached(None, image, lambda: "uncached", caption="cat") == "uncached"
+    assert cached(cache, image, lambda: "first", caption="cat") == "first"
+    assert cached(cache, image, lambda: "second", caption="cat") == "first"
+    print("✅ one model call for 8 requests")
+
+    print("\n[Test 5] Batched misses and keys in flight...")
+    cache = ResultCache("test")
+    cache.put("hit", "cached")
+    batches = []
+    started = threading.Event()
+
+    def compute_many(keys):
+        def compute(indices):
+            batches.append([keys[i] for i in indices])
+            started.set()
+            time.sleep(0.1)
+            return [f"value of {keys[i]}" for i in indices]
+        return compute
+
+    first = ["x", "y", "hit"]
+    second = ["y", "z", "z"]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first_result = pool.submit(cache.get_or_compute_many, first, compute_many(first))
+        started.wait()
+        second_result = pool.submit(cache.get_or_compute_many, second, compute_many(second))
+        assert first_result.result() == ["value of x", "value of y", "cached"]
+        assert second_result.result() == ["value of y", "value of z", "value of z"]
+    assert batches == [["x", "y"], ["z"]], batches
+    print("✅ misses computed in one batch, y waited for the first request, z computed once")
+
+    print("\n[Test 6] A failed computation is retried by the waiting request...")
+    cache = ResultCache("test")
+    started.clear()
+
+    def failing(indices):
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("CUDA out of memory")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        failed = pool.submit(cache.get_or_compute, "k", lambda: failing([0]))
+        started.wait()
+        waiting = pool.submit(cache.get_or_compute, "k", lambda: "recomputed")
+        try:
+            failed.result()
+            assert False, "the first request should fail"
+        except RuntimeError:
+            pass
+        assert waiting.result() == "recomputed"
+    assert not cache._inflight
+    print("✅ the error goes to its request only")
+
+    print("\n" + "=" * 60)
+    print("✅ All tests passed!")
+    print("=" * 60)
+    return True
+
+
+if __name__ == "__main__":
+    success = test_result_cache()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,55 @@
+"""The binary message format of the experts' HTTP routes (see fast_api.py), shared with the agent's client.
+
+A message is a JSON document whose bytes values (images, raw arrays) travel as binary parts instead of base64:
+    4 bytes            the length of the header, big-endian
+    header             UTF-8 JSON: {"body": the document with each bytes value replaced by {"$part": i},
+                                    "parts": [the length of part i, ...]}
+    parts              back to back
+"""
+import json
+import struct
+from typing import Any, List
+
+MEDIA_TYPE = "application/x-vsp-expert"
+
+
+def _extract(value: Any, parts: List[bytes]) -> Any:
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        parts.append(bytes(value))
+        return {"$part": len(parts) - 1}
+    if isinstance(value, dict):
+        return {key: _extract(item, parts) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_extract(item, parts) for item in value]
+    return value
+
+
+def _restore(value: Any, parts: List[bytes]) -> Any:
+    if isinstance(value, dict):
+        if len(value) == 1 and "$part" in value:
+            return parts[value["$part"]]
+        return {key: _restore(item, parts) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_restore(item, parts) for item in value]
+    return value
+
+
+def pack(document: Any) -> bytes:
+    parts: List[bytes] = []
+    body = _extract(document, parts)
+    header = json.dumps({"body": body, "parts": [len(part) for part in parts]}).encode("utf-8")
+    return b"".join([struct.pack(">I", len(header)), header, *parts])
+
+
+def unpack(message: bytes) -> Any:
+    if len(message) < 4:
+        raise ValueError("Truncated message")
+    (header_length,) = struct.unpack(">I", message[:4])
+    header = json.loads(message[4:4 + header_length].decode("utf-8"))
+    parts, offset = [], 4 + header_length
+    for length in header["parts"]:
+        parts.append(message[offset:offset + length])
+        offset += length
+    if offset != len(message):
+        raise ValueError(f"Message length {len(message)} does not match its parts ({offset})")
+    return _restore(header["body"], parts)